@@ -538,11 +538,13 @@ var State = function(Y, gui, instance)
         {
           i.obj.value = val.result.map(function(e) {
             return hash(val.desc.columns, e); });
+          i.obj.version = null;
           _complete(i);
         }
         else if (val.result)
         {
           i.obj.value = val.result;
+          i.obj.version = null;
           _complete(i);
         }
         else
@@ -566,6 +568,72 @@ var State = function(Y, gui, instance)
     }
   };
 
+  /** Handle successfully retrieved bundle of several state items. Only
+      items still waiting for this bundle are updated; items whose version
+      did not change on the server keep their current value. */
+  var _bundleSuccess = function(id, o, i)
+  {
+    var hash = Y.Array.hash;
+
+    try
+    {
+      var ctype = o.getResponseHeader("Content-Type");
+      if (o.status == 304)
+      {
+        Y.each(i.names, function(name) {
+          if (_pending[name] === i.xhr)
+            _complete({ obj: _data[name], name: name });
+        });
+      }
+      else if (o.status != 200)
+      {
+        _error("(state)", 0, "bad-status", "Internal error retrieving '"
+               + Y.Escape.html(i.name)
+               + "': success handler called with status code " + o.status
+               + " != 200 ('" + Y.Escape.html(o.statusText) + "')");
+      }
+      else if (ctype != "application/json")
+      {
+        _error("(state)", 0, "bad-ctype", "Internal error retrieving '"
+               + Y.Escape.html(i.name)
+               + "': expected 'application/json' reply, got '"
+               + Y.Escape.html(ctype) + "'");
+      }
+      else
+      {
+        var val = Y.JSON.parse(o.responseText);
+        if (val.result)
+        {
+          Y.each(val.result, function(r) {
+            var obj = _data[r.item];
+            if (! obj || _pending[r.item] !== i.xhr)
+              return;
+
+            if (r.changed && r.columns)
+              obj.value = r.result.map(function(e) { return hash(r.columns, e); });
+            else if (r.changed)
+              obj.value = r.result;
+            obj.version = r.version;
+            _complete({ obj: obj, name: r.item });
+          });
+        }
+        else
+        {
+          _error("(state)", 0, "bad-json", "Internal error retrieving '"
+                 + Y.Escape.html(i.name) + "': failed to parse json result");
+        }
+      }
+    }
+    catch (err)
+    {
+      var fileName = (err.fileName ? err.fileName.replace(/.*\//, "") : "(unknown)");
+      var lineNumber = (err.lineNumber ? err.lineNumber : 0);
+      _error(fileName, lineNumber, "exception", "An exception '"
+             + Y.Escape.html(err.name) + "' was raised during page update: "
+             + Y.Escape.html(err.message));
+    }
+  };
+
   /** Handle failure to retrieve data from the server. */
   var _failure = function(id, o, i)
   {
@@ -592,7 +660,8 @@ var State = function(Y, gui, instance)
     // are smart enough to avoid this in case they don't want this behaviour.
     if (name in _pending)
     {
-      _pending[name].abort();
+      if (! _pending[name].bundle)
+        _pending[name].abort();
       delete _pending[name];
     }
 
@@ -623,6 +692,43 @@ var State = function(Y, gui, instance)
                             headers: headers });
   };
 
+  /** Issue a single server request for all the state items @a names in
+      @a state using the 'bundle' entity. The versions of the data we
+      already have are passed along so that the server only returns the
+      items which have changed since. */
+  var _refreshBundle = function(names, state)
+  {
+    var query = [], args = { names: names, name: "bundle" };
+    var headers = { "Accept": "application/json" };
+
+    _self.complete = false;
+    Y.each(names, function(name) {
+      var obj = _data[name];
+      if (obj.valid > state)
+        obj.valid = state;
+      if (obj.valid == _RELOAD)
+        headers["Cache-Control"] = "max-age=0, must-revalidate";
+      if (name in _pending)
+      {
+        if (! _pending[name].bundle)
+          _pending[name].abort();
+        delete _pending[name];
+      }
+
+      obj.node.setAttribute("class", "pending");
+      query.push("item=" + encodeURIComponent(name));
+      if (obj.value && obj.version)
+        query.push("version=" + encodeURIComponent(name + ":" + obj.version));
+    });
+
+    args.xhr = Y.io(_url("bundle") + "?" + query.join("&"),
+                    { on: { success: _bundleSuccess, failure: _failure },
+                      context: this, method: "GET", sync: false,
+                      timeout: null, arguments: args, headers: headers });
+    args.xhr.bundle = true;
+    Y.each(names, function(name) { _pending[name] = args.xhr; });
+  };
+
   /** Check if the user has @a role in @a group. */
   this.hasGroupRole = function(role, group)
   {
@@ -673,15 +779,21 @@ var State = function(Y, gui, instance)
       are out of date and not currently pending load. */
   this.require = function()
   {
+    var names = [];
     for (var i = 0; i < arguments.length; ++i)
     {
       var name = arguments[i];
       var pending = (name in _pending);
       var obj = _data[name];
       if (obj.valid != _VALID && ! pending)
-        _refresh(name, obj, _INVALID);
+        names.push(name);
     }
 
+    if (names.length > 1)
+      _refreshBundle(names, _INVALID);
+    else if (names.length)
+      _refresh(names[0], _data[names[0]], _INVALID);
+
     return _self;
   };
 
@@ -991,7 +1103,7 @@ var State = function(Y, gui, instance)
         debug.append(n);
       }
 
-      _data[name] = { valid: false, value: null, node: n };
+      _data[name] = { valid: false, value: null, version: null, node: n };
     });
   };
 
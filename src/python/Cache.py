@@ -0,0 +1,421 @@
+import re, time, hashlib
+from bisect import bisect_left, bisect_right
+from threading import Lock, Event
+
+#: Tables whose contents change implicitly when rows are deleted from the
+#: key table, through "on delete cascade" or "on delete set null" foreign
+#: key constraints in the schema. Only direct dependencies are listed, the
+#: full closure is computed by :func:`dml_tables`.
+CASCADES = {
+  "site":               ["site_association", "resource_pledge", "resource_delivered",
+                         "resource_element", "phedex_node", "psn_node",
+                         "performance", "job_activity", "site_responsibility",
+                         "question_answer", "site_cms_name_map"],
+  "resource_element":   ["pinned_releases", "resource_cms_name_map"],
+  "phedex_node":        ["data_responsibility", "phedex_node_cms_name_map",
+                         "psn_node_phedex_name_map"],
+  "psn_node":           ["psn_node_phedex_name_map"],
+  "user_passwd":        ["contact"],
+  "contact":            ["site_responsibility", "group_responsibility",
+                         "data_responsibility", "survey"],
+  "role":               ["site_responsibility", "group_responsibility",
+                         "data_responsibility", "survey_who", "survey_roles"],
+  "user_group":         ["group_responsibility"],
+  "cms_name":           ["site_cms_name_map", "phedex_node_cms_name_map",
+                         "resource_cms_name_map", "sam_cms_name_map"],
+  "sam_name":           ["sam_cms_name_map"]
+}
+
+#: Regular expression for recognising modifying SQL statements.
+RX_DML = re.compile(r"(?i)^\s*(insert|update|delete|merge)\b")
+
+#: Regular expression for the target tables of a modifying SQL statement.
+RX_DML_TABLE = re.compile(r"(?i)\b(?:into|delete\s+from|update(?!\s+set\b))"
+                          r"\s+([a-z_][a-z0-9_]*)")
+
+def dml_tables(sql):
+  """Return the set of tables modified by SQL statement `sql`, including
+  the tables modified indirectly by cascading deletes. Returns an empty
+  set if `sql` is not an INSERT, UPDATE, DELETE or MERGE statement."""
+  m = RX_DML.match(sql)
+  if not m:
+    return set()
+
+  tables = set(t.lower() for t in RX_DML_TABLE.findall(sql))
+  if m.group(1).lower() == "delete":
+    todo = list(tables)
+    while todo:
+      for t in CASCADES.get(todo.pop(), []):
+        if t not in tables:
+          tables.add(t)
+          todo.append(t)
+  return tables
+
+#: Regular expression special characters.
+RX_SPECIAL = frozenset(".^$*+?{}[]\\|()")
+
+def _unescape(s):
+  """Return `s` as a plain string if it is a regular expression matching
+  only a literal string, possibly with escaped special characters, or None
+  if it is any more complex than that."""
+  result = []
+  i = 0
+  while i < len(s):
+    c = s[i]
+    if c == "\\" and i+1 < len(s) and s[i+1] in RX_SPECIAL:
+      c = s[i+1]
+      i += 1
+    elif c in RX_SPECIAL:
+      return None
+    result.append(c)
+    i += 1
+  return "".join(result)
+
+def _unanchored(s, suffix):
+  """Return `s` without `suffix` if it ends in the unescaped `suffix`,
+  otherwise return None."""
+  if not s.endswith(suffix):
+    return None
+  n = len(s) - len(suffix)
+  escapes = len(s[:n]) - len(s[:n].rstrip("\\"))
+  return (escapes % 2 == 0 and s[:n]) or None
+
+def rxplan(rx):
+  """Analyse regular expression `rx` for matching with an index rather than
+  against every value. Simple patterns are recognised: literal strings, with
+  or without ``^`` and ``$`` anchors and ``.*`` suffix, and alternations of
+  literals in a group such as ``^(?:T1_CH_CERN|T2_CH_CERN)$``.
+
+  :arg re.RegexObject rx: compiled regular expression, as used for matching
+    from the beginning of the value with ``rx.match()``.
+  :returns: tuple *(exact, literals)*, where *exact* is True if the values
+    must equal one of the *literals*, or False if they need to start with
+    one of them; or None if the pattern is not simple enough."""
+  if rx.flags:
+    return None
+
+  pat = rx.pattern
+  if pat.startswith("^"):
+    pat = pat[1:]
+
+  exact = False
+  if _unanchored(pat, "$") is not None:
+    pat = _unanchored(pat, "$")
+    exact = True
+  if _unanchored(pat, ".*") is not None:
+    pat = _unanchored(pat, ".*")
+    exact = False
+
+  if pat.startswith("(") and pat.endswith(")") and _unanchored(pat, ")"):
+    pat = pat[1:-1]
+    if pat.startswith("?:"):
+      pat = pat[2:]
+    if "\\|" in pat:
+      return None
+    literals = [_unescape(alt) for alt in pat.split("|")]
+  else:
+    literals = [_unescape(pat)]
+
+  if None in literals:
+    return None
+  return exact, literals
+
+class CacheEntry:
+  """A cached query result for query `key`: the column titles and the rows,
+  plus the table version `stamp` the result was read at and the time it
+  `expires`. The `digest` is a SHA1 hash of the result contents and
+  `modified` the time the contents last changed, for use as HTTP cache
+  validators. The `encoded` dictionary holds the formatted and compressed
+  response bodies made from the result, see :class:`~.PayloadFormat`."""
+  def __init__(self, key, tables, stamp, expires, columns, rows, digest, modified):
+    self.key = key
+    self.tables = tables
+    self.stamp = stamp
+    self.expires = expires
+    self.columns = columns
+    self.rows = rows
+    self.digest = digest
+    self.modified = modified
+    self.encoded = {}
+    self._index = {}
+
+  def select(self, rx, select):
+    """Return the rows whose value for `select` matches `rx` using a sorted
+    index of the column values, or None if the pattern is too complex for
+    the index and the caller needs to apply the regular expression to each
+    row instead. The rows are returned in their original order.
+
+    :arg re.RegexObject rx: regular expression to match from the beginning
+      of the value, as with :func:`~.rxfilter`.
+    :arg callable select: operator selecting the column to match, normally
+      :func:`operator.itemgetter` for a single column.
+    :returns: list of matching rows, or None."""
+    plan = rxplan(rx)
+    if not plan or not self.columns:
+      return None
+    try:
+      column = select(tuple(range(len(self.columns))))
+    except Exception:
+      return None
+    if not isinstance(column, int):
+      return None
+
+    if column not in self._index:
+      pairs = sorted((row[column], i) for i, row in enumerate(self.rows)
+                     if isinstance(row[column], basestring))
+      self._index[column] = ([k for k, _ in pairs], [i for _, i in pairs])
+    keys, positions = self._index[column]
+
+    exact, literals = plan
+    matches = set()
+    for lit in literals:
+      i = bisect_left(keys, lit)
+      if exact:
+        end = bisect_right(keys, lit + "\n")
+        matches.update(positions[j] for j in xrange(i, end)
+                       if keys[j] == lit or keys[j] == lit + "\n")
+      else:
+        while i < len(keys) and keys[i].startswith(lit):
+          matches.add(positions[i])
+          i += 1
+    return [self.rows[i] for i in sorted(matches)]
+
+class ResultCache:
+  """Cache of query results shared by all the server threads.
+
+  Every table has a version number per database instance, which is bumped
+  by :meth:`invalidate` after a change to the table has been committed. A
+  cached result records the versions of the tables it was read from, as
+  they were *before* the query was executed, and remains valid only for as
+  long as none of those versions change. This way a result read while a
+  concurrent transaction was committing is at worst discarded unnecessarily,
+  but never served stale. The results also expire after `maxage` seconds
+  regardless, to pick up changes made by other servers in the cluster; zero
+  `maxage` disables the cache.
+
+  Concurrent requests for the same missing result are coalesced with
+  :meth:`acquire` and :meth:`release`: only one thread executes the query,
+  the others wait for it, at most `waittime` seconds, and then use the
+  result it added to the cache. Results of more than `maxrows` rows are
+  not cached, so that streaming them out does not need memory in
+  proportion to the result size."""
+  def __init__(self, maxage = 300, waittime = 60, maxrows = 100000):
+    self.maxage = maxage
+    self.waittime = waittime
+    self.maxrows = maxrows
+    self._lock = Lock()
+    self._versions = {}
+    self._entries = {}
+    self._filling = {}
+
+  def _stamp(self, instance, tables):
+    """Return the current versions of `tables`; call with the lock held."""
+    return tuple(self._versions.get((instance, t), 0) for t in tables)
+
+  def stamp(self, instance, tables):
+    """Return the current versions of `tables` in database `instance`."""
+    with self._lock:
+      return self._stamp(instance, tables)
+
+  def invalidate(self, instance, tables):
+    """Bump the versions of `tables` in database `instance`, invalidating
+    all the cached results which depend on any of them."""
+    with self._lock:
+      for t in tables:
+        self._versions[(instance, t)] = self._versions.get((instance, t), 0) + 1
+
+  def _get(self, instance, key):
+    """Return the valid entry for `key`; call with the lock held."""
+    entry = self._entries.get((instance, key), None)
+    if entry and entry.expires > time.time() \
+       and entry.stamp == self._stamp(instance, entry.tables):
+      return entry
+    return None
+
+  def get(self, instance, key):
+    """Return the valid :class:`CacheEntry` for query `key` in database
+    `instance`, or None if there is no such entry."""
+    with self._lock:
+      return self._get(instance, key)
+
+  def acquire(self, instance, key):
+    """Return the valid :class:`CacheEntry` for query `key` in database
+    `instance`, waiting for another thread already executing the query to
+    add the result to the cache. If there is no valid entry and no other
+    thread is filling it, or the wait times out, the caller should execute
+    the query and :meth:`put` the result.
+
+    :returns: tuple *(entry, token)*; if *entry* is None and *token* is not,
+              the caller is filling the entry for the others and must pass
+              *token* to :meth:`release` once done. Both are None if the
+              wait for another thread timed out."""
+    deadline = time.time() + self.waittime
+    while True:
+      with self._lock:
+        entry = self._get(instance, key)
+        if entry:
+          return entry, None
+        event = self._filling.get((instance, key), None)
+        if not event:
+          event = self._filling[(instance, key)] = Event()
+          return None, event
+
+      # Another thread is executing the query. If it fails or the result
+      # is invalidated meanwhile, loop around and take over the fill.
+      wait = deadline - time.time()
+      if wait <= 0 or not event.wait(wait):
+        return None, None
+
+  def release(self, instance, key, token):
+    """Mark the fill of query `key` started by :meth:`acquire` done, and
+    wake up the threads waiting for it. Safe to call more than once."""
+    with self._lock:
+      if self._filling.get((instance, key), None) is token:
+        del self._filling[(instance, key)]
+    token.set()
+
+  def put(self, instance, key, tables, stamp, columns, rows):
+    """Add to the cache the result `columns` and `rows` of query `key` in
+    database `instance`, read from `tables` when they had versions `stamp`.
+    Returns the new :class:`CacheEntry`. If the contents did not change
+    since the previous result for the same query, the modification time
+    of the previous result is retained."""
+    now = time.time()
+    digest = hashlib.sha1(repr((columns, rows))).hexdigest()
+    with self._lock:
+      prev = self._entries.get((instance, key), None)
+      modified = (prev and prev.digest == digest and prev.modified) or now
+      entry = CacheEntry(key, tables, stamp, now + self.maxage, columns, rows,
+                         digest, modified)
+      for k, e in self._entries.items():
+        if e.expires <= now:
+          del self._entries[k]
+      self._entries[(instance, key)] = entry
+    return entry
+
+  def transient(self, key, tables, columns, rows):
+    """Return a :class:`CacheEntry` for the result `columns` and `rows` of
+    query `key` without adding it to the cache, for results which must not
+    be shared such as those read within an uncommitted transaction."""
+    now = time.time()
+    digest = hashlib.sha1(repr((columns, rows))).hexdigest()
+    return CacheEntry(key, tables, None, now, columns, rows, digest, now)
+
+  def patch(self, instance, entry, tables, rows):
+    """Replace `entry` with one with updated `rows`, after the caller has
+    committed a change to the database and invalidated `tables` for it, and
+    knows how the change affects the result. This avoids executing the query
+    again for small changes. The entry is only replaced if it was current
+    before the change and no other change to the tables it depends on has
+    been invalidated since.
+
+    :arg str instance: database instance.
+    :arg CacheEntry entry: the entry valid before the change.
+    :arg set tables: the tables invalidated for the change.
+    :arg list rows: the result rows after the change.
+    :returns: the new :class:`CacheEntry`, or None if not replaced."""
+    if not tables:
+      return None
+    stamp = tuple(v + ((t in tables and 1) or 0)
+                  for t, v in zip(entry.tables, entry.stamp))
+    digest = hashlib.sha1(repr((entry.columns, rows))).hexdigest()
+    with self._lock:
+      if self._entries.get((instance, entry.key), None) is not entry \
+         or self._stamp(instance, entry.tables) != stamp:
+        return None
+      new = CacheEntry(entry.key, entry.tables, stamp, entry.expires,
+                       entry.columns, rows, digest, time.time())
+      self._entries[(instance, entry.key)] = new
+    return new
+
+class DerivedCache:
+  """Cache of data structures derived from cached query results, such as
+  lookup indices. The derived value is built with `build(rows)` from the
+  rows of a :class:`CacheEntry`, and is rebuilt whenever the cache entry
+  is replaced. Values derived from transient entries are not kept."""
+  def __init__(self, build):
+    self._build = build
+    self._lock = Lock()
+    self._derived = {}
+
+  def get(self, instance, entry):
+    """Return the value derived from cache `entry` of database `instance`."""
+    with self._lock:
+      cur = self._derived.get(instance, None)
+      if cur and cur[0] is entry:
+        return cur[1]
+
+    value = self._build(entry.rows)
+    if entry.stamp is not None:
+      with self._lock:
+        self._derived[instance] = (entry, value)
+    return value
+
+  def patch(self, instance, old, new, update):
+    """Update incrementally the value derived from cache entry `old` to
+    match cache entry `new`. The value is passed to `update`, which must
+    return a new updated value without modifying the old one, as other
+    threads may still be using it. Does nothing if the current value is
+    not derived from `old`; it will be rebuilt when next needed."""
+    with self._lock:
+      cur = self._derived.get(instance, None)
+      if cur and cur[0] is old:
+        self._derived[instance] = (new, update(cur[1]))
+
+class OutcomeCache:
+  """Recent outcomes of write requests by client idempotency key, so that
+  a retried request gets the outcome of the original one instead of being
+  executed again. Outcomes are kept for `maxage` seconds. Only successful
+  outcomes are recorded; a retry of a failed request executes it again.
+  A retry arriving while the original request is still in progress waits
+  at most `waittime` seconds for it to finish.
+
+  The outcomes are kept in this server process only, so a retry which is
+  routed to another server is executed again."""
+  def __init__(self, maxage = 600, waittime = 60):
+    self.maxage = maxage
+    self.waittime = waittime
+    self._lock = Lock()
+    self._outcomes = {}
+    self._running = {}
+
+  def begin(self, key):
+    """Start a request with idempotency `key`. If a request with the same
+    key is in progress, waits for it to finish.
+
+    :arg key: the idempotency key, including the client identity.
+    :returns: tuple *(outcome, token)*. If *outcome* is not None, it is the
+      tuple *(fingerprint, result)* recorded for the key, and the request
+      should not be executed. Otherwise the caller should execute it and
+      then call :meth:`end` with *token*. Both are None if the request
+      with the same key is still in progress after the wait; the caller
+      must not execute the request then."""
+    deadline = time.time() + self.waittime
+    while True:
+      with self._lock:
+        now = time.time()
+        outcome = self._outcomes.get(key, None)
+        if outcome and outcome[0] > now:
+          return outcome[1:], None
+        event = self._running.get(key, None)
+        if not event:
+          event = self._running[key] = Event()
+          return None, event
+
+      wait = deadline - time.time()
+      if wait <= 0 or not event.wait(wait):
+        return None, None
+
+  def end(self, key, token, fingerprint, result):
+    """Finish the request started with :meth:`begin`, recording `result`
+    for request `fingerprint` unless the result is None for failure."""
+    with self._lock:
+      now = time.time()
+      if result is not None:
+        for k, v in self._outcomes.items():
+          if v[0] <= now:
+            del self._outcomes[k]
+        self._outcomes[key] = (now + self.maxage, fingerprint, result)
+      if self._running.get(key, None) is token:
+        del self._running[key]
+    token.set()
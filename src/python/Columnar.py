@@ -0,0 +1,187 @@
+from WMCore.REST.Format import RESTFormat
+from WMCore.REST.Error import RESTError, ExecutionError, report_rest_error
+from traceback import format_exc
+import cherrypy, struct, json
+
+#: MIME type of the columnar format.
+COLUMNAR_TYPE = "application/x-sitedb-columnar"
+
+#: Marker at the beginning of columnar format output.
+COLUMNAR_MAGIC = "SDBC\x03"
+
+#: String table index used for null values in string and JSON columns.
+NULL_STRING = 0xffffffff
+
+def _column_type(values):
+  """Return the type code for column `values`: "i" if all non-null values
+  are integers fitting in 64 bits, "f" if they are all numbers, "s" if
+  they are all strings, otherwise "j" for JSON encoded values."""
+  kind = None
+  for v in values:
+    if v is None:
+      continue
+    elif isinstance(v, basestring):
+      this = "s"
+    elif isinstance(v, bool) or not isinstance(v, (int, long, float)):
+      return "j"
+    elif isinstance(v, float) or not -2**63 <= v < 2**63:
+      this = "f"
+    else:
+      this = "i"
+
+    if kind is None or kind == this:
+      kind = this
+    elif "s" in (kind, this):
+      return "j"
+    else:
+      kind = "f"
+  return kind or "i"
+
+def _nullmap(values):
+  """Return a bitmap with a bit set for each null value in `values`."""
+  bits = bytearray((len(values) + 7) / 8)
+  for i, v in enumerate(values):
+    if v is None:
+      bits[i >> 3] |= 1 << (i & 7)
+  return str(bits)
+
+def _string(v):
+  """Return `v` as an utf-8 encoded string."""
+  if isinstance(v, unicode):
+    return v.encode("utf-8")
+  return str(v)
+
+class ColumnarFormat(RESTFormat):
+  """Format an iterable of rows as compact binary columns.
+
+  The result rows, which must be sequences of column values, are turned
+  into a column-major binary representation. All integers are little
+  endian. The output consists of:
+
+  * magic :obj:`COLUMNAR_MAGIC`, then the number of columns, the number
+    of rows and the number of description entries as unsigned 32-bit
+    integers;
+  * the string table: the number of strings as unsigned 32-bit integer,
+    that many + 1 unsigned 32-bit offsets, then the concatenated utf-8
+    encoded strings; the i'th string is from offset i to offset i+1;
+  * for each description entry, the name and the JSON encoded value as
+    indices into the string table;
+  * for each column, the column name as an index into the string table,
+    a type code character, and the values. Type "i" columns have signed
+    64-bit integers, and type "f" 64-bit IEEE floats, each followed by a
+    bitmap with a bit set for each null value (bit i & 7 of byte i >> 3),
+    in which case the value is zero. Type "s" columns have unsigned 32-bit
+    string table indices, with :obj:`NULL_STRING` for nulls. Type "j"
+    columns, used for columns with booleans or with both strings and
+    numbers, are like "s" but the strings are the JSON encoded values.
+
+  Each distinct string is stored only once. The column names are taken
+  from the ``columns`` of ``cherrypy.request.rest_generate_preamble``, and
+  the description entries are the rest of it, for example the change feed
+  ``sequence`` and ``reset``, like the ``desc`` of JSON output.
+  Unlike :class:`~.JSONFormat` the whole result must be read before any
+  output can be generated. See :func:`columnar_decode` for a decoder."""
+  def stream_chunked(self, stream, etag):
+    """Generator for actually producing the output."""
+    try:
+      rows = list(stream)
+      preamble = cherrypy.request.rest_generate_preamble or {}
+      names = preamble.get("columns", None)
+      if rows and not isinstance(rows[0], (list, tuple)):
+        raise ExecutionError("Result is not representable as columns")
+      names = names or ["column%d" % i for i in xrange(len((rows and rows[0]) or []))]
+
+      strings = {}
+      def strindex(v):
+        v = _string(v)
+        if v not in strings:
+          strings[v] = len(strings)
+        return strings[v]
+
+      desc = [struct.pack("<II", strindex(k), strindex(json.dumps(v)))
+              for k, v in sorted(preamble.items()) if k != "columns"]
+      body = []
+      for i, name in enumerate(names):
+        values = [row[i] for row in rows]
+        kind = _column_type(values)
+        body.append(struct.pack("<Ic", strindex(name), kind))
+        if kind == "s":
+          body.append(struct.pack("<%dI" % len(values),
+                                  *[NULL_STRING if v is None else strindex(v)
+                                    for v in values]))
+        elif kind == "j":
+          body.append(struct.pack("<%dI" % len(values),
+                                  *[NULL_STRING if v is None else strindex(json.dumps(v))
+                                    for v in values]))
+        else:
+          fmt = (kind == "i" and "<%dq") or "<%dd"
+          body.append(struct.pack(fmt % len(values), *[v or 0 for v in values]))
+          body.append(_nullmap(values))
+
+      table = sorted(strings, key=strings.get)
+      offsets = [0]
+      for s in table:
+        offsets.append(offsets[-1] + len(s))
+
+      chunks = [COLUMNAR_MAGIC + struct.pack("<III", len(names), len(rows), len(desc)),
+                struct.pack("<I%dI" % len(offsets), len(table), *offsets)
+                + "".join(table),
+                "".join(desc) + "".join(body)]
+      for chunk in chunks:
+        etag.update(chunk)
+        yield chunk
+
+      cherrypy.response.headers["X-REST-Status"] = 100
+    except RESTError as e:
+      etag.invalidate()
+      report_rest_error(e, format_exc(), False)
+    except Exception as e:
+      etag.invalidate()
+      report_rest_error(ExecutionError(), format_exc(), False)
+
+def columnar_decode(data):
+  """Decode output of :class:`ColumnarFormat`.
+
+  :arg str data: the response body.
+  :returns: tuple *(columns, rows, desc)* of the column names, list of rows
+    and dictionary of the description entries."""
+  if not data.startswith(COLUMNAR_MAGIC):
+    raise ValueError("not columnar format data")
+
+  pos = len(COLUMNAR_MAGIC)
+  ncols, nrows, ndesc, nstrings = struct.unpack_from("<IIII", data, pos)
+  pos += 16
+  offsets = struct.unpack_from("<%dI" % (nstrings + 1), data, pos)
+  pos += 4 * (nstrings + 1)
+  table = [data[pos + offsets[i]:pos + offsets[i+1]].decode("utf-8")
+           for i in xrange(nstrings)]
+  pos += offsets[-1]
+
+  desc = {}
+  for _ in xrange(ndesc):
+    key, value = struct.unpack_from("<II", data, pos)
+    pos += 8
+    desc[table[key]] = json.loads(table[value])
+
+  names, columns = [], []
+  for _ in xrange(ncols):
+    name, kind = struct.unpack_from("<Ic", data, pos)
+    pos += 5
+    names.append(table[name])
+    if kind == "s":
+      values = struct.unpack_from("<%dI" % nrows, data, pos)
+      pos += 4 * nrows
+      columns.append([None if v == NULL_STRING else table[v] for v in values])
+    elif kind == "j":
+      values = struct.unpack_from("<%dI" % nrows, data, pos)
+      pos += 4 * nrows
+      columns.append([None if v == NULL_STRING else json.loads(table[v]) for v in values])
+    else:
+      values = struct.unpack_from(((kind == "i" and "<%dq") or "<%dd") % nrows, data, pos)
+      pos += 8 * nrows
+      nulls = bytearray(data[pos:pos + (nrows + 7) / 8])
+      pos += (nrows + 7) / 8
+      columns.append([None if (nulls[i >> 3] >> (i & 7)) & 1 else v
+                      for i, v in enumerate(values)])
+
+  return names, [list(row) for row in zip(*columns)], desc
@@ -1,4 +1,9 @@
-from WMCore.REST.Server import DatabaseRESTApi
+from WMCore.REST.Server import DatabaseRESTApi, rows, rxfilter
+from SiteDB.Cache import ResultCache, OutcomeCache, dml_tables
+from SiteDB.Columnar import ColumnarFormat, COLUMNAR_TYPE
+from SiteDB.Payload import PayloadFormat, PayloadRows
+from WMCore.REST.Error import InvalidParameter, MissingObject, DatabaseUnavailable
+from SiteDB.Regexps import RX_SINCE, RX_IDEMPOTENCY_KEY
 from SiteDB.DataWhoAmI import *
 from SiteDB.DataRoles import *
 from SiteDB.DataGroups import *
@@ -16,15 +21,65 @@ from SiteDB.DataRebusFetch import *
 from SiteDB.DataESPCredit import *
 from SiteDB.DataUserPNNs import *
 from SiteDB.DataProcessing import *
+from SiteDB.DataBundle import *
+from SiteDB.DataBatch import *
+from cherrypy import request, response, serving, HTTPRedirect
+from cherrypy._cprequest import Request, Response
+from cherrypy.lib import cptools, httputil
+from contextlib import contextmanager
+from functools import wraps
+import cherrypy, hashlib, json, time
 
 class Data(DatabaseRESTApi):
-  """Server object for REST data access API."""
+  """Server object for REST data access API.
+
+  GET requests on entities which declare the tables their query reads with
+  ``@restcall(tables = [...])`` are served from a :class:`~.ResultCache`
+  shared by all the server threads. All modifying statements executed via
+  this object record the tables they change, and the cached results which
+  depend on those tables are invalidated once the change is committed.
+
+  Cached results carry strong ETag and Last-Modified validators derived
+  from the result contents, so conditional GET requests for unchanged data
+  are answered with 304 without querying the database or formatting the
+  result. These entities can also be retrieved in the binary columnar
+  format, see :class:`~.ColumnarFormat`.
+
+  Concurrent identical requests for a result which is not in the cache are
+  coalesced: only one of them executes the query, and the others wait for
+  it to finish and then serve the result it cached. The formatted and
+  compressed response bodies for complete cached results are kept with
+  the result, and served as such to all clients asking for the same
+  format and content encoding, see :class:`~.PayloadFormat`.
+
+  Every committed transaction is recorded in the ``change_log`` table in
+  the database, shared by all the servers, from which the entities serve
+  the changes to their results since a client's previous request; see
+  :meth:`changed` and :meth:`_changes`.
+
+  Write requests may carry an ``Idempotency-Key`` header. The successful
+  result of such a request is remembered for a while, and a request from
+  the same user with the same key gets that result again without being
+  executed; see :meth:`_wrap`."""
   def __init__(self, app, config, mount):
     """
     :arg app: reference to application object; passed to all entities.
     :arg config: reference to configuration; passed to all entities.
     :arg str mount: API URL mount point; passed to all entities."""
     DatabaseRESTApi.__init__(self, app, config, mount)
+    self._cache = ResultCache(getattr(config, "cachetime", 300),
+                              getattr(config, "cachewait", 60),
+                              getattr(config, "cacherows", 100000))
+    self._arraysize = getattr(config, "arraysize", 1000)
+    self._outcomes = OutcomeCache(getattr(config, "idempotency_time", 600),
+                                  getattr(config, "idempotency_wait", 60))
+    self._changetime = getattr(config, "changetime", 7 * 86400)
+    self._changesettle = getattr(config, "changesettle", 60)
+
+    # Stream out responses without a precomputed ETag once they exceed
+    # this size, rather than buffering up to the default 8 MB to hash it.
+    self.etag_limit = 64 * 1024
+    names = SiteNames(app, self, config, mount)
     self._add({ "whoami":                 WhoAmI(app, self, config, mount),
                 "ldapsync":               LdapSync(app, self, config, mount),
                 "rebusfetch":             RebusFetch(app, self, config, mount),
@@ -32,7 +87,8 @@ class Data(DatabaseRESTApi):
                 "groups":                 Groups(app, self, config, mount),
                 "people":                 People(app, self, config, mount),
                 "sites":                  Sites(app, self, config, mount),
-                "site-names":             SiteNames(app, self, config, mount),
+                "site-names":             names,
+                "site-aliases":           SiteAliases(app, self, config, mount, names),
                 "site-resources":         SiteResources(app, self, config, mount),
                 "site-associations":      SiteAssociations(app, self, config, mount),
                 "resource-pledges":       Pledges(app, self, config, mount),
@@ -44,4 +100,660 @@ class Data(DatabaseRESTApi):
                 "federations":            Federations(app, self, config, mount),
                 "federations-sites":      FederationsSites(app, self, config, mount),
                 "federations-pledges":    FederationsPledges(app, self, config, mount),
-                "esp-credit":             ESPCredit(app, self, config, mount)})
+                "esp-credit":             ESPCredit(app, self, config, mount),
+                "bundle":                 Bundle(app, self, config, mount),
+                "batch":                  Batch(app, self, config, mount)})
+
+    # Offer the columnar format for the entities returning table rows, and
+    # cache their encoded responses; the formats do their own compression.
+    encodings = getattr(config, "payload_encodings", ["gzip", "deflate"])
+    payload = [(t, PayloadFormat(t, f, encodings, self.compression_level,
+                                 self.compression_chunk))
+               for t, f in self.formats + [(COLUMNAR_TYPE, ColumnarFormat())]]
+    for method in ("GET", "HEAD"):
+      for apiobj in self.methods.get(method, {}).values():
+        if apiobj.get("tables", None):
+          apiobj.setdefault("formats", payload)
+          apiobj["compression"] = []
+
+  def _dbenter(self, apiobj, method, api, param, safe):
+    """Acquire database connection for the request, and remember which
+    tables the result depends on if it is a cacheable GET request. Takes
+    the optional ``since`` change feed argument for such requests, see
+    :meth:`query`, unless the entity is declared with ``changes = False``
+    as its result is not a plain query result."""
+    since = param.kwargs.pop("since", None)
+    if since is not None and (method not in ("GET", "HEAD")
+                              or not apiobj.get("tables", None)
+                              or not apiobj.get("changes", True)
+                              or not isinstance(since, str)
+                              or not RX_SINCE.match(since)):
+      raise InvalidParameter("Incorrect 'since' parameter")
+
+    key = request.headers.get("Idempotency-Key", None)
+    if key is not None and (method not in ("PUT", "POST", "DELETE")
+                            or not RX_IDEMPOTENCY_KEY.match(key)):
+      raise InvalidParameter("Incorrect 'Idempotency-Key' header")
+
+    DatabaseRESTApi._dbenter(self, apiobj, method, api, param, safe)
+    request.db["tables"] = (method in ("GET", "HEAD") and apiobj.get("tables")) or None
+    request.db["modified"] = set()
+    request.db["since"] = since
+    request.db["feed"] = (api, apiobj.get("changes", True))
+    request.db["changed"] = []
+    request.db["fills"] = {}
+    request.db["idempotency"] = key and (request.db["instance"], method, api,
+                                         request.user.get("login", None),
+                                         request.user.get("dn", None), key)
+
+  def _dbexit(self):
+    """Invalidate the cached results on tables modified and committed by
+    the request, wake up requests still waiting for results this request
+    was to add to the cache, then release the database connection."""
+    self._invalidate()
+    for key in request.db.get("fills", {}).keys():
+      self._release(key)
+    DatabaseRESTApi._dbexit(self)
+
+  def _invalidate(self):
+    """Invalidate the cached results which depend on any of the tables
+    modified so far by the current request."""
+    db = getattr(request, "db", None)
+    if db and db.get("modified"):
+      self._cache.invalidate(db["instance"], db["modified"])
+      db["modified"] = set()
+
+  @contextmanager
+  def session(self, instance, module, method = "PUT"):
+    """Context manager for using the database outside HTTP requests, for
+    example from a server task thread, without going through the server.
+    Sets up a private request context for the calling thread with a pool
+    connection to `instance` like :meth:`_dbenter`, identified as used by
+    `module` for `method`, so the usual database methods of this object
+    can be used within it. At the end the connection is released, rolling
+    back any uncommitted changes.
+
+    :arg str instance: database instance name.
+    :arg str module: name to identify the connection user.
+    :arg str method: HTTP method whose database account to use.
+    :returns: this object."""
+    if method in self._db[instance]:
+      db = self._db[instance][method]
+    elif '*' in self._db[instance]:
+      db = self._db[instance]['*']
+    else:
+      raise DatabaseUnavailable()
+
+    serving.load(Request(httputil.Host("127.0.0.1", 0), httputil.Host("127.0.0.1", 0)),
+                 Response())
+    try:
+      request.db = { "instance": instance, "type": db["type"], "pool": db["pool"],
+                     "handle": None, "last_sql": None, "last_bind": (None, None) }
+      dbh, err = db["pool"].get("%s %s internal" % (method, instance), module)
+      if err:
+        self._dberror(err[0], err[1], True)
+      elif not dbh:
+        raise DatabaseUnavailable()
+
+      request.db.update(handle = dbh, tables = None, modified = set(),
+                        since = None, changed = [], fills = {}, idempotency = None)
+      try:
+        yield self
+      finally:
+        self._dbexit()
+    finally:
+      serving.clear()
+
+  def _wrap(self, handler):
+    """Wrap `handler` in the database exception filter like the base class,
+    except let through :class:`~.HTTPRedirect` raised to answer conditional
+    requests; the database connection is released by :meth:`_dbexit`.
+
+    If the request has an idempotency key, the result is recorded, and
+    replayed for retries of the same request with the same key, which wait
+    for the original request if it is still in progress. If it is still in
+    progress after the wait, the retry fails with 409 without executing.
+    Reusing a key for a different request is an error."""
+    @wraps(handler)
+    def redirect_catcher(*xargs, **xkwargs):
+      try:
+        return handler(*xargs, **xkwargs)
+      except HTTPRedirect as e:
+        return e
+
+    dbapi_wrapper = DatabaseRESTApi._wrap(self, redirect_catcher)
+
+    @wraps(handler)
+    def redirect_wrapper(*xargs, **xkwargs):
+      result = dbapi_wrapper(*xargs, **xkwargs)
+      if isinstance(result, HTTPRedirect):
+        raise result
+      return result
+
+    @wraps(handler)
+    def idempotent_wrapper(*xargs, **xkwargs):
+      key = request.db.get("idempotency", None)
+      if not key:
+        return redirect_wrapper(*xargs, **xkwargs)
+
+      fingerprint = hashlib.sha1(repr((request.path_info,
+                                       sorted(request.params.items())))).hexdigest()
+      outcome, token = self._outcomes.begin(key)
+      if not (outcome or token):
+        raise cherrypy.HTTPError(409, "A request with the same Idempotency-Key"
+                                 " is still in progress.")
+      if outcome:
+        if outcome[0] != fingerprint:
+          raise InvalidParameter("Idempotency key reused for a different request")
+        response.headers["X-Idempotent-Replay"] = "true"
+        return outcome[1]
+
+      result = None
+      try:
+        result = list(redirect_wrapper(*xargs, **xkwargs))
+        return result
+      finally:
+        self._outcomes.end(key, token, fingerprint, result)
+
+    return idempotent_wrapper
+
+  def _validators(self, entry, match):
+    """Set the ETag and Last-Modified response headers for a result served
+    from cache `entry` and filtered by `match`. The ETag also covers the
+    negotiated format and content encoding. Raises 304 if the request has
+    an If-Modified-Since header and no If-None-Match header, and the data
+    has not changed since; If-None-Match is matched against the ETag when
+    the response is streamed out, before the result is formatted."""
+    etag = hashlib.sha1(entry.digest)
+    etag.update(repr(((match and match.pattern) or None,
+                      request.headers.get("Accept", None),
+                      request.headers.get("Accept-Encoding", None))))
+    response.headers["ETag"] = '"%s"' % etag.hexdigest()
+    response.headers["Last-Modified"] = httputil.HTTPDate(entry.modified)
+    if "If-None-Match" not in request.headers:
+      cptools.validate_since()
+
+  def _fresh(self):
+    """Return True if the client requested a fresh copy of the data with
+    ``Cache-Control: no-cache`` or ``max-age=0`` request headers, or the
+    request reads everything from its snapshot, see :meth:`snapshot`."""
+    if request.db.get("fresh", False):
+      return True
+    cc = request.headers.get("Cache-Control", "") + request.headers.get("Pragma", "")
+    return "no-cache" in cc or "max-age=0" in cc
+
+  def snapshot(self, tables, fresh = False):
+    """Start a read-only transaction, so all the following queries of the
+    request read one consistent database state. The result cache versions
+    of `tables` are captured just before, and results read in the snapshot
+    are cached with those versions, so they are discarded if the tables
+    have changed since. Cached results can still be served meanwhile;
+    use :meth:`snapshot_changed` at the end to check they match the
+    snapshot, or pass `fresh` to read everything from the snapshot.
+
+    Results read in a snapshot are parts of a larger response, so they
+    get no validators nor conditional request handling of their own.
+
+    :arg list tables: all the tables the following queries read.
+    :arg bool fresh: if true, do not use cached results."""
+    tables = sorted(set(tables))
+    stamp = dict(zip(tables, self._cache.stamp(request.db["instance"], tables)))
+    request.db["handle"]["connection"].rollback()
+    DatabaseRESTApi.execute(self, "set transaction read only")
+    request.db["snapshot"] = stamp
+    request.db["fresh"] = fresh
+
+  def snapshot_changed(self):
+    """Return True if any of the tables given to :meth:`snapshot` have
+    changed since, so cached results served meanwhile may not match it."""
+    stamp = request.db["snapshot"]
+    tables = sorted(stamp)
+    return self._cache.stamp(request.db["instance"], tables) \
+           != tuple(stamp[t] for t in tables)
+
+  def _stamp(self, tables):
+    """Return the result cache versions of `tables` to cache a result read
+    now with: the current ones, or those captured for the snapshot."""
+    snapshot = request.db.get("snapshot", None)
+    if snapshot is None:
+      return self._cache.stamp(request.db["instance"], tables)
+    return tuple(snapshot.get(t, -1) for t in tables)
+
+  def prepare(self, sql):
+    """Prepare `sql` like the base class, and set the cursor array size
+    so queries fetch many rows per database round trip."""
+    c = DatabaseRESTApi.prepare(self, sql)
+    c.arraysize = self._arraysize
+    return c
+
+  def execute(self, sql, *binds, **kwbinds):
+    """Execute `sql` like the base class, but remember the tables it may
+    modify for invalidating the result cache at the end of the request."""
+    request.db.setdefault("modified", set()).update(dml_tables(sql))
+    return DatabaseRESTApi.execute(self, sql, *binds, **kwbinds)
+
+  def executemany(self, sql, *binds, **kwbinds):
+    """Execute `sql` like the base class, but remember the tables it may
+    modify for invalidating the result cache at the end of the request."""
+    request.db.setdefault("modified", set()).update(dml_tables(sql))
+    return DatabaseRESTApi.executemany(self, sql, *binds, **kwbinds)
+
+  def modify(self, sql, *binds, **kwbinds):
+    """Modify the database like the base class, but commit with
+    :meth:`commit`, so the change is recorded in the change log and the
+    cached results which depend on it are invalidated. Within a batch of
+    changes, marked by ``batch`` in ``request.db``, the rows affected are
+    checked but the change is left for the batch to commit."""
+    if binds:
+      c, _ = self.executemany(sql, *binds, **kwbinds)
+      expected = len(binds[0])
+    else:
+      kwbinds = self.bindmap(**kwbinds)
+      c, _ = self.executemany(sql, kwbinds, *binds)
+      expected = len(kwbinds)
+    result = self.rowstatus(c, expected)
+    self.commit()
+    return result
+
+  def changed(self, api, op = None, keys = None):
+    """Record that the current transaction changed the rows of the result
+    of `api` with `keys`, for the change feed, see :meth:`_changes`. The
+    keys are the values of the key columns the entity declares with
+    ``@restcall(changes = [...])``, as tuples or, for one column, as plain
+    values. Without `keys`, records that the transaction did not change
+    the rows of `api`, which may also be a list of entity names, even
+    though it modified the tables they come from. The changes are written
+    to the change log by :meth:`commit`.
+
+    If a transaction modifies the tables of an entity's result without
+    recording its changes, clients of the feed have to reload the result.
+
+    :arg str api: name of the entity whose result changed.
+    :arg str op: "insert", "update" or "delete".
+    :arg list keys: keys of the rows changed."""
+    changed = request.db.setdefault("changed", [])
+    if keys is None:
+      changed.extend((a, "", "") for a in
+                     (isinstance(api, basestring) and [api]) or api)
+      return
+    for k in keys:
+      if not isinstance(k, (tuple, list)):
+        k = (k,)
+      changed.append((api, json.dumps(list(k)), op))
+
+  def _record(self, modified):
+    """Write the changes of the current transaction, which modified tables
+    `modified`, to the change log under a new sequence number, as part of
+    the transaction. Old changes are deleted once in a while."""
+    changed = request.db.get("changed", None) or []
+    request.db["changed"] = []
+    if not modified:
+      return
+    now = time.time()
+    seq = self.nextvals("change_log_sq", 1)[0]
+    DatabaseRESTApi.executemany(self, """
+      insert into change_log (seq, ctime, tbl, api, item, op)
+      values (:seq, :ctime, :tbl, :api, :item, :op)
+      """, [{ "seq": seq, "ctime": now, "tbl": t, "api": "", "item": "", "op": "" }
+            for t in sorted(modified)]
+         + [{ "seq": seq, "ctime": now, "tbl": "", "api": api, "item": item, "op": op }
+            for api, item, op in changed])
+    if seq % 1000 == 0:
+      DatabaseRESTApi.execute(self, "delete from change_log where ctime < :old",
+                              old = now - self._changetime)
+
+  def _changes(self, tables, match, select, sql, *binds, **kwbinds):
+    """Return the changes to the result of query `sql` since the client
+    token given in the ``since`` request argument, filtered by `match`.
+
+    The tokens are sequence numbers in the change log, see :meth:`changed`,
+    so they are valid on all the servers. The change log and the result are
+    read in one snapshot, see :meth:`snapshot`, so the result includes all
+    the changes logged. The token returned is the last one logged at least
+    `changesettle` seconds ago, so changes from transactions which commit
+    in a different order than they got their sequence numbers are not
+    missed; more recent changes are returned again next time.
+
+    The result has an extra first column *change*, with value "insert",
+    "update" or "delete", followed by the row values. For each key, as
+    declared by the entity with ``@restcall(changes = [...])``, changed
+    since the token, all the current rows with that key are returned, as
+    "insert" if the key was new or "update" otherwise. If there are no
+    rows with the key any more, one "delete" row with just the key values
+    is returned. The current token is returned as *sequence* in the
+    response description, to be used as ``since`` next time. If the token
+    is unknown or too old, or the changes since were not recorded row by
+    row, the full result is returned as "insert" rows instead, and the
+    description has *reset* set to true. Clients start by passing "0"."""
+    api, keys = request.db["feed"]
+    since = int(request.db["since"])
+    self.snapshot(list(tables) + ["change_log"], fresh = True)
+    c, _ = self.execute("""
+      select min(seq), max(seq), max(case when ctime < :settled then seq end)
+      from change_log
+      """, settled = time.time() - self._changesettle)
+    first, last, settled = c.fetchall()[0]
+    logged = None
+    if since and first is not None and first <= since <= last:
+      logged = self._logged(api, keys, tables, since)
+
+    if logged == []:
+      changes = []
+      entry = self.lookup(sql, *binds, **kwbinds)
+      if entry:
+        columns = entry.columns
+      else:
+        c, _ = self.execute(sql, *binds, **kwbinds)
+        columns = [x[0].lower() for x in c.description]
+    else:
+      entry = self.cached(tables, sql, *binds, **kwbinds)
+      columns = entry.columns
+      if logged is None:
+        changes = [("insert", row) for row in entry.rows]
+      else:
+        changes = self._changed_rows(entry, keys, logged)
+
+    request.rest_generate_preamble["columns"] = ["change"] + columns
+    request.rest_generate_preamble["sequence"] = str(max(since, settled or 0))
+    request.rest_generate_preamble["reset"] = logged is None
+    response.headers["Cache-Control"] = "no-cache"
+    return rows([op] + list(row) for op, row in changes
+                if not match or select(row) is None or match.match(select(row)))
+
+  def _logged(self, api, keys, tables, since):
+    """Return the changes to the result of entity `api`, which reads
+    `tables`, logged after sequence number `since`, as a list of *(item,
+    op)* in the order logged. Returns None if any transaction since
+    modified the tables without recording the changes to the result, or
+    the entity does not declare the `keys` of its result rows."""
+    tables = sorted(tables)
+    binds = dict(("t%d" % n, t) for n, t in enumerate(tables))
+    c, _ = self.execute("""
+      select seq, tbl, item, op from change_log
+      where seq > :since and (api = :api or tbl in (%s))
+      order by seq
+      """ % ", ".join(":t%d" % n for n in xrange(len(tables))),
+      since = since, api = api, **binds)
+    modified, recorded, changes = set(), set(), []
+    for seq, tbl, item, op in c:
+      if tbl:
+        modified.add(seq)
+      else:
+        recorded.add(seq)
+        if item:
+          changes.append((item, op))
+    if modified - recorded or (changes and not isinstance(keys, (list, tuple))):
+      return None
+    return changes
+
+  def _changed_rows(self, entry, keys, logged):
+    """Return the change feed rows for the `logged` changes, as returned
+    by :meth:`_logged`, to the result in cache `entry` whose rows have the
+    key columns `keys`. Returns a list of *(op, row)*."""
+    index = [entry.columns.index(k) for k in keys]
+    current = {}
+    for row in entry.rows:
+      current.setdefault(json.dumps([row[i] for i in index]), []).append(row)
+
+    order, first = [], {}
+    for item, op in logged:
+      if item not in first:
+        order.append(item)
+        first[item] = op
+
+    result = []
+    for item in order:
+      if item in current:
+        op = (first[item] == "insert" and "insert") or "update"
+        result.extend((op, row) for row in current[item])
+      elif first[item] != "insert":
+        row = [None] * len(entry.columns)
+        for i, value in zip(index, json.loads(item)):
+          row[i] = value
+        result.append(("delete", row))
+    return result
+
+  def _stream(self, tables, match, select, sql, *binds, **kwbinds):
+    """Execute query `sql` and return a generator which yields the rows,
+    filtered by `match` as in :func:`~.rxfilter`, as they are fetched from
+    the cursor. The rows are collected for the result cache meanwhile, and
+    once all have been fetched the result is added to the cache and the
+    requests waiting for this one to fill it are released, see
+    :meth:`_acquire`. If the response is not fully streamed out, for
+    example because the client disconnected, nothing is cached and the
+    waiting requests take over the fill. The same applies once the result
+    exceeds the cache row limit, after which the rows are no longer kept,
+    so memory use does not grow with the size of the result."""
+    instance = request.db["instance"]
+    key = self._cachekey(sql, binds, kwbinds)
+    stamp = self._stamp(tables)
+    c, _ = self.execute(sql, *binds, **kwbinds)
+    columns = [x[0].lower() for x in c.description]
+    request.rest_generate_preamble["columns"] = columns
+
+    def stream():
+      try:
+        result = []
+        while True:
+          batch = c.fetchmany()
+          if not batch:
+            break
+          if result is not None:
+            result.extend(batch)
+            if len(result) > self._cache.maxrows:
+              result = None
+              self._release(key)
+          for row in batch:
+            if not match or match.match(select(row)):
+              yield row
+        if result is not None:
+          request.db["entry"] = \
+            self._cache.put(instance, key, tables, stamp, columns, result)
+      finally:
+        self._release(key)
+
+    return stream()
+
+  def _dirty(self):
+    """Return True if the current transaction has uncommitted changes, or is
+    a batch of changes, in which case results read in it reflect changes
+    which may yet be rolled back. Such results must not be shared with other
+    requests through the result cache nor recorded in the change log."""
+    return bool(request.db.get("batch", False) or request.db.get("modified", None))
+
+  def _cachekey(self, sql, binds, kwbinds):
+    """Return the result cache key for query `sql` with bind values."""
+    return (sql, repr(binds), repr(sorted(kwbinds.items())))
+
+  def _acquire(self, sql, binds, kwbinds):
+    """Return the valid :class:`~.CacheEntry` for query `sql`, waiting for
+    any other request already executing the same query, or None if this
+    request should execute it; see :meth:`~.ResultCache.acquire`. If other
+    requests may wait for this one to fill the cache, the fill is recorded
+    in ``request.db["fills"]`` until :meth:`_release`. Requests asking for
+    fresh data never wait nor use the cached result."""
+    if self._fresh():
+      return None
+    key = self._cachekey(sql, binds, kwbinds)
+    if key in request.db["fills"]:
+      return None
+    entry, token = self._cache.acquire(request.db["instance"], key)
+    if token:
+      request.db["fills"][key] = token
+    return entry
+
+  def _release(self, key):
+    """Release the result cache fill for `key` taken by :meth:`_acquire`."""
+    token = request.db["fills"].pop(key, None)
+    if token:
+      self._cache.release(request.db["instance"], key, token)
+
+  def cached(self, tables, sql, *binds, **kwbinds):
+    """Return the result of query `sql` as a :class:`~.CacheEntry`, from the
+    result cache if possible, otherwise by executing the query and adding
+    the result to the cache. The table versions are captured before the
+    query is executed so that changes committed meanwhile cause the new
+    cache entry to be discarded. Within a transaction with uncommitted
+    changes the query is always executed, and the result not cached, see
+    :meth:`_dirty`.
+
+    :arg list tables: the tables the query reads.
+    :arg str sql: the query to execute.
+    :returns: the :class:`~.CacheEntry` for the query."""
+    instance = request.db["instance"]
+    key = self._cachekey(sql, binds, kwbinds)
+    if self._dirty():
+      c, _ = self.execute(sql, *binds, **kwbinds)
+      columns = [x[0].lower() for x in c.description]
+      entry = self._cache.transient(key, tables, columns, c.fetchall())
+      request.db["entry"] = entry
+      return entry
+
+    entry = self._acquire(sql, binds, kwbinds)
+    if not entry:
+      try:
+        stamp = self._stamp(tables)
+        c, _ = self.execute(sql, *binds, **kwbinds)
+        columns = [x[0].lower() for x in c.description]
+        entry = self._cache.put(instance, key, tables, stamp, columns, c.fetchall())
+      finally:
+        self._release(key)
+    request.db["entry"] = entry
+    return entry
+
+  def lookup(self, sql, *binds, **kwbinds):
+    """Return the currently valid :class:`~.CacheEntry` for query `sql`,
+    or None if the result is not in the cache or the transaction has
+    uncommitted changes, see :meth:`_dirty`. Never executes the query."""
+    if self._dirty():
+      return None
+    return self._cache.get(request.db["instance"],
+                           self._cachekey(sql, binds, kwbinds))
+
+  def patch(self, entry, tables, rows):
+    """Update cached result `entry` with `rows` after a change committed
+    with :meth:`commit` which invalidated `tables`. See
+    :meth:`~.ResultCache.patch`; returns the new entry or None. Does nothing
+    if the change is not committed yet, see :meth:`_dirty`."""
+    if self._dirty():
+      return None
+    return self._cache.patch(request.db["instance"], entry, tables, rows)
+
+  def sparse_update(self, current, update, assign, key, values, chunk = 500):
+    """Update only the columns which actually change, in rows identified by
+    argument `key`. The current values of the rows are read first, in chunks
+    of at most `chunk` keys; rows whose new values are all the same as the
+    current ones are not updated at all. The others are grouped by the set
+    of changed columns, and each group is updated with one array statement
+    setting just those columns. The change is then committed.
+
+    :arg str current: query returning the key and the current values of the
+      arguments, using the argument names as column labels, with a ``%s``
+      placeholder for the list of keys in an ``in (...)`` condition.
+    :arg str update: update statement with a ``%s`` placeholder for the
+      column assignments, identifying the row by the `key` bind variable.
+    :arg dict assign: SQL assignment for each argument, for example
+      ``"logourl = :logo_url"``.
+    :arg str key: name of the argument identifying the rows.
+    :arg dict values: lists of new values by argument name; must include
+      `key`, other arguments are optional and all must be equally long.
+    :returns: a list with a dict in which *modified* gives the number of
+      rows updated, and *unchanged* the number of rows already up to date.
+      It is an error to update a non-existent row."""
+    keys = values[key]
+    names = [n for n in values if n != key]
+    old = {}
+    for i in xrange(0, len(keys), chunk):
+      part = list(set(keys[i:i+chunk]))
+      binds = dict(("k%d" % n, k) for n, k in enumerate(part))
+      c, _ = self.execute(current % ", ".join(":k%d" % n for n in xrange(len(part))),
+                          **binds)
+      columns = [d[0].lower() for d in c.description]
+      for row in c:
+        row = dict(zip(columns, row))
+        old[row[key]] = row
+
+    new = {}
+    for i, k in enumerate(keys):
+      if k not in old:
+        raise MissingObject(info = "No such object: %s" % k)
+      row = new.setdefault(k, dict(old[k]))
+      for n in names:
+        row[n] = values[n][i]
+
+    groups = {}
+    for k, row in new.iteritems():
+      changed = tuple(n for n in names if (row[n] or None) != (old[k][n] or None))
+      if changed:
+        groups.setdefault(changed, []).append(dict((n, row[n]) for n in changed + (key,)))
+
+    modified = 0
+    for changed, binds in groups.iteritems():
+      c, _ = self.executemany(update % ", ".join(assign[n] for n in changed), binds)
+      self.rowstatus(c, len(binds))
+      modified += len(binds)
+
+    self.commit()
+    return rows([{ "modified": modified, "unchanged": len(new) - modified }])
+
+  def nextvals(self, sequence, count):
+    """Allocate `count` new values from database sequence `sequence` with
+    a single query, for bulk inserts whose dependent rows need to refer to
+    the new ids without looking them up again.
+
+    :arg str sequence: name of the sequence; must not be user input.
+    :arg int count: number of values to allocate.
+    :returns: list of the new values."""
+    if not count:
+      return []
+    c, _ = self.execute("select %s.nextval from dual connect by level <= :n"
+                        % sequence, n = count)
+    return [row[0] for row in c.fetchall()]
+
+  def commit(self):
+    """Commit the current transaction, recording it in the change log, see
+    :meth:`changed`, and invalidate the cached results which depend on the
+    tables modified in it. Does nothing within a batch of changes, see
+    :meth:`modify`.
+
+    :returns: the set of tables modified and invalidated."""
+    if request.db.get("batch", False):
+      return set()
+    modified = request.db.get("modified", set())
+    self._record(modified)
+    trace = request.db["handle"]["trace"]
+    trace and cherrypy.log("%s commit" % trace)
+    request.db["handle"]["connection"].commit()
+    self._invalidate()
+    return modified
+
+  def query(self, match, select, sql, *binds, **kwbinds):
+    """Query the database like the base class, but serve the result from
+    the result cache when the entity has declared the tables it reads, see
+    :meth:`cached`. The response gets validators for conditional requests,
+    see :meth:`_validators`. Simple `match` patterns are resolved with an
+    index on the cached result, see :meth:`~.CacheEntry.select`. If the
+    result is not in the cache, the rows are streamed out as they are
+    fetched from the database and added to the cache at the end, see
+    :meth:`_stream`, while concurrent requests for the same result wait
+    for it, see :meth:`_acquire`. Requests with the ``since`` argument get
+    the changes since then, see :meth:`_changes`."""
+    tables = request.db.get("tables", None)
+    if tables and request.db.get("since", None):
+      return self._changes(tables, match, select, sql, *binds, **kwbinds)
+    if not tables or not self._cache.maxage or self._dirty():
+      return DatabaseRESTApi.query(self, match, select, sql, *binds, **kwbinds)
+
+    entry = self._acquire(sql, binds, kwbinds)
+    if not entry:
+      return self._stream(tables, match, select, sql, *binds, **kwbinds)
+
+    if request.db.get("snapshot", None) is None:
+      self._validators(entry, match)
+    request.rest_generate_preamble["columns"] = entry.columns
+    if not match:
+      return PayloadRows(entry)
+    matched = entry.select(match, select)
+    if matched is None:
+      return rxfilter(match, select, entry.rows)
+    return rows(matched)
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -30,7 +30,7 @@ class Accounts(RESTEntity):
       validate_strlist('username', param, safe, RX_USER)
       authz_match(role=["Global Admin"], group=["global"])
 
-  @restcall
+  @restcall(tables = ["user_passwd"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve accounts. The results aren't ordered in any particular way.
@@ -0,0 +1,94 @@
+from WMCore.REST.Server import RESTEntity, RESTArgs, restcall, rows
+from WMCore.REST.Error import InvalidParameter
+from WMCore.REST.Validation import *
+from cherrypy import request
+import json
+
+#: Maximum number of operations in one batch.
+MAX_OPERATIONS = 1000
+
+#: Methods which can be used in batch operations.
+BATCH_METHODS = ("PUT", "POST", "DELETE")
+
+#: Entities which cannot be used in batch operations, as they manage their
+#: own transactions.
+BATCH_EXCLUDED = ("batch", "ldapsync", "rebusfetch")
+
+def _argvalue(value):
+  """Convert a JSON argument value to what the entity validation expects of
+  request arguments: an utf-8 string, or a list of them."""
+  if isinstance(value, list):
+    return [_argvalue(v) for v in value]
+  elif isinstance(value, unicode):
+    return value.encode("utf-8")
+  elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+    return repr(value)
+  elif isinstance(value, str):
+    return value
+  raise InvalidParameter("Incorrect 'operations' argument value")
+
+class Batch(RESTEntity):
+  """REST entity for making changes to several other entities in a single
+  transaction.
+
+  ==================== ========================= ==================================== ====================
+  Contents             Meaning                   Value                                Constraints
+  ==================== ========================= ==================================== ====================
+  *operations*         changes to make           JSON list of operations              required
+  ==================== ========================= ==================================== ====================
+
+  Each operation is a JSON object with ``method``, one of PUT, POST or
+  DELETE, ``entity``, the name of the entity, and ``args``, an object with
+  the arguments exactly as they would be given to the entity directly; the
+  values are strings, numbers or lists of them."""
+  def validate(self, apiobj, method, api, param, safe):
+    """Validate request input data. Each operation is validated, and
+    authorised as far as possible, by its own entity."""
+    if method == 'POST':
+      try:
+        ops = json.loads(param.kwargs.pop('operations', None) or "null")
+      except (TypeError, ValueError):
+        raise InvalidParameter("Incorrect 'operations' parameter")
+      if not isinstance(ops, list) or not 0 < len(ops) <= MAX_OPERATIONS:
+        raise InvalidParameter("Incorrect 'operations' parameter")
+
+      operations = []
+      for op in ops:
+        if not isinstance(op, dict) \
+           or op.get("method", None) not in BATCH_METHODS \
+           or not isinstance(op.get("entity", None), basestring) \
+           or op["entity"] in BATCH_EXCLUDED \
+           or op["entity"] not in self.api.methods.get(op["method"], {}) \
+           or not isinstance(op.get("args", {}), dict):
+          raise InvalidParameter("Incorrect 'operations' parameter")
+
+        opmethod, name = str(op["method"]), str(op["entity"])
+        opapi = self.api.methods[opmethod][name]
+        opargs = dict((str(k), _argvalue(v)) for k, v in op.get("args", {}).iteritems())
+        opparam, opsafe = RESTArgs([], opargs), RESTArgs([], {})
+        opapi["entity"].validate(opapi, opmethod, name, opparam, opsafe)
+        validate_no_more_input(opparam)
+        operations.append((opmethod, name, opapi, opsafe))
+
+      safe.kwargs['operations'] = operations
+
+  @restcall
+  def post(self, operations):
+    """Make several changes in one transaction. The operations are executed
+    in order on the same database connection, and committed together once
+    all of them have succeeded. If any of them fails, none of the changes
+    are made, and the error of the failed operation is returned.
+
+    :arg list operations: validated operations.
+    :returns: sequence of one dictionary per operation, in the order given,
+              with keys ``method``, ``entity`` and ``result``, the latter the
+              result the operation would return by itself."""
+    result = []
+    request.db["batch"] = True
+    for method, name, apiobj, safe in operations:
+      call = getattr(apiobj["entity"], method.lower())
+      result.append({ "method": method, "entity": name,
+                      "result": list(call(*safe.args, **safe.kwargs)) })
+    request.db["batch"] = False
+    self.api.commit()
+    return rows(result)
@@ -0,0 +1,106 @@
+from WMCore.REST.Server import RESTEntity, RESTArgs, restcall, rows
+from WMCore.REST.Tools import tools
+from WMCore.REST.Validation import *
+from cherrypy import request, response
+import hashlib, re
+
+#: Entities which can be retrieved with the bundle, in the default order.
+ITEMS = ("whoami", "roles", "groups", "people", "sites", "site-names",
+         "site-resources", "site-associations", "resource-pledges",
+         "pinned-software", "site-responsibilities", "group-responsibilities",
+         "data-responsibilities", "federations", "federations-sites",
+         "federations-pledges", "esp-credit", "data-processing")
+
+#: Regular expression for bundle item names.
+RX_ITEM = re.compile(r"^(?:%s)$" % "|".join(ITEMS))
+
+#: Regular expression for bundle item versions: "item:version".
+RX_ITEM_VERSION = re.compile(r"^(?:%s):[0-9a-f]{40}$" % "|".join(ITEMS))
+
+class Bundle(RESTEntity):
+  """REST entity for retrieving several other entities in one request.
+
+  ==================== ========================= ==================================== ====================
+  Contents             Meaning                   Value                                Constraints
+  ==================== ========================= ==================================== ====================
+  *item*               entity name               string matching :obj:`.RX_ITEM`      optional, multiple
+  *version*            version client has        "item:version" string                optional, multiple
+  ==================== ========================= ==================================== ====================
+  """
+  #: Number of times to read the entities before bypassing the result cache.
+  _attempts = 3
+
+  def validate(self, apiobj, method, api, param, safe):
+    """Validate request input data."""
+    if method in ('GET', 'HEAD'):
+      validate_strlist('item', param, safe, RX_ITEM)
+      validate_strlist('version', param, safe, RX_ITEM_VERSION)
+
+  @restcall
+  @tools.expires(secs=-1)
+  def get(self, item, version):
+    """Retrieve the contents of several entities at once. All the entities
+    are read from one consistent database snapshot. Each entity is
+    retrieved like its own GET would, from the result cache if possible,
+    but if the cached results turn out not to match the snapshot, all
+    the entities are read again.
+
+    Each entity is returned as one dictionary with keys ``item`` for the
+    entity name, ``version`` for the version of its contents, ``changed``,
+    ``columns`` for the column names, and ``result`` for the rows as they
+    would be returned by the entity itself. If the client passed the same
+    version for the item in `version`, ``changed`` is false and ``columns``
+    and ``result`` are null.
+
+    :arg list item: names of the entities to retrieve; all if empty.
+    :arg list version: "item:version" of the entity contents the client
+      already has.
+    :returns: sequence of one dictionary per item, in the order requested."""
+    known = dict(v.split(":", 1) for v in version)
+    names = item or ITEMS
+    tables = sum((self.api.methods["GET"][name].get("tables", None) or []
+                  for name in names), [])
+    for attempt in xrange(self._attempts):
+      # The last attempt reads everything from the snapshot.
+      last = (attempt == self._attempts - 1)
+      self.api.snapshot(tables, fresh = last)
+      result = []
+      for name in names:
+        columns, data, digest = self._fetch(name)
+        changed = known.get(name, None) != digest
+        result.append({ "item": name, "version": digest, "changed": changed,
+                        "columns": (changed and columns) or None,
+                        "result": (changed and data) or None })
+      if last or not self.api.snapshot_changed():
+        break
+
+    request.rest_generate_preamble.pop("columns", None)
+    etag = hashlib.sha1(repr(([(r["item"], r["version"], r["changed"])
+                               for r in result],
+                              request.user["dn"], request.user["login"],
+                              request.headers.get("Accept", None),
+                              request.headers.get("Accept-Encoding", None))))
+    response.headers["ETag"] = '"%s"' % etag.hexdigest()
+    response.headers.pop("Last-Modified", None)
+    response.headers.pop("Cache-Control", None)
+    return rows(result)
+
+  def _fetch(self, name):
+    """Retrieve the contents of entity `name` by invoking its GET method
+    with the default arguments, in the snapshot of the request. Returns
+    a tuple of the column names, the rows, and the version of the
+    contents."""
+    apiobj = self.api.methods["GET"][name]
+    safe = RESTArgs([], {})
+    apiobj["entity"].validate(apiobj, "GET", name, RESTArgs([], {}), safe)
+    request.db["tables"] = apiobj.get("tables", None)
+    request.db["entry"] = None
+    request.rest_generate_preamble.pop("columns", None)
+    data = list(apiobj["entity"].get(*safe.args, **safe.kwargs))
+    columns = request.rest_generate_preamble.get("columns", None)
+    entry = request.db["entry"]
+    if entry:
+      digest = entry.digest
+    else:
+      digest = hashlib.sha1(repr((columns, data))).hexdigest()
+    return columns, data, digest
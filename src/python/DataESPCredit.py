@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -25,9 +25,10 @@ Contents             Meaning                   Value
       validate_strlist('site', param, safe, RX_LABEL)
       validate_reallist('value', param, safe, minval = 0.)
       validate_strlist('year', param, safe, RX_YEARS)
+      validate_lengths(safe, 'site', 'value', 'year')
       authz_match(role=["Global Admin"], group=["global"])
 
-  @restcall
+  @restcall(tables = ["sites_esp_credits"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve all sites ESP Credits values and years. The results aren`t ordered in any particular way
@@ -39,37 +40,21 @@ Contents             Meaning                   Value
 
   @restcall
   def put(self, site, value, year):
-    """Insert new ESP Credit value, or update old one. History is not implemented. Always rewriting and showing the newest value
+    """Insert new ESP Credit values, or update the existing ones for the same
+    site and year. History is not implemented; the newest value is kept.
+    When more than one argument is given, there must be an equal number of
+    arguments for all the parameters; all the values are stored with one
+    array operation.
 
     :arg list site: site canonical name;
     :arg list value: new values;
     :arg list year: new values;
     :returns: a list with dict in which *modified* gives number of objects updated or
-              inserted in database"""
-    current = {}
-    siten = site[0]
-    valuen = value[0]
-    yearn = year[0]
-    c, _ = self.api.execute("""select site, year, esp_credit from sites_esp_credits""")
-    for row in c:
-      site_r, year_r, esp_credit_r = row
-      if site_r in current.keys():
-        if year_r in current[site_r].keys():
-          cherrypy.log('ERROR, Dublicate value in database!')
-        else:
-          current[site_r][str(year_r)] = {'espcredit': esp_credit_r };
-      else:
-        current[site_r] = {str(year_r) : {'espcredit': esp_credit_r}};
-    cherrypy.log('ALL from database %s' % current.keys())
-    if siten in current.keys():
-      if yearn in current[siten].keys():
-        return self.api.modify("""update sites_esp_credits set esp_credit = :esp_credit where site= :site and year = :year """,
-                             esp_credit = value, site = site, year = year)
-      else:
-        return self.api.modify("""Insert into sites_esp_credits(id, site, year, esp_credit)
-                           values(sites_esp_credits_sq.nextval, :site, :year, :esp_credit)
-                        """, site = site, year = year, esp_credit = value)
-    else:
-      return self.api.modify("""Insert into sites_esp_credits(id, site, year, esp_credit)
-                         values(sites_esp_credits_sq.nextval, :site, :year, :esp_credit)
-                      """, site = site, year = year, esp_credit = value)
+              inserted in database, which is always *len(site)*."""
+    return self.api.modify("""
+      merge into sites_esp_credits e
+      using dual on (e.site = :site and e.year = :year)
+      when matched then update set e.esp_credit = :esp_credit
+      when not matched then insert (id, site, year, esp_credit)
+        values (sites_esp_credits_sq.nextval, :site, :year, :esp_credit)
+      """, site = site, year = year, esp_credit = value)
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -19,7 +19,8 @@ Contents             Meaning                   Value
     if method in ('GET', 'HEAD'):
       validate_rx('match', param, safe, optional = True)
 
-  @restcall
+  @restcall(tables = ["federations_pledges", "all_federations_names"],
+            changes = ["name", "year"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve federations pledges. The results aren't ordered in any particular way.
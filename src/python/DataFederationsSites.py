@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -28,7 +28,8 @@ Contents             Meaning                   Value
       validate_strlist('site_id', param, safe, RX_LABEL)
       authz_match(role=["Global Admin"], group=["global"])
 
-  @restcall
+  @restcall(tables = ["site", "site_cms_name_map", "cms_name",
+                      "sites_federations_names_map"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve federations sites associations. The results aren't ordered in any particular way.
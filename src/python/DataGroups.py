@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -23,7 +23,7 @@ class Groups(RESTEntity):
       validate_strlist('name', param, safe, RX_LABEL)
       authz_match(role="Global Admin", group="global")
 
-  @restcall
+  @restcall(tables = ["user_group"], changes = ["name"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve user groups. The results aren't ordered in any particular way.
@@ -42,6 +42,8 @@ class Groups(RESTEntity):
     :arg list name: names to insert.
     :returns: a list with a dict in which *modified* gives number of objects
               inserted into the database, which is always *len(name).*"""
+    self.api.changed("groups", "insert", name)
+    self.api.changed("group-responsibilities")
     return self.api.modify("""
       insert into user_group (name, id)
       values (:name, user_group_sq.nextval)
@@ -56,4 +58,5 @@ class Groups(RESTEntity):
     :arg list name: names to delete.
     :returns: a list with a dict in which *modified* gives number of objects
               deleted from the database, which is always *len(name).*"""
+    self.api.changed("groups", "delete", name)
     return self.api.modify("delete from user_group where name = :name", name = name)
@@ -1,12 +1,14 @@
-import os, sys, time, pycurl, re, string, random, cherrypy, urllib, ldap, collections
+import os, sys, time, calendar, pycurl, re, string, random, cherrypy, urllib, ldap, collections, json
 from WMCore.REST.Server import RESTEntity, restcall
 from WMCore.REST.Test import fake_authz_headers
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Validation import *
 from WMCore.REST.Error import *
 from SiteDB.Regexps import *
+from SiteDB.DataPeople import RESPONSIBILITIES
 from SiteDB.HTTPRequest import RequestManager
-from threading import Thread, Condition
+from threading import Thread, Condition, Event, Lock
+from Queue import Queue, Full
 from traceback import format_exc
 from cStringIO import StringIO
 
@@ -18,11 +20,15 @@ class LdapSync(RESTEntity):
   def __init__(self, app, api, config, mount):
     RESTEntity.__init__(self, app, api, config, mount)
     if getattr(config, "ldapsync", False):
-      self._syncer = LdapSyncThread(app, config.ldapsync, mount,
+      self._syncer = LdapSyncThread(app, self, config.ldapsync, mount,
                            cacertdir = getattr(config, "cacertdir",
                                            "/etc/grid-security/certificates"),
                            minreq = getattr(config, "ldsyncreq", 1000),
                            interval = getattr(config, "ldsynctime", 300),
+                           fullinterval = getattr(config, "ldsyncfull", 86400),
+                           overlap = getattr(config, "ldsyncoverlap", 900),
+                           direct = getattr(config, "ldsyncdirect", True),
+                           parts = getattr(config, "ldsyncparts", 1),
                            instance = getattr(config, "ldsyncto", "test"))
     else:
       self._syncer = None
@@ -41,7 +47,12 @@ class LdapSync(RESTEntity):
       validate_ustrlist('name',     param, safe, RX_NAME)
       validate_ustrlist('dn',       param, safe, RX_DN)
       validate_lengths(safe, 'username', 'passwd', 'email', 'name', 'dn')
+      validate_str('incremental', param, safe, RX_YES_NO, optional=True)
 
+    elif method == "POST":
+      validate_strlist ('username', param, safe, RX_USER)
+
+    if method in ("PUT", "POST", "DELETE"):
       authz = cherrypy.request.user
       if authz['method'] != 'Internal' or authz['login'] != self._syncer.sectoken:
         raise cherrypy.HTTPError(403, "You are not allowed to access this resource.")
@@ -52,36 +63,128 @@ class LdapSync(RESTEntity):
     return [self._syncer.status()]
 
   @restcall
-  def put(self, username, passwd, email, name, dn):
-    """Perform a full synchronisation.
+  def put(self, username, passwd, email, name, dn, incremental):
+    """Perform a full or incremental synchronisation.
 
     :arg list username: accounts to modify.
     :arg list dn: encrypted passwords.
     :arg list email: emails.
     :arg list name: names.
+    :arg str incremental: if "y", the accounts are only those changed
+      recently, and accounts not included are not deleted.
     :returns: nothing."""
     ldrows = self.api.bindmap(username=username, passwd=passwd, email=email, name=name, dn=dn)
-    passwords, contacts, deletions = self._merge(self._current(), ldrows)
-    self._update(passwords, contacts, deletions)
+    self.apply(ldrows, incremental == "y")
     return []
 
-  def _current(self):
-    """Return the current user information from the database."""
+  @restcall
+  def post(self, username):
+    """Find the accounts not yet in the database, so the synchronisation
+    can add accounts which joined the authorised e-group without changing.
+
+    :arg list username: accounts found in LDAP.
+    :returns: the accounts among `username` not in the database."""
+    return self.missing(username)
+
+  @restcall
+  def delete(self):
+    """Delete the accounts no longer in LDAP, finishing a full synchronisation
+    whose accounts were updated incrementally.
+
+    :returns: nothing."""
+    self.prune()
+    return []
+
+  def apply(self, ldrows, incremental):
+    """Synchronise the database with the LDAP accounts `ldrows`, a list of
+    dictionaries with the keys of :meth:`put` arguments. If `incremental`
+    is true, only the accounts in `ldrows` are compared and none deleted,
+    otherwise the accounts not in `ldrows` are deleted. Used by :meth:`put`
+    and directly by the synchronisation thread."""
+    if incremental:
+      current = self._current([row["username"] for row in ldrows])
+      passwords, contacts, _ = self._merge(current, ldrows)
+      deletions = []
+    else:
+      current = self._current()
+      passwords, contacts, deletions = self._merge(current, ldrows)
+
+    people = set(u for u, info in current.iteritems() if info["email"] is not None)
+    self.api.changed("people", "insert",
+                     [c["username"] for c in contacts if c["username"] not in people])
+    self.api.changed("people", "update",
+                     [c["username"] for c in contacts if c["username"] in people])
+    self._update(passwords, contacts, deletions)
+
+  def prune(self, chunk = 200):
+    """Delete the accounts which are no longer enabled members of the
+    authorised e-group in LDAP, except service accounts. The accounts in
+    the database are checked against LDAP `chunk` at a time, so neither
+    list is held in memory in full. Refuses to delete anything if LDAP
+    finds none of a chunk of more than ten accounts, as LDAP is then not
+    answering properly. Used by :meth:`delete` and directly by the
+    synchronisation thread."""
+    c, _ = self.api.execute("select username from user_passwd")
+    deletions = []
+    while True:
+      rows = c.fetchmany(chunk)
+      if not rows:
+        break
+      names = [u for u, in rows if u.find("@") < 0]
+      query = [u for u in names if RX_USER.match(u)]
+      members = set(query and self._syncer.members(query))
+      if len(query) > 10 and not members:
+        raise RuntimeError("LDAP found none of %d accounts, refusing to"
+                           " delete any" % len(query))
+      deletions.extend({ "username": u } for u in names if u not in members)
+    self._update([], [], deletions)
+
+  def missing(self, usernames, chunk = 500):
+    """Return the accounts in `usernames` not in the database, looked up
+    `chunk` at a time. Used by :meth:`post` and directly by the
+    synchronisation thread."""
+    known = set()
+    for query, binds in self._chunks("select username from user_passwd",
+                                     "username", usernames, chunk):
+      c, _ = self.api.execute(query, **binds)
+      known.update(u for u, in c)
+    return [u for u in usernames if u not in known]
+
+  def _chunks(self, sql, column, usernames, chunk):
+    """Return `(sql, binds)` queries restricting `sql` to `column` values
+    among `usernames`, at most `chunk` per query."""
+    queries = []
+    for i in xrange(0, len(usernames), chunk):
+      part = usernames[i:i+chunk]
+      queries.append((sql + " where %s in (%s)"
+                      % (column, ", ".join(":u%d" % n for n in xrange(len(part)))),
+                      dict(("u%d" % n, u) for n, u in enumerate(part))))
+    return queries
+
+  def _current(self, usernames = None, chunk = 500):
+    """Return the current user information from the database, for all the
+    users or only those in `usernames`, looked up `chunk` at a time."""
+    sql = """select u.username, u.passwd, c.email,
+                    to_nchar(c.forename),
+                    to_nchar(c.surname),
+                    c.dn
+             from user_passwd u
+             left join contact c
+               on c.username = u.username"""
+    if usernames is None:
+      queries = [(sql, {})]
+    else:
+      queries = self._chunks(sql, "u.username", usernames, chunk)
+
     users = {}
-    c, _ = self.api.execute("""select u.username, u.passwd, c.email,
-                                      to_nchar(c.forename),
-                                      to_nchar(c.surname),
-                                      c.dn
-                               from user_passwd u
-                               left join contact c
-                                 on c.username = u.username""")
-
-    for row in c:
-      username, passwd, email, forename, surname, dn = row
-      users[username] = { "username": username, "passwd": passwd,
-                          "forename": forename, "surname": surname,
-                          "name": " ".join([x for x in forename, surname if x]),
-                          "email": email, "dn": dn }
+    for query, binds in queries:
+      c, _ = self.api.execute(query, **binds)
+      for row in c:
+        username, passwd, email, forename, surname, dn = row
+        users[username] = { "username": username, "passwd": passwd,
+                            "forename": forename, "surname": surname,
+                            "name": " ".join([x for x in forename, surname if x]),
+                            "email": email, "dn": dn }
     return users
 
   def _update(self, passwords, contacts, deletions):
@@ -99,36 +202,37 @@ class LdapSync(RESTEntity):
                                 set u.passwd = :passwd
                            """, passwords)
 
-    for contact in contacts:
-      try:
-        self.api.execute("""merge into contact c
-                            using dual on (c.username = :username)
-                            when not matched then
-                              insert (id, username, forename, surname, email, dn)
-                              values (contact_sq.nextval, :username, :forename,
-                                      :surname, :email, :dn)
-                            when matched then update
-                              set c.forename = :forename,
-                                  c.surname = :surname,
-                                  c.email = :email,
-                                  c.dn = :dn
-                         """, contact)
-      except Exception as e:
-        # Ignore constraint errors for individual users instead of failing
+    if contacts:
+      # Merge all contacts in one array operation. Constraint errors for
+      # individual users are reported per row instead of failing the lot.
+      c, _ = self.api.executemany("""merge into contact c
+                                     using dual on (c.username = :username)
+                                     when not matched then
+                                       insert (id, username, forename, surname, email, dn)
+                                       values (contact_sq.nextval, :username, :forename,
+                                               :surname, :email, :dn)
+                                     when matched then update
+                                       set c.forename = :forename,
+                                           c.surname = :surname,
+                                           c.email = :email,
+                                           c.dn = :dn
+                                  """, contacts, batcherrors = True)
+      for e in c.getbatcherrors():
+        contact = contacts[e.offset]
         cherrypy.log("WARNING: failed to update user %s, DN %s: %s"
-                     %(contact['username'], contact['dn'], str(e)))
-        continue
+                     %(contact['username'], contact['dn'], str(e.message).strip()))
 
     if deletions:
+      self.api.changed("people", "delete", [d["username"] for d in deletions])
       self.api.executemany("""delete from user_passwd
                               where username = :username
                            """, deletions)
       self.api.execute("delete from contact where username is null")
+    else:
+      self.api.changed(RESPONSIBILITIES)
 
     if passwords or contacts or deletions:
-      trace = cherrypy.request.db["handle"]["trace"]
-      trace and cherrypy.log("%s commit" % trace)
-      cherrypy.request.db["handle"]["connection"].commit()
+      self.api.commit()
 
   def _merge(self, users, ldrows):
     """Merge `ldrows` output into `users`. Returns tuple `(passwords,
@@ -174,18 +278,49 @@ class LdapSync(RESTEntity):
 
 class LdapSyncThread(Thread):
   """A task thread to synchronise SiteDB from CERN/LDAP. This runs on
-  a single node only in the cluster."""
+  a single node only in the cluster.
+
+  Most synchronisations are incremental: only the accounts changed in LDAP
+  since the last synchronisation, as told by ``whenChanged``, are fetched
+  and updated. Accounts newly added to the authorised e-group do not
+  necessarily change, so incremental synchronisations also list just the
+  names of all the members, and fetch in full those not yet in the
+  database. A full synchronisation, which also removes accounts no longer
+  in LDAP, is made every `fullinterval` seconds.
+
+  If `direct` is true the changes are applied by calling the `entity`
+  methods in this thread on a database connection of its own, otherwise
+  with internal REST API requests to the entity.
+
+  The LDAP search can be split into `parts` partitions by account name,
+  which are then searched in parallel on a pool of reused connections."""
 
   _baseurl = "ldaps://xldap.cern.ch:636"
   _ident = "SiteDB/%s Python/%s" % \
            (os.environ["SITEDB_VERSION"], ".".join(map(str, sys.version_info[:3])))
 
+  # Initials at which account name partitions can start, in LDAP order.
+  _initials = "abcdefghijklmnopqrstuvwxyz"
+
+  # Filter for the members of the authorised e-group, including via nested groups.
+  _ldgroup = '(memberOf:1.2.840.113556.1.4.1941:=CN=cms-authorized-users,OU=e-groups,OU=Workgroups,DC=cern,DC=ch)'
+
+  # Account attributes to fetch, and those enough to tell new members.
+  _ldattrs = ['sAMAccountName','displayName','employeeID','mail','altSecurityIdentities','userAccountControl','whenChanged']
+  _ldnames = ['sAMAccountName','userAccountControl']
+
+  # Number of new members to fetch per search.
+  _ldbatch = 100
+
   # The buggy ca.cern.ch user interface allows to put anything, so some users
   # have uploaded CA certificates or even SSH keys. So try to ignore them.
   RX_ALTDN = re.compile(r"(?iu)^X509:.*<S>(([A-Z]+=([-\w _@'.()/]+),?)*(?<!berosservice|CERN Root CA|on Authority|s,CN=lsfcert|s,CN=acronmc))$")
 
-  def __init__(self, app, baseurl, mount, cacertdir = "/etc/grid-security/certificates", minreq = 1000, interval = 300, instance = "test"):
+  def __init__(self, app, entity, baseurl, mount, cacertdir = "/etc/grid-security/certificates", minreq = 1000, interval = 300, fullinterval = 86400, overlap = 900, direct = True, parts = 1, instance = "test"):
     Thread.__init__(self, name = "LdapSync")
+    self._entity = entity
+    self._direct = direct
+    self._instance = instance
     self.sectoken = "".join(random.sample(string.letters, 30))
     self._inturl = "http://localhost:%d%s/%s/ldapsync" % \
                    (app.srvconfig.port, mount, instance)
@@ -201,10 +336,18 @@ class LdapSyncThread(Thread):
       self._baseurl = baseurl
 
     self._cacertdir = cacertdir
+    self._parts = parts
+    self._ldlock = Lock()
+    self._ldidle = []
     self._minreq = minreq
     self._interval = interval
+    self._fullinterval = fullinterval
+    self._overlap = overlap
     self._stopme = False
-    self._full = (0, [], [])
+    self._full = (0, 0, 0)
+    self._incremental = (0, 0, 0)
+    self._lastfull = 0
+    self._highmark = 0
     self._warnings = {}
 
     self._intreq = RequestManager(num_connections = 2,
@@ -216,10 +359,11 @@ class LdapSyncThread(Thread):
     cherrypy.engine.subscribe("start", self.start)
 
   def status(self):
-    """Get the processing status. Returns time of last successful full
+    """Get the processing status. Returns the time, number of valid users
+    and number of LDAP entries of the last successful full and incremental
     synchronisation with CERN/LDAP."""
     with self._cv:
-      return self._full[:]
+      return { "full": self._full[:], "incremental": self._incremental[:] }
 
   def stop(self, *args):
     """Tell the task thread to quit."""
@@ -266,20 +410,18 @@ class LdapSyncThread(Thread):
       self._warnings[input] = now
     return None
     
-  def _sync(self, now):
-    """Perform full synchronisation."""
-
-    # Delete warnings older than 24 hours
-    for k, v in self._warnings.items():
-      if v < now - 86400:
-        del self._warnings[k]
-
-    # Get the user information from CERN/LDAP
-    ldresult = self._ldget(self._baseurl)
-
-    # Process each user record returned
-    rows = []
-    for (dn, attrs) in ldresult:
+  def _changed(self, attrs):
+    """Return the ``whenChanged`` time of LDAP entry `attrs` as seconds
+    since the epoch, or zero if it is missing or invalid."""
+    try:
+      return calendar.timegm(time.strptime(attrs['whenChanged'][0][:14], "%Y%m%d%H%M%S"))
+    except (KeyError, IndexError, ValueError):
+      return 0
+
+  def _users(self, entries, now):
+    """Generator over the valid, enabled user accounts in LDAP `entries`,
+    yielding a dictionary of the account data to synchronise for each."""
+    for (dn, attrs) in entries:
       u = { 'username': attrs['sAMAccountName'][0],
             'passwd'  : 'NeedsToBeUpdated',
             'dn'      : dn,
@@ -312,51 +454,285 @@ class LdapSyncThread(Thread):
             newdn = m.group(1)
         u['dn'] = '/'+newdn.replace(',','/')
 
-        # add this user to the bulk data to be updated
-        rows.append(u)
-
-    # check number of rows is sane
-    if len(rows) < self._minreq:
-      cherrypy.log("ERROR: cowardly refusing full ldap synchronisation"
-                   " with only %d users received, fewer than required %d"
-                   % (len(rows), self._minreq))
-      return
-    cherrypy.log("INFO: found %d valid users in ldap" % len(rows))
+        # Check the final DN like the REST API validation would.
+        if not self._validate(u['dn'], basestring, RX_DN, now):
+          cherrypy.log('WARNING: ignoring user with invalid DN: %s' % u['username'])
+          continue
+        yield u
+
+  def _members(self, entries, now):
+    """Return the names of the enabled accounts with valid names in LDAP
+    `entries` fetched with the attributes :attr:`_ldnames`."""
+    return [attrs['sAMAccountName'][0] for _, attrs in entries
+            if attrs.get('userAccountControl', [None])[0] == '512'
+            and self._validate(attrs['sAMAccountName'][0], str, RX_USER, now)]
+
+  def members(self, names):
+    """Return those of the account `names`, which must be valid, which are
+    enabled members of the authorised e-group in LDAP. Used by the entity
+    to find the accounts to delete."""
+    now = time.time()
+    return sum((self._members(page, now) for page in
+                self._ldget(self._baseurl, names = names, attrs = self._ldnames)), [])
+
+  def _call(self, method, rows, incremental):
+    """Apply changes from `rows` like REST API call `method` would, either
+    directly or with an internal request. Returns the result of the call."""
+    if self._direct:
+      with self._entity.api.session(self._instance, self.__class__.__name__, method):
+        if method == "PUT":
+          return self._entity.apply([self._unicode(u) for u in rows], incremental)
+        elif method == "POST":
+          return self._entity.missing([u["username"] for u in rows])
+        else:
+          return self._entity.prune()
 
-    # do the internal api call for the bulk update
     result = []
-    self._intreq.put(("PUT", rows, result))
+    self._intreq.put((method, rows, result, incremental))
     self._intreq.process()
-    self._full = (now, rows, ldresult, result and result[0])
+    if not result:
+      raise RuntimeError("Internal %s request failed" % method)
+    return json.loads(result[0])["result"]
+
+  def _unicode(self, u):
+    """Return user data `u` with the values as the REST API validation
+    would leave them, the name and DN as unicode strings."""
+    u = dict(u)
+    for key in ('name', 'dn'):
+      if isinstance(u[key], str):
+        u[key] = u[key].decode("utf-8")
+    return u
 
-  def _ldget(self, url):
-    """Get data from LDAP."""
-    result = []
+  def _sync(self, now):
+    """Perform full or incremental synchronisation.
+
+    The LDAP results are processed one page at a time: the valid accounts
+    on each page are sent to the database right away as an incremental
+    update, so only a page of data is held in memory at once. A full
+    synchronisation first counts the enabled members, listing just their
+    names, and gives up before changing anything if there are fewer than
+    `minreq`. After the updates it has the entity delete the accounts no
+    longer in LDAP, see :meth:`LdapSync.prune`. An incremental one lists
+    the names of all the enabled members after the updates, and fetches
+    and adds those missing from the database."""
+
+    # Delete warnings older than 24 hours
+    for k, v in self._warnings.items():
+      if v < now - 86400:
+        del self._warnings[k]
+
+    # Get the user information from CERN/LDAP. Incremental updates fetch
+    # the entries changed since the latest change seen before, with some
+    # overlap to allow for replication delays between LDAP servers.
+    full = (not self._highmark or now >= self._lastfull + self._fullinterval)
+    since = (not full and self._highmark - self._overlap) or None
+
+    # check number of users is sane before changing anything
+    if full:
+      nmembers = sum(len(self._members(page, now)) for page in
+                     self._ldget(self._baseurl, attrs = self._ldnames))
+      if nmembers < self._minreq:
+        cherrypy.log("ERROR: cowardly refusing full ldap synchronisation"
+                     " with only %d users received, fewer than required %d"
+                     % (nmembers, self._minreq))
+        return
+
+    highmark, nentries, nusers = self._highmark, 0, 0
+    for page in self._ldget(self._baseurl, since):
+      nentries += len(page)
+      highmark = max([highmark] + [self._changed(attrs) for _, attrs in page])
+      rows = list(self._users(page, now))
+      nusers += len(rows)
+      if rows:
+        self._call("PUT", rows, True)
+
+    # pick up new members of the e-group whose entries did not change
+    if not full:
+      for page in self._ldget(self._baseurl, attrs = self._ldnames):
+        names = self._members(page, now)
+        added = (names and self._call("POST", [{ "username": u } for u in names], False)) or []
+        for i in xrange(0, len(added), self._ldbatch):
+          for entries in self._ldget(self._baseurl, names = added[i:i+self._ldbatch]):
+            nentries += len(entries)
+            rows = list(self._users(entries, now))
+            nusers += len(rows)
+            if rows:
+              self._call("PUT", rows, True)
+
+    cherrypy.log("INFO: found %d valid%s users in ldap"
+                 % (nusers, (not full and " changed or new") or ""))
+
+    # do the internal api call for deleting accounts no longer in ldap
+    if full:
+      self._call("DELETE", [], False)
+
+    with self._cv:
+      self._highmark = highmark
+      if full:
+        self._lastfull = now
+        self._full = (now, nusers, nentries)
+      else:
+        self._incremental = (now, nusers, nentries)
+
+  def _ldconnect(self, url, pooled = True):
+    """Get an idle LDAP connection to `url` from the pool, or make a new
+    one. Connections are kept open between synchronisations, so the TLS
+    session is set up only once per connection.
+
+    :arg str url: LDAP server URL.
+    :arg bool pooled: if False, always make a new connection.
+    :returns: tuple *(connection, pooled)*, the latter True if the
+      connection came from the pool."""
+    if pooled:
+      with self._ldlock:
+        for i, (u, l) in enumerate(self._ldidle):
+          if u == url:
+            del self._ldidle[i]
+            return l, True
 
-    ldap.set_option(ldap.OPT_X_TLS_CACERTDIR, self._cacertdir)
     l = ldap.initialize(url)
     l.protocol_version = ldap.VERSION3
+    return l, False
+
+  def _ldclose(self, l):
+    """Close LDAP connection `l`, ignoring errors."""
+    try:
+      l.unbind_s()
+    except ldap.LDAPError:
+      pass
+
+  def _ldsearch(self, url, ldfilter, attrs):
+    """Generator over pages of entries matching `ldfilter` in LDAP `url`,
+    with the attributes in the list `attrs`.
+    The connection is returned to the pool once all pages have been read,
+    and discarded if the search fails or is abandoned. If the server has
+    dropped a pooled connection, the search is retried once on a new one."""
+    l, pooled = self._ldconnect(url)
+    done = False
+    try:
+      # Fetch paged results from ldap server.
+      # This is needed because there is a size limit on the CERN ldap server
+      # side to return at most 1000 entries per request.
+      # For more information, see http://tools.ietf.org/html/rfc2696.html
+      srv_ctrls = [ldap.controls.SimplePagedResultsControl(criticality=False, cookie="")]
+      while True:
+        srv_ctrls[0].size = 1000 # dont necessarily need to match the server limit
+        try:
+          s = l.search_ext('OU=Users,OU=Organic Units,DC=cern,DC=ch',
+                           ldap.SCOPE_SUBTREE,
+                           ldfilter,
+                           attrs,
+                           serverctrls=srv_ctrls,
+                           sizelimit=0)
+          _, res_data, _, srv_ctrls = l.result3(s, timeout=100)
+        except ldap.SERVER_DOWN:
+          # The server may close idle connections. The paging cookie is
+          # only valid on the original connection, so retry only if the
+          # search had not returned anything yet.
+          if not pooled or srv_ctrls[0].cookie:
+            raise
+          cherrypy.log("WARNING: idle LDAP connection to %s lost, reconnecting" % url)
+          self._ldclose(l)
+          l, pooled = self._ldconnect(url, False)
+          continue
+        yield res_data
+        if not srv_ctrls[0].cookie: break
+      done = True
+    finally:
+      if done:
+        with self._ldlock:
+          self._ldidle.append((url, l))
+      else:
+        self._ldclose(l)
+
+  def _ldpartitions(self):
+    """Return the LDAP filters splitting the accounts into `self._parts`
+    disjoint ranges of ``sAMAccountName``, which together cover all names."""
+    n = max(1, min(self._parts, len(self._initials)))
+    bounds = [self._initials[i * len(self._initials) / n] for i in xrange(1, n)]
+    lower = [None] + bounds
+    upper = bounds + [None]
+    return ["".join([(lo and "(sAMAccountName>=%s)" % lo) or "",
+                     (hi and "(!(sAMAccountName>=%s))" % hi) or ""])
+            for lo, hi in zip(lower, upper)]
+
+  def _ldscan(self, url, ldfilter, attrs, queue, stop):
+    """Search LDAP `url` for `ldfilter` and put the pages of entries into
+    `queue`, followed by None at the end, or the exception if the search
+    fails. Gives up if `stop` is set."""
+    def offer(item):
+      while not stop.is_set():
+        try:
+          queue.put(item, True, 1)
+          return True
+        except Full:
+          pass
+      return False
+
+    try:
+      for page in self._ldsearch(url, ldfilter, attrs):
+        if not offer(page):
+          return
+      offer(None)
+    except Exception as e:
+      for line in format_exc().rstrip().split("\n"):
+        cherrypy.log("  " + line)
+      offer(e)
+
+  def _ldget(self, url, since = None, names = None, attrs = None):
+    """Generator over pages of data from LDAP. If `since` is given, get
+    only the entries changed at or after that time in seconds since the
+    epoch. If `names` is given, get only the entries for those accounts.
+    Gets the attributes in `attrs`, by default all those needed for the
+    synchronisation. Each page is a list of ``(dn, attrs)`` entries.
+
+    If more than one partition is configured, the partitions are searched
+    concurrently, each on a connection of its own, and the pages yielded
+    in the order they arrive. At most a few pages per partition are held
+    in memory at any one time."""
+    nentries = 0
+    attrs = attrs or self._ldattrs
+    ldfilter = self._ldgroup
+    if since:
+      ldfilter = '(&%s(whenChanged>=%s.0Z))' \
+                 % (ldfilter, time.strftime("%Y%m%d%H%M%S", time.gmtime(since)))
+    if names is not None:
+      # The names have been validated against RX_USER, which excludes
+      # all the characters special in LDAP filters.
+      ldfilter = '(&%s(|%s))' \
+                 % (ldfilter, "".join("(sAMAccountName=%s)" % n for n in names))
 
-    # Fetch paged results from ldap server.
-    # This is needed because there is a size limit on the CERN ldap server
-    # side to return at most 1000 entries per request.
-    # For more information, see http://tools.ietf.org/html/rfc2696.html
-    srv_ctrls = [ldap.controls.SimplePagedResultsControl(criticality=False, cookie="")]
-    while True:
-      srv_ctrls[0].size = 1000 # dont necessarily need to match the server limit
-      s = l.search_ext('OU=Users,OU=Organic Units,DC=cern,DC=ch',
-                       ldap.SCOPE_SUBTREE,
-                       '(memberOf:1.2.840.113556.1.4.1941:=CN=cms-authorized-users,OU=e-groups,OU=Workgroups,DC=cern,DC=ch)',
-                       ['sAMAccountName','displayName','employeeID','mail','altSecurityIdentities','userAccountControl'],
-                       serverctrls=srv_ctrls,
-                       sizelimit=0)
-      _, res_data, _, srv_ctrls = l.result3(s, timeout=100)
-      result.extend(res_data)
-      if not srv_ctrls[0].cookie: break
-
-    if not result:
+    ldap.set_option(ldap.OPT_X_TLS_CACERTDIR, self._cacertdir)
+    parts = (names is None and self._ldpartitions()) or [""]
+    if len(parts) == 1:
+      for page in self._ldsearch(url, ldfilter, attrs):
+        nentries += len(page)
+        yield page
+    else:
+      queue, stop = Queue(2 * len(parts)), Event()
+      workers = [Thread(target = self._ldscan, name = "LdapSync/%d" % i,
+                        args = (url, "(&%s%s)" % (ldfilter, part), attrs, queue, stop))
+                 for i, part in enumerate(parts)]
+      for w in workers:
+        w.start()
+      try:
+        running = len(workers)
+        while running:
+          page = queue.get()
+          if page is None:
+            running -= 1
+          elif isinstance(page, Exception):
+            raise page
+          else:
+            nentries += len(page)
+            yield page
+      finally:
+        stop.set()
+        for w in workers:
+          w.join()
+
+    if not nentries and not since and names is None:
       raise RuntimeError("Ldap returned no data for %s" % url)
-    return result
 
   def _handle_init(self, c):
     """Initialise curl handle `c`."""
@@ -370,14 +746,18 @@ class LdapSyncThread(Thread):
       raise RuntimeError("HTTP status %d for %s" % (code, c.getinfo(pycurl.EFFECTIVE_URL)))
     c.result.append(c.buffer.getvalue())
 
-  def _int_init(self, c, method, rows, result):
+  def _int_init(self, c, method, rows, result, incremental):
     """Initialise curl handle `c` for an internal REST API request."""
     type, body = self._encode(rows)
+    if incremental:
+      body += "&incremental=y"
     headers = self._headers[:] + [("Content-Type", type),
                                   ("Content-Length", str(len(body)))]
-    if method == "PUT":
+    if method in ("PUT", "POST", "DELETE"):
+      # The handles are reused, so always set the method explicitly.
       c.setopt(pycurl.POST, 0)
       c.setopt(pycurl.UPLOAD, 1)
+      c.setopt(pycurl.CUSTOMREQUEST, method)
     else:
       assert False, "Unsupported method"
     c.setopt(pycurl.URL, self._inturl)
@@ -386,7 +766,7 @@ class LdapSyncThread(Thread):
     c.result = result
 
   def _encode(self, rows):
-    """Encode dictionaries in `rows` for POST/PUT body as a HTML form."""
+    """Encode dictionaries in `rows` for PUT/DELETE body as a HTML form."""
     body, sep = "", ""
     for obj in rows:
       for key, value in obj.iteritems():
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -7,6 +7,15 @@ from operator import itemgetter
 from cherrypy import HTTPError
 import cherrypy
 
+#: Entities whose results list the roles of people, but not their details.
+RESPONSIBILITIES = ["site-responsibilities", "group-responsibilities",
+                    "data-responsibilities"]
+
+#: Column assignments for updating people, by argument name.
+PEOPLE_UPDATE = dict((arg, "%s = :%s" % (arg, arg))
+                     for arg in ("email", "forename", "surname", "dn",
+                                 "phone1", "phone2", "im_handle"))
+
 class People(RESTEntity):
   """REST entity object for people information.
 
@@ -38,12 +47,17 @@ class People(RESTEntity):
       validate_strlist('phone1',    param, safe, RX_PHONE)
       validate_strlist('phone2',    param, safe, RX_PHONE)
       validate_strlist('im_handle', param, safe, RX_IM)
-      validate_lengths(safe, 'username', 'email', 'forename', 'surname',
-                       'dn', 'phone1', 'phone2', 'im_handle')
+      if method == 'POST':
+        validate_lengths(safe, 'username', *[arg for arg in PEOPLE_UPDATE
+                                             if safe.kwargs[arg]])
+      else:
+        validate_lengths(safe, 'username', 'email', 'forename', 'surname',
+                         'dn', 'phone1', 'phone2', 'im_handle')
 
       mydn = cherrypy.request.user['dn']
       me = cherrypy.request.user['login']
-      for user, dn in zip(safe.kwargs['username'], safe.kwargs['dn']):
+      dns = safe.kwargs['dn'] or [mydn] * len(safe.kwargs['username'])
+      for user, dn in zip(safe.kwargs['username'], dns):
         if (method != 'POST' or user != me or dn != mydn):
           try:
             authz_match(role=["Global Admin"], group=["global"])
@@ -54,7 +68,7 @@ class People(RESTEntity):
       validate_strlist('username',  param, safe, RX_USER)
       authz_match(role=["Global Admin"], group=["global"])
 
-  @restcall
+  @restcall(tables = ["contact"], changes = ["username"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve people. The results aren't ordered in any particular way.
@@ -75,8 +89,10 @@ class People(RESTEntity):
     can update their own record except not alter the DN information, global
     admins the info for anyone. For input validation requirements, see the
     field descriptions above. When more than one argument is given, there
-    must be equal number of arguments for all the parameters. It is an error
-    to attempt to update a non-existent `username`.
+    must be equal number of arguments for all the parameters given.
+    Parameters not given are left unchanged, and only the values which
+    differ from the current ones are written. It is an error to attempt to
+    update a non-existent `username`.
 
     :arg list username: accounts to update;
     :arg list email: new values;
@@ -87,19 +103,23 @@ class People(RESTEntity):
     :arg list phone1: new values;
     :arg list im_handle: new values.
     :returns: a list with a dict in which *modified* gives number of objects
-              updated in the database, which is always *len(username).*"""
-    return self.api.modify("""
-      update contact
-      set email = :email,
-          forename = :forename,
-          surname = :surname,
-          dn = :dn,
-          phone1 = :phone1,
-          phone2 = :phone2,
-          im_handle = :im_handle
-      where username = :username
-      """, username = username, email = email, forename = forename, surname = surname,
-      dn = dn, phone1 = phone1, phone2 = phone2, im_handle = im_handle)
+              updated in the database, and *unchanged* the number of objects
+              which already had the given values."""
+    values = dict((arg, val) for arg, val in
+                  (("email", email), ("forename", forename), ("surname", surname),
+                   ("dn", dn), ("phone1", phone1), ("phone2", phone2),
+                   ("im_handle", im_handle)) if val)
+    values["username"] = username
+    self.api.changed("people", "update", username)
+    self.api.changed(RESPONSIBILITIES)
+    return self.api.sparse_update("""
+      select username, email, to_nchar(forename) forename,
+             to_nchar(surname) surname, to_nchar(dn) dn,
+             phone1, phone2, im_handle
+      from contact
+      where username in (%s)
+      """, """update contact set %s where username = :username
+      """, PEOPLE_UPDATE, "username", values)
 
   @restcall
   def put(self, username, email, forename, surname, dn, phone1, phone2, im_handle):
@@ -125,6 +145,8 @@ class People(RESTEntity):
       when not matched then insert (username, passwd) values (:username, 'NeedsToBeUpdated')
       """, self.api.bindmap(username = username))
 
+    self.api.changed("people", "insert", username)
+    self.api.changed(RESPONSIBILITIES)
     return self.api.modify("""
       insert into contact
       (id, username, email, forename, surname, dn, phone1, phone2, im_handle)
@@ -142,6 +164,7 @@ class People(RESTEntity):
     :arg list username: accounts to delete.
     :returns: a list with a dict in which *modified* gives number of objects
               deleted from the database, which is always *len(username).*"""
+    self.api.changed("people", "delete", username)
     return self.api.modify("""
       delete from contact where username = :username
       """, username = username)
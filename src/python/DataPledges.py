@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from SiteDB.SiteAuth import oldsite_authz_match
+from SiteDB.SiteAuth import oldsite_authz_batch
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -28,11 +28,13 @@ class Pledges(RESTEntity):
 
   On read, all pledges made by the site are returned in increasing pledge
   date and year order. To obtain the current pledge for each year the
-  client should keep just the last pledge for that year."""
+  client should keep just the last pledge for that year, or ask for only
+  the current pledges with the *current* option."""
   def validate(self, apiobj, method, api, param, safe):
     """Validate request input data."""
     if method in ('GET', 'HEAD'):
       validate_rx('match', param, safe, optional = True)
+      validate_str('current', param, safe, RX_YES_NO, optional = True)
 
     elif method == 'PUT':
       validate_strlist('site_name',           param, safe, RX_SITE)
@@ -46,24 +48,46 @@ class Pledges(RESTEntity):
       # Delay authz until we have database connection for name remapping.
 
   def _authz(self, sites):
-    """Run late authorisation, remapping site names to canonical ones."""
-    remap = {}
-    for site in sites:
-      oldsite_authz_match(self.api, remap,
-                          role=["Global Admin", "Site Executive"],
-                          group=["global"], site=[site])
+    """Run late authorisation, remapping site names to canonical ones.
+    All the sites are authorised at once, see :func:`~.oldsite_authz_batch`."""
+    oldsite_authz_batch(self.api, None,
+                        role=["Global Admin", "Site Executive"],
+                        group=["global"], site=sites)
 
-  @restcall
+  @restcall(tables = ["resource_pledge", "site"])
   @tools.expires(secs=300)
-  def get(self, match):
+  def get(self, match, current):
     """Retrieve pledges. The results aren't ordered in any particular
     way except that for any given site's year, they are ordered by
     increasing pledge date, i.e. last entry for a site's year is the
     "current" one.
 
+    With `current` set to "y", only the current pledge for each site and
+    year is returned, selected in the database, rather than the complete
+    pledge history.
+
     :arg str match: optional regular expression to filter by *site_name*
+    :arg str current: optional "y" to return only the current pledges
     :returns: sequence of rows of pledges; field order in the
               returned *desc.columns*."""
+    if current == "y":
+      return self.api.query(match, itemgetter(0), """
+        select s.name site_name,
+               (cast(sys_extract_utc(rp.pledgedate) as date)
+                - to_date('19700101', 'YYYYMMDD')) *86400 pledge_date,
+               rp.pledgequarter quarter,
+               rp.cpu, rp.disk_store,
+               rp.tape_store, rp.local_store
+        from (select p.*,
+                     row_number() over (partition by p.site, p.pledgequarter
+                                        order by p.pledgedate desc,
+                                                 p.pledgeid desc) pos
+              from resource_pledge p) rp
+        join site s on s.id = rp.site
+        where rp.pos = 1
+        order by s.name, rp.pledgequarter
+        """)
+
     return self.api.query(match, itemgetter(0), """
       select s.name site_name,
              (cast(sys_extract_utc(rp.pledgedate) as date)
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -23,7 +23,8 @@ class Processing(RESTEntity):
       validate_lengths(safe, 'phedex_name', 'psn_name')
       authz_match(role=["Global Admin", "Operator"], group=["global","SiteDB"])
 
-  @restcall
+  @restcall(tables = ["psn_node_phedex_name_map", "phedex_node", "psn_node",
+                      "site"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve pnn privilege associations. The results aren't ordered in
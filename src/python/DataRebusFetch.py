@@ -1,7 +1,7 @@
 import os, sys, time, pycurl, re, string, random, cherrypy, urllib2, ldap, collections, signal, json
 from WMCore.REST.Server import RESTEntity, restcall
 from WMCore.REST.Test import fake_authz_headers
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Validation import *
 from WMCore.REST.Error import *
 from SiteDB.Regexps import *
@@ -137,9 +137,7 @@ class RebusFetch(RESTEntity):
                      %(resource['siteid'], resource['year'], str(e)))
         continue
     if resources:
-      trace = cherrypy.request.db["handle"]["trace"]
-      trace and cherrypy.log("%s commit" % trace)
-      cherrypy.request.db["handle"]["connection"].commit()
+      self.api.commit()
 
   def _compare_pledges(self, keyfed, keysite, t1disk, fed_resources, site_resources):
     """Comparing Federation pledges and Site pledges, if year above 2014, then it is not updated."""
@@ -334,9 +332,7 @@ class RebusFetch(RESTEntity):
                      %(resource['site'], resource['pledgequarter'], str(e)))
         continue
     if resources:
-      trace = cherrypy.request.db["handle"]["trace"]
-      trace and cherrypy.log("%s commit" % trace)
-      cherrypy.request.db["handle"]["connection"].commit()
+      self.api.commit()
 
   def _update(self, orc_data, data_ins):
     """Comparing database output and wlcg rebus fetch data. Preparing update list
@@ -351,9 +347,12 @@ class RebusFetch(RESTEntity):
             names_update[row['name']]= {'country': row['country']}
             names_new.append({'name': row['name'], 'country' : row['country']})
     if names_new:
+      self.api.changed("federations", "insert", [n['name'] for n in names_new])
+      self.api.changed("federations-pledges")
       self._insertnames(names_new)
       orc_data = self._current();
     pledges_update = []
+    pledged = []
     for row in data_ins:
       cpu_row=''; disk_row=''; tape_row = '';
       cpu_orc=''; disk_orc=''; tape_orc = '';
@@ -378,13 +377,16 @@ class RebusFetch(RESTEntity):
               tape_orc = self.tryToInt(orc_data[row['name']]['pledges'][fed_year]['tape']);
               if (not(cpu_orc == cpu_row and tape_orc == tape_row and disk_orc == disk_row)):
                 pledges_update.append({'id': fed_id, 'year': fed_year, 'cpu': cpu_row, 'disk': disk_row, 'tape': tape_row})
+                pledged.append((fed_name, fed_year))
             else:
               pledges_update.append({'id': fed_id, 'year': fed_year, 'cpu': cpu_row, 'disk': disk_row, 'tape': tape_row})
+              pledged.append((fed_name, fed_year))
           else:
             cherrypy.log('Year Error in row: %s ' % row)
         else:
           cherrypy.log('Name Error in row: %s' % row)
     if pledges_update:
+      self.api.changed("federations-pledges", "update", pledged)
       self._insertpledges(pledges_update)
 
   def _insertpledges(self, pledges_update):
@@ -403,9 +405,7 @@ class RebusFetch(RESTEntity):
                      %(pledge['id'], pledge['year'], str(e)))
         continue
     if pledges_update:
-      trace = cherrypy.request.db["handle"]["trace"]
-      trace and cherrypy.log("%s commit" % trace)
-      cherrypy.request.db["handle"]["connection"].commit()
+      self.api.commit()
 
   def _insertnames(self, names_new):
     """Inserting federation name and country.
@@ -420,9 +420,7 @@ class RebusFetch(RESTEntity):
         cherrypy.log('Error : %s' %str(e))
         continue
     if names_new:
-      trace = cherrypy.request.db["handle"]["trace"]
-      trace and cherrypy.log("%s commit" % trace)
-      cherrypy.request.db["handle"]["connection"].commit()
+      self.api.commit()
 
   def _read_sites_topolygy(self):
     """Read REBUS sites topology. Topology url: http://wlcg-rebus.cern.ch/apps/topology/all/json
@@ -444,6 +442,7 @@ class RebusFetch(RESTEntity):
   def _update_sites_assoc(self, rows_ins, current_sites, current_feds):
     """Comparing database and REBUS data. Preparing database update rows for site associations."""
     update = []
+    federations = []
     for row in rows_ins:
       tier = row["tier"]
       site = row["site"]
@@ -455,6 +454,8 @@ class RebusFetch(RESTEntity):
             site_id = current_sites[tier][site];
             if site_id not in current_feds[federation]["sites"]:
               update.append({"site_id": site_id, "federations_names_id": fed_id})
+              federations.append(federation)
+    self.api.changed("federations", "update", federations)
     self._insert_new_assoc(update)
  
   def _insert_new_assoc(self, new_assoc):
@@ -470,9 +471,7 @@ class RebusFetch(RESTEntity):
         cherrypy.log('Error : %s' %str(e))
         continue
     if new_assoc:
-      trace = cherrypy.request.db["handle"]["trace"]
-      trace and cherrypy.log("%s commit" % trace)
-      cherrypy.request.db["handle"]["connection"].commit()
+      self.api.commit()
  
               
 
@@ -1,8 +1,9 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
+from SiteDB.DataPeople import RESPONSIBILITIES
 from operator import itemgetter
 
 class Roles(RESTEntity):
@@ -29,7 +30,7 @@ class Roles(RESTEntity):
       validate_strlist('description', param, safe, RX_DESCRIPTION)
       authz_match(role=["Global Admin"], group=["global"])
 
-  @restcall
+  @restcall(tables = ["role"], changes = ["title"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve roles. The results aren't ordered in any particular way.
@@ -48,6 +49,8 @@ class Roles(RESTEntity):
     :arg list title: names to insert.
     :returns: a list with a dict in which *modified* gives number of objects
               inserted into the database, which is always *len(title).*"""
+    self.api.changed("roles", "insert", title)
+    self.api.changed(RESPONSIBILITIES)
     return self.api.modify("""
       insert into role (title, id)
       values (:title, role_sq.nextval)
@@ -62,6 +65,7 @@ class Roles(RESTEntity):
     :arg list title: names to delete.
     :returns: a list with a dict in which *modified* gives number of objects
               deleted from the database, which is always *len(title)*."""
+    self.api.changed("roles", "delete", title)
     return self.api.modify("delete from role where title = :title", title = title)
 
   @restcall
@@ -74,6 +78,8 @@ class Roles(RESTEntity):
     :arg list description: role description.
     :returns: a list with a dict in which *modified* gives number of objects
               updated in database. which is not alwaus *len(title)*."""
+    self.api.changed("roles", "update", title)
+    self.api.changed(RESPONSIBILITIES)
     return self.api.modify(""" update role set description = :description_i
                                where title = :title_i""",
                                description_i = description, title_i = title)
@@ -1,12 +1,121 @@
 from WMCore.REST.Server import RESTEntity, restcall, rows
-from SiteDB.SiteAuth import oldsite_authz_match
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import oldsite_authz_batch, authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
+from SiteDB.Cache import DerivedCache
 from operator import itemgetter
 from cherrypy import request
 
+#: Query for all the site name aliases.
+SITE_NAMES_SQL = """
+      (select 'lcg' type, s.name site_name, sam.name alias
+       from site s
+       join site_cms_name_map cmap on cmap.site_id = s.id
+       join sam_cms_name_map smap on smap.cms_name_id = cmap.cms_name_id
+       join sam_name sam on sam.id = smap.sam_id)
+      union
+      (select 'cms' type, s.name site_name, c.name alias
+       from site s
+       join site_cms_name_map cmap on cmap.site_id = s.id
+       join cms_name c on c.id = cmap.cms_name_id)
+      union
+      (select 'phedex' type, s.name site_name, p.name alias
+       from site s
+       join phedex_node p on p.site = s.id)
+      union
+      (select 'psn' type, s.name site_name, p.name alias
+       from site s
+       join psn_node p on p.site = s.id)
+      """
+
+#: Tables read by :obj:`SITE_NAMES_SQL`.
+SITE_NAMES_TABLES = ["site", "site_cms_name_map", "sam_cms_name_map",
+                     "sam_name", "cms_name", "phedex_node", "psn_node"]
+
+#: Statement inserting a site name alias of any type unless it exists
+#: already, for array execution with the ``type``, ``site_name`` and
+#: ``alias`` binds. Inserts no rows if the alias exists or the site does
+#: not; violating a constraint, for example an alias already used by
+#: another site, raises an error.
+SITE_NAMES_UPSERT = """
+      insert all
+      when t = 'cms' and present = 0 then
+        into cms_name (id, name) values (cms_name_sq.nextval, alias)
+        into site_cms_name_map (site_id, cms_name_id) values (site_id, cms_name_sq.nextval)
+      when t = 'lcg' and present = 0 then
+        into sam_name (id, name) values (sam_name_sq.nextval, alias)
+        into sam_cms_name_map (cms_name_id, sam_id) values (cms_id, sam_name_sq.nextval)
+      when t = 'phedex' and present = 0 then
+        into phedex_node (id, site, name) values (phedex_node_sq.nextval, site_id, alias)
+      when t = 'psn' and present = 0 then
+        into psn_node (id, site, name) values (psn_node_sq.nextval, site_id, alias)
+      select :type t, s.id site_id, cmap.cms_name_id cms_id, :alias alias,
+             case :type
+               when 'cms' then
+                 (select count(*) from site_cms_name_map m
+                  join cms_name c on c.id = m.cms_name_id
+                  where m.site_id = s.id and c.name = :alias)
+               when 'lcg' then
+                 (select count(*) from sam_cms_name_map m
+                  join sam_name n on n.id = m.sam_id
+                  where m.cms_name_id = cmap.cms_name_id and n.name = :alias)
+               when 'phedex' then
+                 (select count(*) from phedex_node p
+                  where p.site = s.id and p.name = :alias)
+               when 'psn' then
+                 (select count(*) from psn_node p
+                  where p.site = s.id and p.name = :alias)
+             end present
+      from site s
+      left join site_cms_name_map cmap on cmap.site_id = s.id and :type = 'lcg'
+      where s.name = :site_name
+      """
+
+def site_alias_index(names):
+  """Build site name alias index from `names`, a sequence of (type,
+  site_name, alias) triplets as returned by :obj:`SITE_NAMES_SQL`.
+
+  :returns: tuple of dictionaries *(byalias, bysite)*, where *byalias*
+    maps an alias to a list of (type, site_name) tuples, and *bysite*
+    maps a site name to a dictionary of lists of aliases by type."""
+  return site_alias_index_update(({}, {}), names, [])
+
+def site_alias_index_update(index, added, removed):
+  """Return a copy of site name alias `index` updated with `added` and
+  `removed` (type, site_name, alias) triplets. The original `index` is
+  not modified. See :func:`site_alias_index` for the index format."""
+  byalias, bysite = dict(index[0]), dict(index[1])
+  for type, site_name, alias in removed:
+    byalias[alias] = [x for x in byalias.get(alias, []) if x != (type, site_name)]
+    if not byalias[alias]:
+      del byalias[alias]
+    bysite[site_name] = dict(bysite.get(site_name, {}))
+    bysite[site_name][type] = [a for a in bysite[site_name].get(type, []) if a != alias]
+    if not bysite[site_name][type]:
+      del bysite[site_name][type]
+    if not bysite[site_name]:
+      del bysite[site_name]
+
+  for type, site_name, alias in added:
+    if (type, site_name) not in byalias.get(alias, []):
+      byalias[alias] = byalias.get(alias, []) + [(type, site_name)]
+      bysite[site_name] = dict(bysite.get(site_name, {}))
+      bysite[site_name][type] = bysite[site_name].get(type, []) + [alias]
+
+  return byalias, bysite
+
+#: Column assignments for updating sites, by argument name.
+SITE_UPDATE = {
+  "tier":           "tier = (select id from tier where name = :tier)",
+  "country":        "country = :country",
+  "usage":          "usage = :usage",
+  "url":            "url = :url",
+  "logo_url":       "logourl = :logo_url",
+  "devel_release":  "getdevlrelease = :devel_release",
+  "manual_install": "manualinstall = :manual_install"
+}
+
 ######################################################################
 ######################################################################
 class Sites(RESTEntity):
@@ -40,11 +149,19 @@ class Sites(RESTEntity):
       validate_strlist('logo_url', param, safe, RX_URL)
       validate_strlist('devel_release', param, safe, RX_YES_NO)
       validate_strlist('manual_install', param, safe, RX_YES_NO)
-      validate_lengths(safe, 'site_name', 'tier', 'country', 'usage',
-                       'url', 'logo_url', 'devel_release', 'manual_install')
+      if method == 'POST':
+        validate_lengths(safe, 'site_name', *[arg for arg in SITE_UPDATE
+                                              if safe.kwargs[arg]])
+      else:
+        validate_lengths(safe, 'site_name', 'tier', 'country', 'usage',
+                         'url', 'logo_url', 'devel_release', 'manual_install')
       if method == 'PUT':
         validate_strlist('executive', param, safe, RX_USER)
-        validate_lengths(safe, 'executive')
+        validate_lengths(safe, 'site_name', 'executive')
+        for arg in ('cms_name', 'phedex_node', 'psn_node'):
+          validate_strlist(arg, param, safe, RX_NAME)
+          if safe.kwargs[arg]:
+            validate_lengths(safe, 'site_name', arg)
 
     elif method == 'DELETE':
       validate_strlist('site_name', param, safe, RX_SITE)
@@ -56,14 +173,13 @@ class Sites(RESTEntity):
       authz_match(role=["Global Admin"], group=["global"])
 
   def _authz(self, sites):
-    """Run late authorisation, remapping site names to canonical ones."""
-    remap = {}
-    for site in sites:
-      oldsite_authz_match(self.api, remap,
-                          role=["Global Admin", "Operator", "Site Executive", "Site Admin"],
-                          group=["global","SiteDB"], site=[site])
+    """Run late authorisation, remapping site names to canonical ones.
+    All the sites are authorised at once, see :func:`~.oldsite_authz_batch`."""
+    oldsite_authz_batch(self.api, None,
+                        role=["Global Admin", "Operator", "Site Executive", "Site Admin"],
+                        group=["global","SiteDB"], site=sites)
 
-  @restcall
+  @restcall(tables = ["site", "tier"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve sites. The results aren't ordered in any particular way.
@@ -86,8 +202,10 @@ class Sites(RESTEntity):
     """Update the information for sites identified by `site_name`. A site
     executive/admin can update their own site's record, operators and global
     admins the info for all the sites. When more than one argument is given,
-    there must be equal number of arguments for all the parameters.  It is
-    an error to attempt to update a non-existent `site`.
+    there must be equal number of arguments for all the parameters given.
+    Parameters not given are left unchanged, and only the values which
+    differ from the current ones are written. It is an error to attempt to
+    update a non-existent `site`.
 
     :arg list site_name: site names to insert;
     :arg list tier: new values;
@@ -98,25 +216,28 @@ class Sites(RESTEntity):
     :arg list devel_release: new values;
     :arg list manual_install: new values;
     :returns: a list with a dict in which *modified* gives number of objects
-              updated in the database, which is always *len(site_name).*"""
+              updated in the database, and *unchanged* the number of objects
+              which already had the given values."""
     self._authz(site_name)
-    return self.api.modify("""
-      update site set
-        tier = (select id from tier where name = :tier),
-        country = :country,
-        usage = :usage,
-        url = :url,
-        logourl = :logo_url,
-        getdevlrelease = :devel_release,
-        manualinstall = :manual_install
-      where name = :site_name
-      """, site_name = site_name, tier = tier, country = country,
-      usage = usage, url = url, logo_url = logo_url,
-      devel_release = devel_release, manual_install = manual_install)
+    values = dict((arg, val) for arg, val in
+                  (("tier", tier), ("country", country), ("usage", usage),
+                   ("url", url), ("logo_url", logo_url),
+                   ("devel_release", devel_release),
+                   ("manual_install", manual_install)) if val)
+    values["site_name"] = site_name
+    return self.api.sparse_update("""
+      select s.name site_name, t.name tier, to_nchar(s.country) country,
+             s.usage, s.url, s.logourl logo_url,
+             s.getdevlrelease devel_release, s.manualinstall manual_install
+      from site s join tier t on t.id = s.tier
+      where s.name in (%s)
+      """, """update site set %s where name = :site_name
+      """, SITE_UPDATE, "site_name", values)
 
   @restcall
   def put(self, site_name, tier, country, usage, url, logo_url,
-          devel_release, manual_install, executive):
+          devel_release, manual_install, executive,
+          cms_name, phedex_node, psn_node):
     """Insert new sites. The caller needs to have global admin privileges
     or be an operator.
     When more than one argument is given, there must equal number of
@@ -124,6 +245,12 @@ class Sites(RESTEntity):
     see the field descriptions above.  It is an error to attempt to insert
     a `site_name` which already exists.
 
+    Each site can optionally be given its CMS name, PhEDEx node and PSN
+    node at the same time; if any of those arguments is given, it must be
+    given for every site. All the inserts are made with array operations
+    referring to the new site ids directly, and are committed together,
+    so either all the sites are onboarded completely, or none are.
+
     :arg list site_name: site names to insert;
     :arg list tier: new values;
     :arg list country: new values;
@@ -133,25 +260,51 @@ class Sites(RESTEntity):
     :arg list devel_release: new values;
     :arg list manual_install: new values;
     :arg list executive: username of site executives;
+    :arg list cms_name: optional CMS names of the sites;
+    :arg list phedex_node: optional PhEDEx node names of the sites;
+    :arg list psn_node: optional PSN node names of the sites;
     :returns: a list with a dict in which *modified* gives number of objects
               inserted into the database, which is always *len(site_name).*"""
 
-    r = self.api.modify("""
+    site_id = self.api.nextvals("site_sq", len(site_name))
+    c, _ = self.api.executemany("""
       insert into site
       (id, name, tier, country, usage, url, logourl, getdevlrelease, manualinstall)
-      values (site_sq.nextval, :site_name, (select id from tier where name = :tier),
+      values (:site_id, :site_name, (select id from tier where name = :tier),
               :country, :usage, :url, :logo_url, :devel_release, :manual_install)
-      """, site_name = site_name, tier = tier, country = country,
-      usage = usage, url = url, logo_url = logo_url,
-      devel_release = devel_release, manual_install = manual_install)
+      """, self.api.bindmap(site_id = site_id, site_name = site_name, tier = tier,
+      country = country, usage = usage, url = url, logo_url = logo_url,
+      devel_release = devel_release, manual_install = manual_install))
+    result = self.api.rowstatus(c, len(site_name))
 
-    self.api.modify("""
+    c, _ = self.api.executemany("""
       insert into site_responsibility (contact, role, site)
       values ((select id from contact where username = :username),
               (select id from role where title = 'Site Executive'),
-              (select id from site where name = :site_name))
-      """, username = executive, site_name = site_name)
-    return r
+              :site_id)
+      """, self.api.bindmap(username = executive, site_id = site_id))
+    self.api.rowstatus(c, len(site_name))
+
+    if cms_name:
+      cms_id = self.api.nextvals("cms_name_sq", len(cms_name))
+      c, _ = self.api.executemany("""
+        insert all
+        into cms_name (id, name) values (:cms_id, :alias)
+        into site_cms_name_map (site_id, cms_name_id) values (:site_id, :cms_id)
+        select * from dual
+        """, self.api.bindmap(cms_id = cms_id, site_id = site_id, alias = cms_name))
+      self.api.rowstatus(c, 2*len(cms_name))
+
+    for table, names in (("phedex_node", phedex_node), ("psn_node", psn_node)):
+      if names:
+        c, _ = self.api.executemany("""
+          insert into %s (id, site, name)
+          values (%s_sq.nextval, :site_id, :alias)
+          """ % (table, table), self.api.bindmap(site_id = site_id, alias = names))
+        self.api.rowstatus(c, len(names))
+
+    self.api.commit()
+    return result
 
   @restcall
   def delete(self, site_name):
@@ -179,20 +332,24 @@ class SiteNames(RESTEntity):
   *alias*              name alias                string matching :obj:`.RX_NAME`      required, unique
   ==================== ========================= ==================================== ====================
   """
+  def __init__(self, app, api, config, mount):
+    RESTEntity.__init__(self, app, api, config, mount)
+    self.index = DerivedCache(site_alias_index)
+
   def validate(self, apiobj, method, api, param, safe):
     """Validate request input data."""
 
     if method in ('GET', 'HEAD'):
       validate_rx('match', param, safe, optional = True)
 
-    elif method in ('PUT', 'DELETE'):
+    elif method in ('PUT', 'POST', 'DELETE'):
       validate_strlist('type', param, safe, RX_NAME_TYPE)
       validate_strlist('site_name', param, safe, RX_SITE)
       validate_strlist('alias', param, safe, RX_NAME)
       validate_lengths(safe, 'type', 'site_name', 'alias')
       authz_match(role=["Global Admin", "Operator"], group=["global","SiteDB"])
 
-  @restcall
+  @restcall(tables = SITE_NAMES_TABLES, changes = ["type", "site_name", "alias"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve site name associations. The results aren't ordered in any
@@ -202,26 +359,7 @@ class SiteNames(RESTEntity):
     :returns: sequence of rows of site names; field order in the returned
               *desc.columns*."""
 
-    return self.api.query(match, itemgetter(1), """
-      (select 'lcg' type, s.name site_name, sam.name alias
-       from site s
-       join site_cms_name_map cmap on cmap.site_id = s.id
-       join sam_cms_name_map smap on smap.cms_name_id = cmap.cms_name_id
-       join sam_name sam on sam.id = smap.sam_id)
-      union
-      (select 'cms' type, s.name site_name, c.name alias
-       from site s
-       join site_cms_name_map cmap on cmap.site_id = s.id
-       join cms_name c on c.id = cmap.cms_name_id)
-      union
-      (select 'phedex' type, s.name site_name, p.name alias
-       from site s
-       join phedex_node p on p.site = s.id)
-      union
-      (select 'psn' type, s.name site_name, p.name alias
-       from site s
-       join psn_node p on p.site = s.id)
-      """)
+    return self.api.query(match, itemgetter(1), SITE_NAMES_SQL)
 
   @restcall
   def put(self, type, site_name, alias):
@@ -237,6 +375,8 @@ class SiteNames(RESTEntity):
     :returns: a list with a dict in which *modified* gives the number of objects
               inserted into the database, which is always *len(type).*"""
 
+    names = zip(type, site_name, alias)
+    entry = self.api.lookup(SITE_NAMES_SQL)
     binds = self.api.bindmap(type = type, site_name = site_name, alias = alias)
     lcg = filter(lambda b: b['type'] == 'lcg', binds)
     cms = filter(lambda b: b['type'] == 'cms', binds)
@@ -287,11 +427,68 @@ class SiteNames(RESTEntity):
       updated += c.rowcount
 
     result = rows([{ "modified": updated }])
-    trace = request.db["handle"]["trace"]
-    trace and cherrypy.log("%s commit" % trace)
-    request.db["handle"]["connection"].commit()
+    self.api.changed("site-names", "insert", names)
+    self._patch(entry, self.api.commit(), added = names)
     return result
 
+  @restcall
+  def post(self, type, site_name, alias):
+    """Insert the site names which do not exist yet. Like :meth:`put`, but
+    existing names are not an error, so the complete list of names can be
+    submitted repeatedly. All the names of all types are inserted with one
+    array operation, and the names which fail to insert are reported rather
+    than failing the whole request. The same privileges are required as
+    for :meth:`put`.
+
+    :arg list type: new values;
+    :arg list site_name: new values;
+    :arg list alias: new values;
+    :returns: a list with a dict for each distinct (type, site_name, alias)
+              triplet, in which *status* is "inserted" if the name was added,
+              "unchanged" if it already existed, or "conflict" if it could not
+              be added, with the reason in *error*."""
+
+    names, seen = [], set()
+    for name in zip(type, site_name, alias):
+      if name not in seen:
+        seen.add(name)
+        names.append(name)
+
+    entry = self.api.lookup(SITE_NAMES_SQL)
+    c, _ = self.api.executemany(SITE_NAMES_UPSERT,
+                                [{ "type": t, "site_name": s, "alias": a }
+                                 for t, s, a in names],
+                                batcherrors = True, arraydmlrowcounts = True)
+    errors = dict((e.offset, e.message) for e in c.getbatcherrors())
+    counts = c.getarraydmlrowcounts()
+
+    # Names which were not inserted either exist already or refer to a
+    # missing site or CMS name. Tell them apart from the current names in
+    # this transaction, not from the cache which may be stale.
+    present = set()
+    if any(not counts[i] for i in xrange(len(names)) if i not in errors):
+      c, _ = self.api.execute(SITE_NAMES_SQL)
+      present = set(tuple(r) for r in c.fetchall())
+
+    result, added = [], []
+    for i, (t, s, a) in enumerate(names):
+      status, error = "inserted", None
+      if i in errors:
+        status, error = "conflict", str(errors[i]).strip()
+      elif not counts[i]:
+        if (t, s, a) in present:
+          status = "unchanged"
+        else:
+          status, error = "conflict", "No such site or CMS name for site"
+      else:
+        added.append((t, s, a))
+      result.append({ "type": t, "site_name": s, "alias": a,
+                      "status": status, "error": error })
+
+    self.api.changed("site-names", "insert", added)
+    self._patch(entry, self.api.commit(), added = added)
+    return rows(result)
+
   @restcall
   def delete(self, type, site_name, alias):
     """Delete site name associations. Only Global admins and SiteDB operators,
@@ -307,6 +504,10 @@ class SiteNames(RESTEntity):
     :returns: a list with a dict in which *modified* gives the number of objects
               deleted from the database, which is always *len(type).*"""
 
+    # Deleting a CMS name also removes the LCG names mapped to it, so
+    # the cached names can't be updated incrementally in that case.
+    names = zip(type, site_name, alias)
+    entry = ('cms' not in type and self.api.lookup(SITE_NAMES_SQL)) or None
     binds = self.api.bindmap(type = type, site_name = site_name, alias = alias)
     lcg = filter(lambda b: b['type'] == 'lcg', binds)
     cms = filter(lambda b: b['type'] == 'cms', binds)
@@ -359,11 +560,110 @@ class SiteNames(RESTEntity):
       updated += c.rowcount
 
     result = rows([{ "modified": updated }])
-    trace = request.db["handle"]["trace"]
-    trace and cherrypy.log("%s commit" % trace)
-    request.db["handle"]["connection"].commit()
+    if 'cms' not in type:
+      self.api.changed("site-names", "delete", names)
+    self._patch(entry, self.api.commit(), removed = names)
     return result
 
+  def _patch(self, entry, modified, added = [], removed = []):
+    """Update the cached site names and the alias index incrementally
+    after a committed change which added and removed the (type, site_name,
+    alias) triplets `added` and `removed`, respectively. Does nothing if
+    the site names were not cached, or were changed meanwhile by others,
+    in which case they will be reloaded from the database when needed.
+
+    :arg CacheEntry entry: cached site names before the change, or None.
+    :arg set modified: tables modified by the change.
+    :arg list added: triplets added.
+    :arg list removed: triplets removed."""
+    if not entry:
+      return
+
+    removed = set(removed)
+    current = set(entry.rows)
+    names = [r for r in entry.rows if r not in removed]
+    for r in added:
+      if r not in current:
+        current.add(r)
+        names.append(r)
+
+    new = self.api.patch(entry, modified, names)
+    if new:
+      self.index.patch(request.db["instance"], entry, new,
+                       lambda index: site_alias_index_update(index, added, removed))
+
+######################################################################
+######################################################################
+class SiteAliases(RESTEntity):
+  """REST entity for resolving site name aliases, using an index of the
+  site names. The aliases are looked up by name, or all the aliases of
+  the sites by site name. The index is kept up to date incrementally when
+  names are added or removed via :class:`SiteNames`.
+
+  ==================== ========================= ==================================== ====================
+  Contents             Meaning                   Value                                Constraints
+  ==================== ========================= ==================================== ====================
+  *type*               alias type                string matching :obj:`.RX_NAME_TYPE` optional, multiple
+  *site_name*          site name                 string matching :obj:`.RX_SITE`      optional, multiple
+  *alias*              name alias                string matching :obj:`.RX_NAME`      optional, multiple
+  ==================== ========================= ==================================== ====================
+  """
+  def __init__(self, app, api, config, mount, names):
+    """
+    :arg SiteNames names: the site names entity which owns the index."""
+    RESTEntity.__init__(self, app, api, config, mount)
+    self.names = names
+
+  def validate(self, apiobj, method, api, param, safe):
+    """Validate request input data."""
+    if method in ('GET', 'HEAD', 'POST'):
+      validate_strlist('type', param, safe, RX_NAME_TYPE)
+      validate_strlist('site_name', param, safe, RX_SITE)
+      validate_strlist('alias', param, safe, RX_NAME)
+
+  @restcall(tables = SITE_NAMES_TABLES, changes = False)
+  @tools.expires(secs=300)
+  def get(self, type, site_name, alias):
+    """Resolve site name aliases. Returns the site name associations for
+    every alias in `alias`, and all the associations for every site in
+    `site_name`, optionally restricted to the alias types in `type`. Names
+    which are not known are silently ignored. The results are in the order
+    of the arguments, aliases first, but otherwise not ordered.
+
+    :arg list type: optional alias types to return;
+    :arg list site_name: site names whose aliases to return;
+    :arg list alias: aliases to resolve to site names;
+    :returns: sequence of rows of site names; field order in the returned
+              *desc.columns*, the same as for :class:`SiteNames`."""
+    entry = self.api.cached(SITE_NAMES_TABLES, SITE_NAMES_SQL)
+    byalias, bysite = self.names.index.get(request.db["instance"], entry)
+    types = set(type)
+    result = []
+    seen = set()
+    for name in alias:
+      for t, s in byalias.get(name, []):
+        if (not types or t in types) and (t, s, name) not in seen:
+          seen.add((t, s, name))
+          result.append((t, s, name))
+
+    for s in site_name:
+      for t, names in bysite.get(s, {}).iteritems():
+        if not types or t in types:
+          for name in names:
+            if (t, s, name) not in seen:
+              seen.add((t, s, name))
+              result.append((t, s, name))
+
+    request.rest_generate_preamble["columns"] = entry.columns
+    return rows(result)
+
+  @restcall
+  def post(self, type, site_name, alias):
+    """Resolve site name aliases exactly like :meth:`get`, but with the
+    arguments in the request body. Use this for long lists of names which
+    would exceed URL length limits. Does not modify anything."""
+    return self.get(type, site_name, alias)
+
 ######################################################################
 ######################################################################
 class SiteResources(RESTEntity):
@@ -390,14 +690,13 @@ class SiteResources(RESTEntity):
     # Delay authz until we have database connection for name remapping.
 
   def _authz(self, sites):
-    """Run late authorisation, remapping site names to canonical ones."""
-    remap = {}
-    for site in sites:
-      oldsite_authz_match(self.api, remap,
-                          role=["Global Admin", "Site Executive", "Site Admin", "Operator"],
-                          group=["global", "SiteDB"], site=[site])
+    """Run late authorisation, remapping site names to canonical ones.
+    All the sites are authorised at once, see :func:`~.oldsite_authz_batch`."""
+    oldsite_authz_batch(self.api, None,
+                        role=["Global Admin", "Site Executive", "Site Admin", "Operator"],
+                        group=["global", "SiteDB"], site=sites)
 
-  @restcall
+  @restcall(tables = ["site", "resource_element"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve site resources. The results aren't ordered in any particular way.
@@ -446,9 +745,7 @@ class SiteResources(RESTEntity):
     self.api.rowstatus(c, 2*len(binds))
 
     result = rows([{ "modified": c.rowcount / 2 }])
-    trace = request.db["handle"]["trace"]
-    trace and cherrypy.log("%s commit" % trace)
-    request.db["handle"]["connection"].commit()
+    self.api.commit()
     return result
 
   @restcall
@@ -499,14 +796,13 @@ class SiteAssociations(RESTEntity):
       # Delay authz until we have database connection for name remapping.
 
   def _authz(self, sites):
-    """Run late authorisation, remapping site names to canonical ones."""
-    remap = {}
-    for site in sites:
-      oldsite_authz_match(self.api, remap,
-                          role=["Global Admin", "Site Executive"],
-                          group=["global"], site=[site])
+    """Run late authorisation, remapping site names to canonical ones.
+    All the sites are authorised at once, see :func:`~.oldsite_authz_batch`."""
+    oldsite_authz_batch(self.api, None,
+                        role=["Global Admin", "Site Executive"],
+                        group=["global"], site=sites)
 
-  @restcall
+  @restcall(tables = ["site_association", "site"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve site parent-child associations. The results aren't ordered
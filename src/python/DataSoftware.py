@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall, rows
-from SiteDB.SiteAuth import oldsite_authz_match
+from SiteDB.SiteAuth import oldsite_authz_batch
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -27,14 +27,13 @@ class Software(RESTEntity):
       # Delay authz until we have database connection for name remapping.
 
   def _authz(self, sites):
-    """Run late authorisation, remapping site names to canonical ones."""
-    remap = {}
-    for site in sites:
-      oldsite_authz_match(self.api, remap,
-                          role=["Global Admin", "Site Executive", "Site Admin"],
-                          group=["global"], site=[site])
+    """Run late authorisation, remapping site names to canonical ones.
+    All the sites are authorised at once, see :func:`~.oldsite_authz_batch`."""
+    oldsite_authz_batch(self.api, None,
+                        role=["Global Admin", "Site Executive", "Site Admin"],
+                        group=["global"], site=sites)
 
-  @restcall
+  @restcall(tables = ["site", "resource_element", "pinned_releases"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve pinned software releases at sites. The results aren't ordered
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -30,7 +30,7 @@ class Tiers(RESTEntity):
       validate_numlist('position', param, safe, bare = True)
       authz_match(role=["Global Admin"], group=["global"])
 
-  @restcall
+  @restcall(tables = ["tier"])
   @tools.expires(secs=300)
   def get(self, match):
     """Retrieve tiers. The results aren't ordered in any particular way.
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -29,7 +29,8 @@ class UserGroups(RESTEntity):
         except HTTPError:
           authz_match(role=["Global Admin", "Admin"], group=[group])
 
-  @restcall
+  @restcall(tables = ["group_responsibility", "contact", "role", "user_group"],
+            changes = ["username", "user_group", "role"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve group privilege associations. The results aren't ordered in
@@ -61,6 +62,7 @@ class UserGroups(RESTEntity):
     :returns: a list with a dict in which *modified* gives the number of objects
               inserted into the database, which is always *len(username).*"""
 
+    self.api.changed("group-responsibilities", "insert", zip(username, user_group, role))
     return self.api.modify("""
       insert into group_responsibility (contact, role, user_group)
       values ((select id from contact where username = :username),
@@ -83,6 +85,7 @@ class UserGroups(RESTEntity):
     :returns: a list with a dict in which *modified* gives the number of objects
               deleted from the database, which is always *len(username).*"""
 
+    self.api.changed("group-responsibilities", "delete", zip(username, user_group, role))
     return self.api.modify("""
       delete from group_responsibility
       where contact = (select id from contact where username = :username)
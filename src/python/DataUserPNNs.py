@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Auth import authz_match
+from SiteDB.SiteAuth import authz_match
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -24,7 +24,8 @@ class UserPNNs(RESTEntity):
       validate_lengths(safe, 'username', 'pnn_name', 'role')
       authz_match(role=["Global Admin", "Operator"], group=["global","SiteDB"])
 
-  @restcall
+  @restcall(tables = ["data_responsibility", "contact", "role", "phedex_node"],
+            changes = ["username", "pnn_name", "role"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve pnn privilege associations. The results aren't ordered in
@@ -55,6 +56,7 @@ class UserPNNs(RESTEntity):
     :returns: a list with a dict in which *modified* gives the number of objects
               inserted into the database, which is always *len(username).*"""
 
+    self.api.changed("data-responsibilities", "insert", zip(username, pnn_name, role))
     return self.api.modify("""
       insert into data_responsibility (contact, role, pnn)
       values ((select id from contact where username = :username),
@@ -77,6 +79,7 @@ class UserPNNs(RESTEntity):
     :returns: a list with a dict in which *modified* gives the number of objects
               deleted from the database, which is always *len(username).*"""
 
+    self.api.changed("data-responsibilities", "delete", zip(username, pnn_name, role))
     return self.api.modify("""
       delete from data_responsibility
       where contact = (select id from contact where username = :username)
@@ -1,5 +1,5 @@
 from WMCore.REST.Server import RESTEntity, restcall
-from SiteDB.SiteAuth import oldsite_authz_match
+from SiteDB.SiteAuth import oldsite_authz_batch
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
@@ -25,14 +25,14 @@ class UserSites(RESTEntity):
       # Delay authz until we have database connection for name remapping.
 
   def _authz(self, sites):
-    """Run late authorisation, remapping site names to canonical ones."""
-    remap = {}
-    for site in sites:
-      oldsite_authz_match(self.api, remap,
-                          role=["Global Admin", "Site Executive"],
-                          group=["global"], site=[site])
+    """Run late authorisation, remapping site names to canonical ones.
+    All the sites are authorised at once, see :func:`~.oldsite_authz_batch`."""
+    oldsite_authz_batch(self.api, None,
+                        role=["Global Admin", "Site Executive"],
+                        group=["global"], site=sites)
 
-  @restcall
+  @restcall(tables = ["site_responsibility", "contact", "role", "site"],
+            changes = ["username", "site_name", "role"])
   @tools.expires(secs=300)
   def get(self):
     """Retrieve site privilege associations. The results aren't ordered in
@@ -65,6 +65,7 @@ class UserSites(RESTEntity):
               inserted into the database, which is always *len(username).*"""
 
     self._authz(site_name)
+    self.api.changed("site-responsibilities", "insert", zip(username, site_name, role))
     return self.api.modify("""
       insert into site_responsibility (contact, role, site)
       values ((select id from contact where username = :username),
@@ -88,6 +89,7 @@ class UserSites(RESTEntity):
               deleted from the database, which is always *len(username).*"""
 
     self._authz(site_name)
+    self.api.changed("site-responsibilities", "delete", zip(username, site_name, role))
     return self.api.modify("""
       delete from site_responsibility
       where contact = (select id from contact where username = :username)
@@ -2,7 +2,8 @@ from WMCore.REST.Server import RESTEntity, restcall, rows
 from WMCore.REST.Tools import tools
 from WMCore.REST.Validation import *
 from SiteDB.Regexps import *
-import cherrypy
+from SiteDB.SiteAuth import authz_index
+import cherrypy, hashlib
 
 class WhoAmI(RESTEntity):
   """REST entity describing the calling user."""
@@ -11,7 +12,6 @@ class WhoAmI(RESTEntity):
     pass
 
   @restcall
-  @tools.expires(secs=-1)
   def get(self):
     """Return information on the calling user.
 
@@ -46,10 +46,16 @@ class WhoAmI(RESTEntity):
       role title for "Global Admin" is "global-admin", and for the site
       "T1\_CH\_CERN" it is "t1-ch-cern".
 
+    The description comes from the user's cached authorisation index, and
+    the response has an ETag so clients can revalidate it cheaply. It is
+    private to the user and must be revalidated on every use.
+
     :returns: sequence of one dictionary which describes the user."""
 
-    user = cherrypy.request.user
-    for authz in user['roles'].values():
-      for k in ('site', 'group'):
-        authz[k] = [x for x in authz[k]]
-    return rows([cherrypy.request.user])
+    index = authz_index()
+    request, response = cherrypy.request, cherrypy.response
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.headers["ETag"] = '"%s"' % hashlib.sha1(repr((index.etag,
+      request.headers.get("Accept", None),
+      request.headers.get("Accept-Encoding", None)))).hexdigest()
+    return rows([index.whoami])
@@ -0,0 +1,102 @@
+from WMCore.REST.Format import stream_compress, vary_by
+import cherrypy, zlib
+
+#: Compressors for complete response bodies by HTTP content encoding. The
+#: "deflate" encoding is a raw deflate stream like the REST server uses.
+COMPRESSORS = {
+  "gzip":    lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+  "deflate": lambda level: zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+}
+
+class PayloadRows:
+  """Iterable over the rows of the complete cached result `entry`. Returned
+  by the API instead of a plain row generator to tell :class:`PayloadFormat`
+  the response body depends only on the cache entry, the format and the
+  content encoding, and can be served from the cache."""
+  def __init__(self, entry):
+    self.entry = entry
+
+  def __iter__(self):
+    return iter(self.entry.rows)
+
+class PayloadFormat:
+  """Response format wrapper which caches the formatted and compressed body
+  of complete cached results.
+
+  For a :class:`PayloadRows` result, the body is produced once per cache
+  entry, format and content encoding with `format`, compressed with the
+  first of `encodings` the client accepts, and kept in the ``encoded``
+  dictionary of the :class:`~.CacheEntry`. The body is compressed and
+  streamed out chunk by chunk as it is produced, and the chunks are kept
+  once the complete body has been produced without errors. All later
+  requests for the same data version get the stored chunks without
+  encoding or compressing the result again. Other results are formatted
+  and compressed on the fly like the REST server would; the API object
+  must disable the server's own compression with an empty ``compression``
+  list.
+
+  :arg str mimetype: the MIME type `format` produces.
+  :arg RESTFormat format: the formatter to wrap.
+  :arg list encodings: the content encodings to offer, in preference order.
+  :arg int level: ZLIB compression level; zero disables compression.
+  :arg int chunk: approximate amount of streamed output to compress at once."""
+  def __init__(self, mimetype, format, encodings, level, chunk):
+    self.mimetype = mimetype
+    self.format = format
+    self.encodings = encodings
+    self.level = level
+    self.chunk = chunk
+
+  def _encoding(self):
+    """Return the content encoding to use for the response, or None."""
+    if self.level > 0:
+      for enc in cherrypy.request.headers.elements("Accept-Encoding"):
+        if enc.value in self.encodings and enc.value in COMPRESSORS and enc.qvalue > 0:
+          return enc.value
+    return None
+
+  def _encode(self, stream, etag, encoding, key):
+    """Generator formatting `stream` and compressing it with `encoding` in
+    pieces of about `chunk` bytes. The output is also kept in the cache
+    entry under `key` if it was produced without errors."""
+    z = encoding and COMPRESSORS[encoding](self.level)
+    parts, pending, npending = [], [], 0
+    for chunk in self.format(stream, etag):
+      pending.append(chunk)
+      npending += len(chunk)
+      if npending >= self.chunk:
+        part = "".join(pending)
+        pending, npending = [], 0
+        if z:
+          part = z.compress(part) + z.flush(zlib.Z_SYNC_FLUSH)
+        parts.append(part)
+        yield part
+
+    part = "".join(pending)
+    if z:
+      part = z.compress(part) + z.flush()
+    if part:
+      parts.append(part)
+      yield part
+
+    if "X-Error-HTTP" not in cherrypy.response.headers:
+      stream.entry.encoded[key] = parts
+
+  def __call__(self, stream, etag):
+    """Format `stream`, from the cache if possible, and return the output."""
+    if not isinstance(stream, PayloadRows):
+      return stream_compress(self.format(stream, etag), self.encodings,
+                             self.level, self.chunk)
+
+    encoding = self._encoding()
+    vary_by("Accept-Encoding")
+    if encoding:
+      cherrypy.response.headers["Content-Encoding"] = encoding
+
+    key = (self.mimetype, encoding)
+    parts = stream.entry.encoded.get(key, None)
+    if parts is None:
+      return self._encode(stream, etag, encoding, key)
+
+    cherrypy.response.headers["Content-Length"] = sum(len(p) for p in parts)
+    return parts
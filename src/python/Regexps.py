@@ -92,3 +92,9 @@ RX_FQDN      = re.compile(r"(?i)^(([-A-Z0-9]+\.)+[A-Z]{2,5}(:\d+)?)?$")
 
 #: Regular expression for URLs.
 RX_URL       = re.compile(r"(?i)^(https?://([-A-Z0-9]+\.)+[A-Z]{2,5}(:\d+)?(/[-A-Z0-9_.%/+]*)?)?$")
+
+#: Regular expression for change feed tokens: change log sequence numbers.
+RX_SINCE     = re.compile(r"^\d{1,20}$")
+
+#: Regular expression for client idempotency keys.
+RX_IDEMPOTENCY_KEY = re.compile(r"^[-A-Za-z0-9_.:]{1,128}$")
@@ -1,19 +1,153 @@
-from WMCore.REST.Auth import authz_match
-import cherrypy
+from WMCore.REST.Auth import authz_canonical, get_user_info
+from threading import Lock
+import cherrypy, hashlib
+
+#: Query for the CMS names of each site.
+CMS_NAMES_SQL = """select s.name site_name, c.name alias from site s
+                   join site_cms_name_map cmap on cmap.site_id = s.id
+                   join cms_name c on c.id = cmap.cms_name_id"""
+
+def cms_name_map(rows, sites = None):
+  """Return dictionary of site name to list of CMS names from `rows` of
+  :obj:`CMS_NAMES_SQL`, adding to `sites` if given."""
+  if sites is None:
+    sites = {}
+  for old, canonical in rows:
+    if old not in sites:
+      sites[old] = []
+    sites[old].append(canonical)
+  return sites
+
+class AuthzIndex:
+  """Authorisation index for one user, built from the ``roles`` of the user
+  information `user`. Maps each role to frozen sets of the groups and sites
+  it applies to, and each group and site to the roles the user has for it,
+  so authorisation checks are set lookups regardless of how many roles the
+  user has. Also holds the ``whoami`` description of the user and an ETag
+  for it."""
+  def __init__(self, user):
+    self.roles = {}
+    self.bygroup = {}
+    self.bysite = {}
+    for r, authz in ((user and user['roles']) or {}).iteritems():
+      groups, sites = frozenset(authz['group']), frozenset(authz['site'])
+      self.roles[r] = (groups, sites)
+      for g in groups:
+        self.bygroup.setdefault(g, set()).add(r)
+      for s in sites:
+        self.bysite.setdefault(s, set()).add(r)
+    self.allroles = frozenset(self.roles)
+
+    self.whoami = dict(user or {})
+    self.whoami['roles'] = dict((r, {'group': sorted(g), 'site': sorted(s)})
+                                for r, (g, s) in self.roles.iteritems())
+    self.etag = hashlib.sha1(repr(sorted(self.whoami.items()))).hexdigest()
+
+  def matching(self, role):
+    """Return the set of roles the user has among canonical `role` names,
+    or all the user's roles if `role` is empty."""
+    if not role:
+      return self.allroles
+    return self.allroles.intersection(role)
+
+  def granted(self, roles, groups = (), sites = ()):
+    """Return True if any of `roles`, as returned by :meth:`matching`, is
+    granted for any of the canonical `groups` or `sites`."""
+    for g in groups:
+      if g in self.bygroup and not roles.isdisjoint(self.bygroup[g]):
+        return True
+    for s in sites:
+      if s in self.bysite and not roles.isdisjoint(self.bysite[s]):
+        return True
+    return False
+
+class AuthzIndexCache:
+  """Cache of :class:`AuthzIndex` shared by all the server threads. Keyed
+  by the user's identity and roles, so a change in the roles the front-end
+  reports for the user gets a new index. At most `maxusers` indices are
+  kept; the least recently used ones are dropped first."""
+  def __init__(self, maxusers = 1000):
+    self.maxusers = maxusers
+    self._lock = Lock()
+    self._serial = 0
+    self._indices = {}
+
+  def get(self, user):
+    """Return the authorisation index for user information `user`."""
+    roles = frozenset((r, frozenset(authz['group']), frozenset(authz['site']))
+                      for r, authz in ((user and user['roles']) or {}).iteritems())
+    key = tuple((user or {}).get(k, None) for k in ('login', 'dn', 'name', 'method')) + (roles,)
+    with self._lock:
+      self._serial += 1
+      item = self._indices.get(key, None)
+      if item:
+        item[0] = self._serial
+        return item[1]
+
+    index = AuthzIndex(user)
+    with self._lock:
+      if len(self._indices) >= self.maxusers:
+        for k, _ in sorted(self._indices.items(), key = lambda x: x[1][0]) \
+                    [:len(self._indices) - self.maxusers / 2]:
+          del self._indices[k]
+      self._indices[key] = [self._serial, index]
+    return index
+
+#: Authorisation indices of the recent users.
+AUTHZ_INDICES = AuthzIndexCache()
+
+def _canonical(names):
+  """Return the canonical forms of `names`, a string or a list of them."""
+  if isinstance(names, basestring):
+    names = [names]
+  return [authz_canonical(n) for n in names]
+
+def authz_index():
+  """Return the :class:`AuthzIndex` of the user making the current request.
+  Looked up in :obj:`AUTHZ_INDICES` once per request."""
+  request = cherrypy.request
+  index = getattr(request, 'sitedb_authz', None)
+  if not index:
+    index = request.sitedb_authz = AUTHZ_INDICES.get(get_user_info())
+  return index
+
+def authz_match(role=[], group=[], site=[], verbose=False):
+  """Match user against authorisation requirements. Drop-in replacement for
+  :func:`WMCore.REST.Auth.authz_match` with the same decisions, but using
+  the user's cached :class:`AuthzIndex`."""
+  role, group, site = _canonical(role or []), _canonical(group or []), _canonical(site or [])
+  if not (role or group or site):
+    return
+
+  index = authz_index()
+  roles = index.matching(role)
+  if roles and (not (group or site) or index.granted(roles, group, site)):
+    if verbose:
+      cherrypy.log("DEBUG: authz accepted role %s group %s site %s for user %s"
+                   % (role, group, site, get_user_info()))
+    return
+
+  cherrypy.log("ERROR: authz denied role %s group %s site %s for user %s"
+               % (role, group, site, get_user_info()))
+  raise cherrypy.HTTPError(403, "You are not allowed to access this resource.")
+
+def _site_map(api, sites):
+  """Return the site name translation table for `sites`, see
+  :func:`oldsite_authz_match`."""
+  if not sites:
+    c, _ = api.execute(CMS_NAMES_SQL)
+    sites = cms_name_map(c, sites)
+  return sites
 
 def oldsite_authz_match(api, sites, role=[], group=[], site=[], verbose=False):
   """Like authz_match, but translates site names from old to new via `api`.
-  The caller must provide `sites`, an initially empty dictionary, used to
-  cache site name translation lookups."""
+  If `sites` is None, the translation table is read in the request's own
+  transaction, so write requests are authorised against the current site
+  names, never a cached copy which may be stale. Otherwise the caller must
+  provide `sites`, an initially empty dictionary, used to cache site name
+  translation lookups."""
   # Initialise cache if not yet done.
-  if not sites:
-    c, _ = api.execute("""select s.name site_name, c.name alias from site s
-                          join site_cms_name_map cmap on cmap.site_id = s.id
-                          join cms_name c on c.id = cmap.cms_name_id""")
-    for old, canonical in c:
-      if old not in sites:
-        sites[old] = []
-      sites[old].append(canonical)
+  sites = _site_map(api, sites)
 
   # Remap sites. Ignore sites which don't exist, rather than raising an error.
   # This is needed so that a global admin can perform the operations on site
@@ -24,3 +158,43 @@ def oldsite_authz_match(api, sites, role=[], group=[], site=[], verbose=False):
 
   # Now perform normal authz_match.
   return authz_match(role, group, remapped, verbose)
+
+def oldsite_authz_batch(api, sites, role=[], group=[], site=[]):
+  """Authorise an operation on every site in `site` at once. The result is
+  the same as calling :func:`oldsite_authz_match` for each site separately,
+  but the user's privileges are resolved once, and each distinct site name
+  is checked only once, so the cost does not grow with the number of rows
+  in bulk updates. If access is denied, raises a single 403 error listing
+  all the sites the user is not allowed to operate on.
+
+  :arg api: the data API object, for site name translation.
+  :arg dict sites: site name translations as for :func:`oldsite_authz_match`.
+  :arg list role: roles required, any one of which is sufficient.
+  :arg list group: groups in which any of the roles grants access.
+  :arg list site: site names, possibly repeated, to authorise."""
+  role, group = _canonical(role), _canonical(group)
+  if not (role or group or site):
+    return
+
+  # Resolve the roles once; the group check covers all the sites.
+  index = authz_index()
+  roles = index.matching(role)
+  if roles and index.granted(roles, group):
+    return
+
+  # Check each distinct site against the user's roles.
+  sites = _site_map(api, sites)
+  denied = []
+  for s in sorted(set(site)):
+    remapped = _canonical(sites.get(s, []))
+    if not (role or group or remapped):
+      continue
+    if not roles or not ((not group and not remapped)
+                         or index.granted(roles, (), remapped)):
+      denied.append(s)
+
+  if denied:
+    cherrypy.log("ERROR: authz denied role %s group %s sites %s for user %s"
+                 % (role, group, denied, get_user_info()))
+    raise cherrypy.HTTPError(403, "You are not allowed to operate on site%s %s."
+                             % ((len(denied) > 1 and "s") or "", ", ".join(denied)))
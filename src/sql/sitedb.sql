@@ -576,5 +576,25 @@ create table sites_esp_credits(
 );
 create sequence sites_esp_credits_sq by 1 start with 1;
 
+----
+--  Change log for the change feeds
+----
+
+-- Every committed transaction gets one sequence number, with one row for
+-- each table it modified, and one row for each result row key of an API
+-- it changed. A row with just the API name records that the transaction
+-- did not change the rows of that API's result.
+create table change_log (
+  seq				number(20) not null,
+  ctime				number(20,6) not null,
+  tbl				varchar(100),
+  api				varchar(100),
+  item				varchar(4000),
+  op				varchar(10)
+);
+create sequence change_log_sq increment by 1 start with 1;
+create index ix_change_log_seq on change_log (seq);
+create index ix_change_log_ctime on change_log (ctime);
+
 -- begin execute immediate 'create role sitedb_website', exception when others then if sqlcode = -01921 then null, else raise, end if, end
 create role sitedb_website identified by @PASSWORD@;
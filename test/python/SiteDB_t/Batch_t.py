@@ -0,0 +1,82 @@
+'''
+Unit tests for batch transactions and the result cache.
+'''
+import unittest
+from cherrypy import request, serving
+from WMCore.REST.Server import RESTEntity, RESTArgs
+from SiteDB.Cache import ResultCache
+from SiteDB.Data import Data
+from SiteDB.DataBatch import Batch
+from SiteDB_t.FakeDB import FakeConnection, fake_request
+
+SITES = "select name from site order by name"
+
+class TestData(Data):
+    """Data API object with just the result cache, without a server."""
+    def __init__(self):
+        self._cache = ResultCache()
+        self._arraysize = 100
+        self._changetime = 86400
+        self._changesettle = 0
+
+class Writer(RESTEntity):
+    """Entity inserting a site, then reading the site list."""
+    def put(self, name):
+        self.api.execute("insert into site (name) values (:name)", name = name)
+        return [list(self.api.cached(["site"], SITES).rows)]
+
+class Failer(RESTEntity):
+    """Entity which always fails."""
+    def put(self):
+        raise RuntimeError("failed")
+
+class Batch_t(unittest.TestCase):
+
+    def setUp(self):
+        self.api = TestData()
+        self.conn = FakeConnection("create table site (name varchar(100));"
+                                   "insert into site values ('T1_CH_CERN');")
+        fake_request(self.conn)
+
+    def tearDown(self):
+        serving.clear()
+
+    def logged(self):
+        return self.conn.db.execute("select seq, tbl from change_log").fetchall()
+
+    def testRollbackNotCached(self):
+        entry = self.api.cached(["site"], SITES)
+        self.assertEqual(entry.rows, [("T1_CH_CERN",)])
+
+        writer, failer = Writer(None, self.api, None, None), Failer(None, self.api, None, None)
+        batch = Batch(None, self.api, None, None)
+        ops = [("PUT", "writer", { "entity": writer }, RESTArgs([], { "name": "T2_CH_NEW" })),
+               ("PUT", "failer", { "entity": failer }, RESTArgs([], {}))]
+        seen = []
+        writer.put = lambda name: seen.append(Writer.put.im_func(writer, name)) or []
+        self.assertRaises(RuntimeError, batch.post, ops)
+        self.assertEqual(seen, [[[("T1_CH_CERN",), ("T2_CH_NEW",)]]])
+
+        # The uncommitted row was never shared through the cache.
+        self.assertEqual(self.api._cache.get("test", entry.key), entry)
+        self.assertEqual(self.api.lookup(SITES), None)
+
+        self.conn.rollback()
+        request.db["batch"] = False
+        self.api._invalidate()
+        self.assertEqual(self.api.cached(["site"], SITES).rows, [("T1_CH_CERN",)])
+        self.assertEqual(self.logged(), [])
+
+    def testCommitCached(self):
+        self.api.execute("insert into site (name) values (:name)", name = "T2_CH_NEW")
+        self.assertEqual(self.api.cached(["site"], SITES).rows,
+                         [("T1_CH_CERN",), ("T2_CH_NEW",)])
+        self.assertEqual(self.api.lookup(SITES), None)
+        self.assertEqual(self.logged(), [])
+        self.api.commit()
+        self.assertEqual(self.logged(), [(1, "site")])
+        entry = self.api.cached(["site"], SITES)
+        self.assertEqual(self.api.lookup(SITES), entry)
+
+if __name__ == "__main__":
+    unittest.main()
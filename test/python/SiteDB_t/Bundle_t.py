@@ -0,0 +1,114 @@
+'''
+Unit tests for the bundle entity.
+'''
+import unittest
+from cherrypy import request, response, serving
+from SiteDB.Cache import ResultCache
+from SiteDB.Data import Data
+from SiteDB.DataBundle import Bundle
+from SiteDB.DataRoles import Roles
+from SiteDB.DataGroups import Groups
+from SiteDB_t.FakeDB import FakeConnection, fake_request
+
+class TestData(Data):
+    """Data API object with just the result cache and a few entities."""
+    def __init__(self):
+        self._cache = ResultCache()
+        self._arraysize = 100
+        self._changetime = 86400
+        self._changesettle = 0
+        self.methods = { "GET": {} }
+        for name, entity in (("roles", Roles), ("groups", Groups)):
+            e = entity(None, self, None, None)
+            self.methods["GET"][name] = { "entity": e, "tables": getattr(e.get, "rest.params")["tables"] }
+
+class Bundle_t(unittest.TestCase):
+
+    def setUp(self):
+        self.api = TestData()
+        self.conn = FakeConnection("""
+          create table role (title varchar(100), description varchar(100));
+          create table user_group (name varchar(100));
+          insert into role values ('Site Admin', 'Administers a site');
+          insert into user_group values ('global');""")
+        self.bundle = Bundle(None, self.api, None, None)
+        self.request()
+
+    def tearDown(self):
+        serving.clear()
+
+    def request(self):
+        fake_request(self.conn)
+        request.user = { "dn": "/CN=test", "login": "test" }
+
+    def testItems(self):
+        result = list(self.bundle.get(["roles", "groups"], []))
+        self.assertEqual([r["item"] for r in result], ["roles", "groups"])
+        self.assertTrue(all(r["changed"] for r in result))
+        self.assertEqual(result[0]["columns"], ["title", "description"])
+        self.assertEqual(list(result[0]["result"]), [("Site Admin", "Administers a site")])
+        self.assertEqual(list(result[1]["result"]), [("global",)])
+        self.assertTrue("ETag" in response.headers)
+        self.assertFalse("Last-Modified" in response.headers)
+
+    def testVersions(self):
+        first = list(self.bundle.get(["roles", "groups"], []))
+        etag = response.headers["ETag"]
+        versions = ["%s:%s" % (r["item"], r["version"]) for r in first]
+
+        self.request()
+        same = list(self.bundle.get(["roles", "groups"], versions))
+        self.assertEqual([(r["changed"], r["result"]) for r in same],
+                         [(False, None), (False, None)])
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        self.request()
+        self.api.execute("insert into user_group values ('admins')")
+        self.api.commit()
+        self.request()
+        changed = list(self.bundle.get(["roles", "groups"], versions))
+        self.assertEqual([r["changed"] for r in changed], [False, True])
+        self.assertEqual(list(changed[1]["result"]), [("global",), ("admins",)])
+        self.assertNotEqual(changed[1]["version"], first[1]["version"])
+
+    def testNoItemValidators(self):
+        list(self.bundle.get(["roles", "groups"], []))
+        fake_request(self.conn, **{ "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT" })
+        request.user = { "dn": "/CN=test", "login": "test" }
+        result = list(self.bundle.get(["roles", "groups"], []))
+        self.assertEqual(len(result), 2)
+        self.assertFalse("Last-Modified" in response.headers)
+
+    def changing(self, times):
+        """Make the groups item see a concurrent change of the roles in
+        the first `times` reads, and return the list of snapshots taken."""
+        entity = self.api.methods["GET"]["groups"]["entity"]
+        get, snapshot, snapshots = entity.get, self.api.snapshot, []
+        def changed_get(*args, **kwargs):
+            if len(snapshots) <= times:
+                self.conn.db.execute("insert into role values ('R%d', 'x')" % len(snapshots))
+                self.conn.db.commit()
+                self.api._cache.invalidate("test", ["role"])
+            return get(*args, **kwargs)
+        def record(tables, fresh = False):
+            snapshots.append(fresh)
+            return snapshot(tables, fresh)
+        entity.get, self.api.snapshot = changed_get, record
+        return snapshots
+
+    def testSnapshotRetry(self):
+        list(self.bundle.get(["roles", "groups"], []))
+        snapshots = self.changing(1)
+        self.request()
+        result = list(self.bundle.get(["roles", "groups"], []))
+        self.assertEqual(snapshots, [False, False])
+        self.assertEqual(len(result[0]["result"]), 2)
+
+    def testSnapshotFresh(self):
+        snapshots = self.changing(3)
+        result = list(self.bundle.get(["roles", "groups"], []))
+        self.assertEqual(snapshots, [False, False, True])
+        self.assertEqual(len(list(result[0]["result"])), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+'''
+Unit tests for the result cache.
+'''
+import unittest, time, re
+from operator import itemgetter
+from threading import Thread
+from SiteDB.Cache import ResultCache, OutcomeCache, CacheEntry, dml_tables, \
+                         CASCADES, rxplan
+
+class Cache_t(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(maxage = 300, waittime = 1)
+
+    def testAcquireFill(self):
+        entry, token = self.cache.acquire("test", "q")
+        self.assertEqual(entry, None)
+        self.assertNotEqual(token, None)
+        self.cache.put("test", "q", ["site"], (0,), ["a"], [(1,)])
+        self.cache.release("test", "q", token)
+        entry, token = self.cache.acquire("test", "q")
+        self.assertEqual(entry.rows, [(1,)])
+        self.assertEqual(token, None)
+
+    def testAcquireWaitsForFill(self):
+        entry, token = self.cache.acquire("test", "q")
+        result = []
+        waiter = Thread(target = lambda: result.append(self.cache.acquire("test", "q")))
+        waiter.start()
+        time.sleep(0.1)
+        self.assertEqual(result, [])
+        self.cache.put("test", "q", ["site"], (0,), ["a"], [(1,)])
+        self.cache.release("test", "q", token)
+        waiter.join()
+        self.assertEqual(result[0][0].rows, [(1,)])
+        self.assertEqual(result[0][1], None)
+
+    def testAcquireTimeout(self):
+        entry, token = self.cache.acquire("test", "q")
+        start = time.time()
+        self.assertEqual(self.cache.acquire("test", "q"), (None, None))
+        self.assertTrue(time.time() - start >= 0.9)
+        self.cache.release("test", "q", token)
+        entry, token = self.cache.acquire("test", "q")
+        self.assertNotEqual(token, None)
+
+    def testInvalidate(self):
+        self.cache.put("test", "q", ["site"], self.cache.stamp("test", ["site"]),
+                       ["a"], [(1,)])
+        self.assertNotEqual(self.cache.get("test", "q"), None)
+        self.cache.invalidate("test", ["site"])
+        self.assertEqual(self.cache.get("test", "q"), None)
+
+class DmlTables_t(unittest.TestCase):
+
+    def testSelect(self):
+        self.assertEqual(dml_tables("select * from site"), set())
+        self.assertEqual(dml_tables("  SELECT id FROM contact for update"), set())
+
+    def testInsertUpdateMerge(self):
+        self.assertEqual(dml_tables("insert into site (id) values (:id)"),
+                         set(["site"]))
+        self.assertEqual(dml_tables("UPDATE Contact SET email = :email"),
+                         set(["contact"]))
+        self.assertEqual(dml_tables("merge into psn_node p using dual on (1=1)"),
+                         set(["psn_node"]))
+        self.assertEqual(dml_tables("""insert all
+                                       into sam_name (id) values (1)
+                                       into sam_cms_name_map (sam_id) values (1)
+                                       select 1 from dual"""),
+                         set(["sam_name", "sam_cms_name_map"]))
+
+    def testInsertDoesNotCascade(self):
+        self.assertEqual(dml_tables("insert into user_passwd (username) values (:u)"),
+                         set(["user_passwd"]))
+
+    def testDeleteCascades(self):
+        self.assertEqual(dml_tables("delete from user_passwd where username = :u"),
+                         set(["user_passwd", "contact", "site_responsibility",
+                              "group_responsibility", "data_responsibility",
+                              "survey"]))
+        self.assertEqual(dml_tables("delete from sam_name where id = :id"),
+                         set(["sam_name", "sam_cms_name_map"]))
+
+    def testDeleteClosure(self):
+        tables = dml_tables("delete from site where name = :name")
+        for t in CASCADES["site"] + CASCADES["resource_element"] \
+                 + CASCADES["phedex_node"] + CASCADES["psn_node"]:
+            self.assertTrue(t in tables, t)
+        self.assertFalse("contact" in tables)
+
+class RxPlan_t(unittest.TestCase):
+
+    def testLiteral(self):
+        self.assertEqual(rxplan(re.compile("T1_CH_CERN")), (False, ["T1_CH_CERN"]))
+        self.assertEqual(rxplan(re.compile("^T1_CH_CERN$")), (True, ["T1_CH_CERN"]))
+        self.assertEqual(rxplan(re.compile("T1_CH.*")), (False, ["T1_CH"]))
+        self.assertEqual(rxplan(re.compile(r"T1\.x$")), (True, ["T1.x"]))
+
+    def testAlternation(self):
+        self.assertEqual(rxplan(re.compile("^(?:T1_CH_CERN|T2_CH_CERN)$")),
+                         (True, ["T1_CH_CERN", "T2_CH_CERN"]))
+        self.assertEqual(rxplan(re.compile("(T1|T2)")), (False, ["T1", "T2"]))
+
+    def testComplex(self):
+        for pat in ("T[12]_CH", "T1.*CERN", "a|b", "T1+", r"(a\|b)"):
+            self.assertEqual(rxplan(re.compile(pat)), None, pat)
+        self.assertEqual(rxplan(re.compile("t1", re.I)), None)
+
+    def testEscapedAnchor(self):
+        self.assertEqual(rxplan(re.compile(r"T1\$")), (False, ["T1$"]))
+
+class Select_t(unittest.TestCase):
+
+    def setUp(self):
+        names = ["T1_CH_CERN", "T2_CH_CERN", "T2_CH_CERN_HLT", "T1_US_FNAL",
+                 "T1_US_FNAL_Disk", "T2_CH_CERN\n", "T3_CH_CERN", "T2_CH"]
+        rows = [(i, n) for i, n in enumerate(names)] + [(99, None)]
+        self.entry = CacheEntry("q", ["site"], (0,), 0, ["id", "name"],
+                                rows, "", 0)
+
+    def testSameAsMatch(self):
+        for pat in ("T1", "T2_CH_CERN", "^T2_CH_CERN$", "T1_US_FNAL.*",
+                    "^(?:T1_CH_CERN|T2_CH)$", "(T3|T1_US)", "T4", ""):
+            rx = re.compile(pat)
+            expect = [r for r in self.entry.rows
+                      if r[1] is not None and rx.match(r[1])]
+            self.assertEqual(self.entry.select(rx, itemgetter(1)), expect, pat)
+
+    def testOrder(self):
+        rows = self.entry.select(re.compile("T"), itemgetter(1))
+        self.assertEqual([r[0] for r in rows], range(8))
+
+    def testUnindexable(self):
+        self.assertEqual(self.entry.select(re.compile("T[12]"), itemgetter(1)), None)
+        self.assertEqual(self.entry.select(re.compile("T1"), itemgetter(0, 1)), None)
+
+class OutcomeCache_t(unittest.TestCase):
+
+    def setUp(self):
+        self.outcomes = OutcomeCache(maxage = 60, waittime = 0.5)
+
+    def testReplay(self):
+        outcome, token = self.outcomes.begin("k")
+        self.assertEqual(outcome, None)
+        self.outcomes.end("k", token, "f", [1])
+        self.assertEqual(self.outcomes.begin("k"), (("f", [1]), None))
+
+    def testFailureNotRecorded(self):
+        _, token = self.outcomes.begin("k")
+        self.outcomes.end("k", token, "f", None)
+        outcome, token = self.outcomes.begin("k")
+        self.assertEqual(outcome, None)
+        self.assertNotEqual(token, None)
+
+    def testWaitsForOriginal(self):
+        _, token = self.outcomes.begin("k")
+        result = []
+        retry = Thread(target = lambda: result.append(self.outcomes.begin("k")))
+        retry.start()
+        time.sleep(0.1)
+        self.outcomes.end("k", token, "f", [1])
+        retry.join()
+        self.assertEqual(result, [(("f", [1]), None)])
+
+    def testInProgressTimeout(self):
+        _, token = self.outcomes.begin("k")
+        self.assertEqual(self.outcomes.begin("k"), (None, None))
+        self.outcomes.end("k", token, "f", [1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+'''
+Unit tests for the columnar response format.
+'''
+import unittest
+from cherrypy import request, response, serving
+from cherrypy._cprequest import Request, Response
+from cherrypy.lib import httputil
+from SiteDB.Columnar import ColumnarFormat, columnar_decode
+
+class FakeETag:
+    def __init__(self):
+        self.data, self.invalid = "", False
+
+    def update(self, chunk):
+        self.data += chunk
+
+    def invalidate(self):
+        self.invalid = True
+
+class Columnar_t(unittest.TestCase):
+
+    def setUp(self):
+        serving.load(Request(httputil.Host("127.0.0.1", 0), httputil.Host("127.0.0.1", 0)),
+                     Response())
+
+    def tearDown(self):
+        serving.clear()
+
+    def encode(self, rows, **preamble):
+        request.rest_generate_preamble = preamble
+        etag = FakeETag()
+        data = "".join(ColumnarFormat().stream_chunked(iter(rows), etag))
+        self.assertFalse(etag.invalid)
+        self.assertEqual(etag.data, data)
+        return data
+
+    def testChangeFeedDescription(self):
+        data = self.encode([["insert", 1, "T1_CH_CERN"]],
+                           columns = ["change", "id", "name"],
+                           sequence = "48213", reset = True)
+        columns, rows, desc = columnar_decode(data)
+        self.assertEqual(columns, ["change", "id", "name"])
+        self.assertEqual(rows, [["insert", 1, "T1_CH_CERN"]])
+        self.assertEqual(desc, { "sequence": "48213", "reset": True })
+
+    def testRoundTrip(self):
+        rows = [[1, 2.5, u"T2_CH_CERN", None],
+                [None, None, None, u"caf\xe9 \u2603"],
+                [-2**63, -0.25, u"", u"x"],
+                [2**63 - 1, 1e300, u"T2_CH_CERN", None]]
+        data = self.encode(rows, columns = ["i", "f", "s", "u"])
+        self.assertEqual(columnar_decode(data), (["i", "f", "s", "u"], rows, {}))
+
+    def testColumnTypes(self):
+        rows = [[1, 1, True, 2**64, "a", None], [2.5, None, False, 1, 3, None]]
+        columns, result, desc = columnar_decode(self.encode(rows, columns = list("abcdef")))
+        self.assertEqual(result, [[1.0, 1, True, float(2**64), u"a", None],
+                                  [2.5, None, False, 1.0, 3, None]])
+        self.assertTrue(isinstance(result[0][0], float))
+        self.assertTrue(isinstance(result[0][1], (int, long)))
+        self.assertTrue(isinstance(result[1][4], (int, long)))
+
+    def testMixedColumn(self):
+        rows = [["T1_CH_CERN"], [None], [3], [u"caf\xe9"], [[1, "x"]]]
+        self.assertEqual(columnar_decode(self.encode(rows, columns = ["m"]))[1], rows)
+
+    def testUtf8Bytes(self):
+        rows = [["caf\xc3\xa9"]]
+        self.assertEqual(columnar_decode(self.encode(rows, columns = ["s"]))[1],
+                         [[u"caf\xe9"]])
+
+    def testManyNulls(self):
+        rows = [[i % 3 and i or None, None] for i in xrange(37)]
+        self.assertEqual(columnar_decode(self.encode(rows, columns = ["i", "n"]))[1], rows)
+
+    def testEmpty(self):
+        self.assertEqual(columnar_decode(self.encode([], columns = ["a", "b"])),
+                         (["a", "b"], [], {}))
+        self.assertEqual(columnar_decode(self.encode([])), ([], [], {}))
+
+    def testDefaultColumnNames(self):
+        columns, rows, _ = columnar_decode(self.encode([(1, "a")]))
+        self.assertEqual(columns, ["column0", "column1"])
+        self.assertEqual(rows, [[1, u"a"]])
+
+    def testNotRows(self):
+        request.rest_generate_preamble = {}
+        etag = FakeETag()
+        list(ColumnarFormat().stream_chunked(iter([{ "a": 1 }]), etag))
+        self.assertTrue(etag.invalid)
+
+    def testBadMagic(self):
+        self.assertRaises(ValueError, columnar_decode, "[]")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,343 @@
+'''
+Unit tests for the LDAP synchronisation.
+'''
+import unittest, re, time, types, ldap, cherrypy
+from threading import Condition, Lock
+from cherrypy import request, serving
+from SiteDB.Cache import ResultCache
+from SiteDB.Data import Data
+from SiteDB.DataLdapSync import LdapSync, LdapSyncThread
+from SiteDB_t.FakeDB import FakeConnection, FakePool, fake_request
+
+#: Account names to check the partitions with.
+NAMES = ["a", "aaron", "abc", "b", "diego", "m", "mzz", "n", "zz", "zzz",
+         "_svc", "0admin", "9", "~", "lat\xc3\xa9"] + \
+        [c + s for c in "abcdefghijklmnopqrstuvwxyz" for s in ("", "a", "zzzz")]
+
+def matches(ldfilter, name):
+  """Evaluate partition filter `ldfilter` for account `name`."""
+  for neg, bound in re.findall(r"(\(!)?\(sAMAccountName>=([^)]*)\)", ldfilter):
+    if (name >= bound) == bool(neg):
+      return False
+  return True
+
+class FakePagedControl:
+  def __init__(self, cookie):
+    self.cookie = cookie
+    self.size = 0
+
+class FakeLDAP:
+  """LDAP connection returning `pages`, failing with SERVER_DOWN before
+  page `failat` if given."""
+  def __init__(self, pages, failat = None):
+    self.pages, self.failat = pages, failat
+    self.searches, self.unbound = 0, False
+
+  def search_ext(self, base, scope, ldfilter, attrs, serverctrls, sizelimit):
+    if self.searches == self.failat:
+      raise ldap.SERVER_DOWN("connection lost")
+    self.searches += 1
+    return self.searches
+
+  def result3(self, msgid, timeout):
+    more = (msgid < len(self.pages) and "cookie%d" % msgid) or ""
+    return None, self.pages[msgid-1], msgid, [FakePagedControl(more)]
+
+  def unbind_s(self):
+    self.unbound = True
+
+def entry(name, changed, status = "512"):
+  """Return LDAP entry for account `name` changed at time `changed`."""
+  return ("CN=%s,OU=Users,OU=Organic Units,DC=cern,DC=ch" % name,
+          { "sAMAccountName": [name], "displayName": ["Test %s" % name.title()],
+            "employeeID": ["123456"], "mail": ["%s@cern.ch" % name],
+            "userAccountControl": [status],
+            "whenChanged": [time.strftime("%Y%m%d%H%M%S.0Z", time.gmtime(changed))] })
+
+class DataLdapSync_t(unittest.TestCase):
+
+    def setUp(self):
+        self.thread = LdapSyncThread.__new__(LdapSyncThread)
+        self.thread._ldlock = Lock()
+        self.thread._ldidle = []
+        self.thread._parts = 1
+        self.initialize = ldap.initialize
+        self.connections = []
+        ldap.initialize = lambda url: self.connections.pop(0)
+
+    def tearDown(self):
+        ldap.initialize = self.initialize
+
+    def testPartitions(self):
+        for parts in range(1, 30):
+            self.thread._parts = parts
+            filters = self.thread._ldpartitions()
+            self.assertEqual(len(filters), min(parts, 26))
+            for name in NAMES:
+                self.assertEqual(len([f for f in filters if matches(f, name)]), 1,
+                                 (parts, name))
+
+    def testUsers(self):
+        self.thread._warnings = {}
+        bad = entry("bob", 0)
+        bad[1]["displayName"] = [""]
+        cherrypy.log.screen = False
+        try:
+            users = list(self.thread._users([entry("ann", 0), bad], 0))
+        finally:
+            cherrypy.log.screen = None
+        self.assertEqual([u["username"] for u in users], ["ann"])
+        self.assertEqual(users[0]["dn"], "/DC=ch/DC=cern/OU=Organic Units/OU=Users"
+                                         "/CN=ann/CN=123456/CN=Test Ann")
+
+    def testSinglePartition(self):
+        self.assertEqual(self.thread._ldpartitions(), [""])
+
+    def testPool(self):
+        self.connections = [FakeLDAP([["a"], ["b"]])]
+        self.assertEqual(list(self.thread._ldsearch("ldap://x", "", ["sAMAccountName"])), [["a"], ["b"]])
+        self.assertEqual(len(self.thread._ldidle), 1)
+        self.thread._ldidle[0][1].searches = 0
+        self.assertEqual(list(self.thread._ldsearch("ldap://x", "", ["sAMAccountName"])), [["a"], ["b"]])
+        self.assertEqual(self.connections, [])
+
+    def testRetryStaleConnection(self):
+        stale, fresh = FakeLDAP([["a"]], failat = 0), FakeLDAP([["a"], ["b"]])
+        self.thread._ldidle = [("ldap://x", stale)]
+        self.connections = [fresh]
+        self.assertEqual(list(self.thread._ldsearch("ldap://x", "", ["sAMAccountName"])), [["a"], ["b"]])
+        self.assertTrue(stale.unbound)
+        self.assertEqual(self.thread._ldidle, [("ldap://x", fresh)])
+
+    def testNoRetryNewConnection(self):
+        conn = FakeLDAP([["a"]], failat = 0)
+        self.connections = [conn, FakeLDAP([["a"]])]
+        self.assertRaises(ldap.SERVER_DOWN, list, self.thread._ldsearch("ldap://x", "", ["sAMAccountName"]))
+        self.assertTrue(conn.unbound)
+        self.assertEqual(self.thread._ldidle, [])
+
+    def testNoRetryAfterPages(self):
+        conn = FakeLDAP([["a"], ["b"]], failat = 1)
+        self.thread._ldidle = [("ldap://x", conn)]
+        self.connections = [FakeLDAP([["a"], ["b"]])]
+        pages = self.thread._ldsearch("ldap://x", "", ["sAMAccountName"])
+        self.assertEqual(pages.next(), ["a"])
+        self.assertRaises(ldap.SERVER_DOWN, pages.next)
+        self.assertTrue(conn.unbound)
+        self.assertEqual(self.thread._ldidle, [])
+
+class Sync_t(unittest.TestCase):
+
+    T0 = 1700000000
+
+    def setUp(self):
+        cherrypy.log.screen = False
+        self.thread = LdapSyncThread.__new__(LdapSyncThread)
+        for k, v in dict(_cv = Condition(), _warnings = {}, _highmark = 0,
+                         _lastfull = 0, _fullinterval = 86400, _overlap = 900,
+                         _minreq = 1, _full = (0, 0, 0),
+                         _incremental = (0, 0, 0)).iteritems():
+            setattr(self.thread, k, v)
+        self.thread._ldget = self.ldget
+        self.thread._call = self.call
+        self.directory = dict((n, entry(n, self.T0 - t))
+                              for n, t in (("ann", 7200), ("bob", 7200), ("cid", 3600)))
+        self.database = set()
+        self.searches, self.calls = [], []
+
+    def tearDown(self):
+        cherrypy.log.screen = None
+
+    def ldget(self, url, since = None, names = None, attrs = None):
+        self.searches.append((since, names, attrs))
+        page = []
+        for name, (dn, attrs) in sorted(self.directory.items()):
+            changed = self.thread._changed(attrs)
+            if (since is None or changed >= since) and (names is None or name in names):
+                page.append((dn, attrs))
+        if page:
+            yield page
+
+    def call(self, method, rows, incremental):
+        names = [u["username"] for u in rows]
+        self.calls.append((method, names, incremental))
+        if method == "PUT":
+            self.database.update(names)
+        elif method == "POST":
+            return [u for u in names if u not in self.database]
+        elif method == "DELETE":
+            self.database.intersection_update(
+                n for n, (_, attrs) in self.directory.items()
+                if attrs["userAccountControl"] == ["512"])
+
+    def puts(self):
+        return sorted(sum((names for m, names, _ in self.calls if m == "PUT"), []))
+
+    def testFirstRunFull(self):
+        self.thread._sync(self.T0)
+        self.assertEqual(self.searches[0], (None, None, self.thread._ldnames))
+        self.assertEqual(self.searches[1][0], None)
+        self.assertEqual(self.puts(), ["ann", "bob", "cid"])
+        self.assertEqual(self.calls[-1], ("DELETE", [], False))
+        self.assertEqual(self.thread._highmark, self.T0 - 3600)
+        self.assertEqual(self.thread._lastfull, self.T0)
+        self.assertEqual(self.thread._full, (self.T0, 3, 3))
+
+    def testIncrementalOverlap(self):
+        self.thread._sync(self.T0)
+        self.directory["bob"] = entry("bob", self.T0 + 100)
+        self.searches, self.calls = [], []
+        self.thread._sync(self.T0 + 300)
+        self.assertEqual(self.searches[0][0], self.T0 - 3600 - 900)
+        self.assertEqual(self.puts(), ["bob", "cid"])
+        self.assertFalse("DELETE" in [m for m, _, _ in self.calls])
+        self.assertEqual(self.thread._highmark, self.T0 + 100)
+        self.assertEqual(self.thread._lastfull, self.T0)
+
+    def testHighMarkKept(self):
+        self.thread._sync(self.T0)
+        self.directory = {}
+        self.thread._sync(self.T0 + 300)
+        self.assertEqual(self.thread._highmark, self.T0 - 3600)
+        self.searches = []
+        self.thread._sync(self.T0 + 600)
+        self.assertEqual(self.searches[0][0], self.T0 - 3600 - 900)
+
+    def testFullAfterInterval(self):
+        self.thread._sync(self.T0)
+        del self.directory["cid"]
+        self.thread._sync(self.T0 + 86399)
+        self.assertEqual(self.database, set(["ann", "bob", "cid"]))
+        self.searches, self.calls = [], []
+        self.thread._sync(self.T0 + 86400)
+        self.assertEqual(self.searches[0][0], None)
+        self.assertEqual(self.calls[-1], ("DELETE", [], False))
+        self.assertEqual(self.database, set(["ann", "bob"]))
+        self.assertEqual(self.thread._lastfull, self.T0 + 86400)
+
+    def testNewMembers(self):
+        self.thread._sync(self.T0)
+        self.directory["dan"] = entry("dan", self.T0 - 86400)
+        self.directory["eve"] = entry("eve", self.T0 - 86400, status = "514")
+        self.searches, self.calls = [], []
+        self.thread._sync(self.T0 + 300)
+        self.assertEqual(self.searches[1], (None, None, self.thread._ldnames))
+        self.assertEqual([c for c in self.calls if c[0] == "POST"],
+                         [("POST", ["ann", "bob", "cid", "dan"], False)])
+        self.assertEqual(self.searches[2], (None, ["dan"], None))
+        self.assertEqual(self.puts(), ["cid", "dan"])
+        self.assertEqual(self.thread._incremental, (self.T0 + 300, 2, 2))
+
+    def testRefuseFewUsers(self):
+        self.thread._minreq = 4
+        self.thread._sync(self.T0)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.thread._lastfull, 0)
+        self.assertEqual(self.thread._highmark, 0)
+
+class TestData(Data):
+    """Data API object with just the result cache, without a server."""
+    def __init__(self):
+        self._cache = ResultCache()
+        self._arraysize = 100
+        self._changetime = 86400
+        self._changesettle = 0
+
+class LdapSync_t(unittest.TestCase):
+
+    def setUp(self):
+        self.api = TestData()
+        self.conn = FakeConnection("""
+          create table user_passwd (username varchar(60), passwd varchar(30));
+          create table contact (username varchar(60), email varchar(100),
+                                forename varchar(100), surname varchar(100),
+                                dn varchar(1000));
+          insert into user_passwd values ('ann', 'NeedsToBeUpdated');
+          insert into user_passwd values ('bob', 'NeedsToBeUpdated');
+          insert into user_passwd values ('cid', 'NeedsToBeUpdated');
+          insert into user_passwd values ('svc@cern.ch', 'x');
+          insert into contact values ('ann', 'ann@cern.ch', 'Test', 'Ann', '/CN=ann');
+          insert into contact values ('bob', 'bob@cern.ch', 'Test', 'Bob', '/CN=bob');""")
+        self.conn.db.create_function("to_nchar", 1, lambda x: x)
+        fake_request(self.conn)
+        self.entity = LdapSync(None, self.api, None, None)
+        self.entity._syncer = self
+        self.entity._update = lambda *args: self.updates.append(args)
+        self.updates, self.queries, self.ldap = [], [], set(["ann", "cid"])
+
+    def tearDown(self):
+        serving.clear()
+
+    def members(self, names):
+        self.queries.append(names)
+        return [n for n in names if n in self.ldap]
+
+    def row(self, name, email):
+        return { "username": name, "passwd": "NeedsToBeUpdated", "email": email,
+                 "name": "Test %s" % name.title(), "dn": "/CN=%s" % name }
+
+    def testCurrentChunked(self):
+        execute, queries = self.api.execute, []
+        self.api.execute = lambda sql, **binds: queries.append(binds) or execute(sql, **binds)
+        users = self.entity._current(["ann", "bob", "cid", "dan"], chunk = 3)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(sorted(users), ["ann", "bob", "cid"])
+        self.assertEqual(users["bob"]["name"], "Test Bob")
+        self.assertEqual(users["cid"]["email"], None)
+        self.assertEqual(sorted(self.entity._current()), ["ann", "bob", "cid", "svc@cern.ch"])
+
+    def testApplyIncremental(self):
+        self.entity.apply([self.row("bob", "robert@cern.ch"), self.row("ann", "ann@cern.ch"),
+                           self.row("cid", "cid@cern.ch"), self.row("dan", "dan@cern.ch")], True)
+        passwords, contacts, deletions = self.updates[0]
+        self.assertEqual([p["username"] for p in passwords], ["dan"])
+        self.assertEqual([c["username"] for c in contacts], ["bob", "cid", "dan"])
+        self.assertEqual(deletions, [])
+        self.assertEqual(request.db["changed"],
+                         [("people", '["cid"]', "insert"), ("people", '["dan"]', "insert"),
+                          ("people", '["bob"]', "update")])
+
+    def testApplyFull(self):
+        self.entity.apply([self.row("ann", "ann@cern.ch")], False)
+        self.assertEqual(sorted(d["username"] for d in self.updates[0][2]), ["bob", "cid"])
+
+    def testSessionApply(self):
+        serving.clear()
+        pool = FakePool(self.conn)
+        self.api._db = { "test": { "*": { "type": types.ModuleType("cx_Oracle"), "pool": pool } } }
+        def update(passwords, contacts, deletions):
+            # The real updates use Oracle merge statements.
+            for c in contacts:
+                self.api.execute("insert into contact (username, email) values (:username, :email)",
+                                 username = c["username"], email = c["email"])
+            self.api.commit()
+        self.entity._update = update
+        with self.api.session("test", "LdapSyncThread") as api:
+            self.entity.apply([self.row("dan", "dan@cern.ch")], True)
+            api.execute("insert into user_passwd values ('eve', 'x')")
+        self.assertEqual(pool.released, 1)
+        self.assertEqual(self.conn.db.execute("select count(*) from user_passwd"
+                                              " where username = 'eve'").fetchall(), [(0,)])
+        self.assertEqual(self.conn.db.execute("select email from contact"
+                                              " where username = 'dan'").fetchall(),
+                         [("dan@cern.ch",)])
+        self.assertEqual(self.conn.db.execute("select tbl, api, item, op from change_log"
+                                              " order by tbl, api").fetchall(),
+                         [("", "people", '["dan"]', "insert"), ("contact", "", "", "")])
+
+    def testPrune(self):
+        self.conn.db.execute("insert into user_passwd values ('not valid', 'x')")
+        self.entity.prune(chunk = 2)
+        self.assertEqual(self.queries, [["ann", "bob"], ["cid"]])
+        self.assertEqual(self.updates, [([], [], [{ "username": "bob" },
+                                                  { "username": "not valid" }])])
+
+    def testPruneRefuses(self):
+        for i in xrange(20):
+            self.conn.db.execute("insert into user_passwd values ('u%d', 'x')" % i)
+        self.ldap = set()
+        self.assertRaises(RuntimeError, self.entity.prune)
+        self.assertEqual(self.updates, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+'''
+Unit tests for the site name alias index.
+'''
+import unittest, random
+from SiteDB.DataSites import site_alias_index, site_alias_index_update
+
+NAMES = [("cms", "CERN", "T1_CH_CERN"), ("cms", "CERN", "T2_CH_CERN"),
+         ("lcg", "CERN", "CERN-PROD"), ("phedex", "CERN", "T1_CH_CERN"),
+         ("phedex", "CERN", "T1_CH_CERN_Disk"), ("cms", "FNAL", "T1_US_FNAL"),
+         ("psn", "FNAL", "T1_US_FNAL"), ("lcg", "FNAL", "USCMS-FNAL-WC1")]
+
+def normalise(index):
+  """Return `index` with the lists sorted, for comparing indexes built in
+  a different order."""
+  byalias, bysite = index
+  return (dict((a, sorted(v)) for a, v in byalias.iteritems()),
+          dict((s, dict((t, sorted(v)) for t, v in types.iteritems()))
+               for s, types in bysite.iteritems()))
+
+class SiteAliasIndex_t(unittest.TestCase):
+
+    def testBuild(self):
+        byalias, bysite = site_alias_index(NAMES)
+        self.assertEqual(sorted(byalias["T1_CH_CERN"]),
+                         [("cms", "CERN"), ("phedex", "CERN")])
+        self.assertEqual(byalias["CERN-PROD"], [("lcg", "CERN")])
+        self.assertEqual(sorted(bysite["CERN"].keys()), ["cms", "lcg", "phedex"])
+        self.assertEqual(sorted(bysite["CERN"]["cms"]), ["T1_CH_CERN", "T2_CH_CERN"])
+        self.assertEqual(bysite["FNAL"]["psn"], ["T1_US_FNAL"])
+
+    def testDuplicates(self):
+        self.assertEqual(site_alias_index(NAMES + NAMES[:3]), site_alias_index(NAMES))
+
+    def testUpdate(self):
+        index = site_alias_index(NAMES)
+        added = [("cms", "FNAL", "T3_US_FNALLPC"), ("phedex", "FNAL", "T1_US_FNAL")]
+        removed = [("lcg", "CERN", "CERN-PROD"), ("cms", "FNAL", "T1_US_FNAL"),
+                   ("lcg", "FNAL", "USCMS-FNAL-WC1")]
+        byalias, bysite = site_alias_index_update(index, added, removed)
+        self.assertFalse("CERN-PROD" in byalias)
+        self.assertFalse("lcg" in bysite["CERN"])
+        self.assertFalse("lcg" in bysite["FNAL"])
+        self.assertEqual(sorted(byalias["T1_US_FNAL"]),
+                         [("phedex", "FNAL"), ("psn", "FNAL")])
+        self.assertEqual(bysite["FNAL"]["cms"], ["T3_US_FNALLPC"])
+
+    def testRemoveSite(self):
+        index = site_alias_index(NAMES)
+        byalias, bysite = site_alias_index_update(index, [], [n for n in NAMES if n[1] == "FNAL"])
+        self.assertFalse("FNAL" in bysite)
+        self.assertFalse("T1_US_FNAL" in byalias)
+
+    def testOriginalUnchanged(self):
+        index = site_alias_index(NAMES)
+        before = normalise(index)
+        site_alias_index_update(index, [("cms", "CERN", "T0_CH_CERN")], NAMES[:4])
+        self.assertEqual(normalise(index), before)
+
+    def testSameAsRebuild(self):
+        rnd = random.Random(1)
+        universe = NAMES + [("cms", "RAL", "T1_UK_RAL"), ("phedex", "RAL", "T1_UK_RAL_Disk"),
+                            ("lcg", "RAL", "RAL-LCG2"), ("psn", "CERN", "T2_CH_CERN")]
+        current = set(NAMES)
+        index = site_alias_index(NAMES)
+        for _ in xrange(50):
+            removed = rnd.sample(sorted(current), min(len(current), rnd.randint(0, 3)))
+            added = [n for n in rnd.sample(universe, rnd.randint(0, 3))
+                     if n not in current or n in removed]
+            current = (current - set(removed)) | set(added)
+            index = site_alias_index_update(index, added, removed)
+            self.assertEqual(normalise(index), normalise(site_alias_index(current)))
+
+if __name__ == "__main__":
+    unittest.main()
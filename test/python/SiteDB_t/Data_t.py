@@ -0,0 +1,161 @@
+'''
+Unit tests for the data API request handling.
+'''
+import unittest, time
+from operator import itemgetter
+from threading import Thread
+from cherrypy import request, serving
+from WMCore.REST.Server import RESTArgs
+from WMCore.REST.Error import InvalidParameter
+from SiteDB.Cache import ResultCache
+from SiteDB.Data import Data
+from SiteDB_t.FakeDB import FakeConnection, fake_request
+
+SITES = "select name from site order by name"
+
+class TestData(Data):
+    """Data API object with just the result cache, without a server."""
+    def __init__(self):
+        self._cache = ResultCache()
+        self._arraysize = 100
+        self._changetime = 86400
+        self._changesettle = 0
+
+class Data_t(unittest.TestCase):
+
+    def setUp(self):
+        self.api = TestData()
+        self.conn = FakeConnection("create table site (name varchar(100));" +
+                                   "".join("insert into site values ('T%d');" % i
+                                           for i in xrange(10)))
+        fake_request(self.conn)
+
+    def tearDown(self):
+        serving.clear()
+
+    def testSinceRejected(self):
+        for method, apiobj in (("PUT", { "tables": ["site"] }),
+                               ("GET", {}),
+                               ("GET", { "tables": ["site"], "changes": False })):
+            param = RESTArgs([], { "since": "1" })
+            self.assertRaises(InvalidParameter, self.api._dbenter,
+                              apiobj, method, "sites", param, RESTArgs([], {}))
+        for since in ("latest", "1:0"):
+            param = RESTArgs([], { "since": since })
+            self.assertRaises(InvalidParameter, self.api._dbenter,
+                              { "tables": ["site"] }, "GET", "sites", param, RESTArgs([], {}))
+
+    def write(self, sql, *changed):
+        fake_request(self.conn)
+        if changed:
+            self.api.changed("sites", *changed)
+        self.api.execute(sql)
+        self.api.commit()
+
+    def feed(self, since):
+        fake_request(self.conn)
+        request.db.update(tables = ["site"], since = since, feed = ("sites", ["name"]))
+        rows = list(self.api.query(None, itemgetter(0), SITES))
+        preamble = request.rest_generate_preamble
+        return preamble["sequence"], preamble["reset"], rows
+
+    def testFeedReset(self):
+        sequence, reset, rows = self.feed("0")
+        self.assertEqual((sequence, reset, len(rows)), ("0", True, 10))
+        self.assertEqual(rows[0], ["insert", "T0"])
+        self.assertEqual(request.rest_generate_preamble["columns"], ["change", "name"])
+
+    def testFeedChanges(self):
+        self.write("insert into site values ('T10')", "insert", ["T10"])
+        token, reset, rows = self.feed("0")
+        self.assertEqual((token, reset, len(rows)), ("1", True, 11))
+
+        self.write("insert into site values ('T11')", "insert", ["T11"])
+        self.write("delete from site where name = 'T0'", "delete", ["T0"])
+        self.write("insert into site values ('T12')", "insert", ["T12"])
+        self.write("delete from site where name = 'T12'", "delete", ["T12"])
+        self.write("update site set name = name where name = 'T5'", "update", ["T5"])
+        self.assertEqual(self.feed(token), ("6", False, [["insert", "T11"], ["delete", "T0"],
+                                                         ["update", "T5"]]))
+        self.assertEqual(self.feed("6"), ("6", False, []))
+        self.assertEqual(request.rest_generate_preamble["columns"], ["change", "name"])
+
+    def testFeedUnrecorded(self):
+        self.write("insert into site values ('T10')", "insert", ["T10"])
+        self.write("insert into site values ('T11')")
+        self.assertEqual(self.feed("1")[:2], ("2", True))
+        self.write("insert into site values ('T12')", "insert", [])
+        self.assertEqual(self.feed("2")[:2], ("3", True))
+
+    def testFeedUnchanged(self):
+        self.write("insert into site values ('T10')", "insert", ["T10"])
+        self.write("insert into site values ('T11')")
+        self.write("update site set name = name where name = 'T0'", None)
+        self.assertEqual(self.feed("1")[:2], ("3", True))
+        self.assertEqual(self.feed("2"), ("3", False, []))
+
+    def testFeedSettle(self):
+        self.write("insert into site values ('T10')", "insert", ["T10"])
+        self.write("insert into site values ('T11')", "insert", ["T11"])
+        self.api._changesettle = 60
+        self.assertEqual(self.feed("1"), ("1", False, [["insert", "T11"]]))
+
+    def testFeedUnknownToken(self):
+        self.write("insert into site values ('T10')", "insert", ["T10"])
+        self.write("insert into site values ('T11')", "insert", ["T11"])
+        self.assertEqual(self.feed("3")[:2], ("3", True))
+        self.conn.db.execute("delete from change_log where seq = 1")
+        self.conn.db.commit()
+        self.assertEqual(self.feed("1")[:2], ("2", True))
+        self.assertEqual(self.feed("2")[:2], ("2", False))
+
+    def testStreamFillsCache(self):
+        request.db["tables"] = ["site"]
+        rows = self.api.query(None, None, SITES)
+        key = self.api._cachekey(SITES, (), {})
+        self.assertTrue(key in request.db["fills"])
+        self.assertEqual(rows.next(), ("T0",))
+
+        # Another request for the same result waits for this one.
+        waiter = []
+        t = Thread(target = lambda: waiter.append(self.api._cache.acquire("test", key)))
+        t.start()
+        time.sleep(0.1)
+        self.assertEqual(waiter, [])
+
+        self.assertEqual(len(list(rows)), 9)
+        t.join()
+        self.assertEqual(len(waiter[0][0].rows), 10)
+        self.assertEqual(waiter[0][1], None)
+        self.assertEqual(request.db["fills"], {})
+
+    def testStreamAbandoned(self):
+        request.db["tables"] = ["site"]
+        rows = self.api.query(None, None, SITES)
+        rows.next()
+        rows.close()
+        self.assertEqual(request.db["fills"], {})
+        self.assertEqual(self.api.lookup(SITES), None)
+
+    def testStreamBeforeFetched(self):
+        self.api._arraysize = 2
+        request.db["tables"] = ["site"]
+        rows = self.api.query(None, None, SITES)
+        self.assertEqual(rows.next(), ("T0",))
+        self.assertEqual(self.conn.fetched, 2)
+        self.assertEqual(len(list(rows)), 9)
+        self.assertEqual(self.conn.fetched, 10)
+
+    def testStreamTooLargeNotCached(self):
+        self.api._arraysize = 2
+        self.api._cache.maxrows = 5
+        request.db["tables"] = ["site"]
+        rows = self.api.query(None, None, SITES)
+        got = [rows.next() for _ in xrange(6)]
+        self.assertEqual(request.db["fills"], {})
+        got.extend(rows)
+        self.assertEqual(len(got), 10)
+        self.assertEqual(self.api.lookup(SITES), None)
+
+if __name__ == "__main__":
+    unittest.main()
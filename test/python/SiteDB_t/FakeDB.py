@@ -0,0 +1,112 @@
+'''
+In-memory SQLite stand-in for an Oracle database connection, for unit
+tests which exercise the SiteDB database logic without a server.
+'''
+import sqlite3, types, re
+from cherrypy import request, serving
+from cherrypy._cprequest import Request, Response
+from cherrypy.lib import httputil
+
+#: Oracle query allocating several sequence values at once.
+NEXTVALS = re.compile(r"select (\w+)\.nextval from dual connect by level <= :n$")
+
+#: The change log table every SiteDB schema has.
+CHANGE_LOG = """create table change_log (seq integer, ctime real, tbl varchar(100),
+                api varchar(100), item varchar(4000), op varchar(10));"""
+
+class FakeCursor:
+    """Cursor supporting the cx_Oracle prepare/execute(None) protocol."""
+    def __init__(self, conn, owner):
+        self._cursor = conn.cursor()
+        self._owner = owner
+        self._sql = None
+        self.arraysize = 100
+
+    def prepare(self, sql):
+        self._sql = sql
+
+    def execute(self, sql, *binds, **kwbinds):
+        sql = sql or self._sql
+        if sql.lower().startswith("set transaction"):
+            return None
+        m = NEXTVALS.match(sql)
+        if m:
+            first = self._owner.sequences.get(m.group(1), 0) + 1
+            last = self._owner.sequences[m.group(1)] = first + kwbinds["n"] - 1
+            sql = """with recursive s(v) as (select :first union all
+                     select v + 1 from s where v < :last) select v from s"""
+            kwbinds = { "first": first, "last": last }
+        self._cursor.execute(sql, (binds and binds[0]) or kwbinds)
+        return self._cursor.description and self._cursor
+
+    def executemany(self, sql, binds, **kwargs):
+        self._cursor.executemany(sql or self._sql, binds)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchmany(self, n = None):
+        result = self._cursor.fetchmany(n or self.arraysize)
+        self._owner.fetched += len(result)
+        return result
+
+    def fetchall(self):
+        result = self._cursor.fetchall()
+        self._owner.fetched += len(result)
+        return result
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+class FakeConnection:
+    """Connection handing out :class:`FakeCursor` objects. Counts the rows
+    fetched from them in `fetched`. Sequences are emulated in `sequences`."""
+    def __init__(self, schema):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(CHANGE_LOG + schema)
+        self.db.commit()
+        self.fetched = 0
+        self.sequences = {}
+
+    def cursor(self):
+        return FakeCursor(self.db, self)
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+class FakePool:
+    """Connection pool handing out `conn`, rolling back uncommitted changes
+    when it is returned like the real pool does. Counts the connections
+    returned in `released`."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.released = 0
+
+    def get(self, id, module):
+        return { "connection": self.conn, "trace": None }, None
+
+    def put(self, dbh, bad):
+        self.conn.rollback()
+        self.released += 1
+
+def fake_request(conn, instance = "test", **headers):
+    """Set up a request context for the calling thread with database
+    connection `conn` like the server would for a database request."""
+    serving.load(Request(httputil.Host("127.0.0.1", 0), httputil.Host("127.0.0.1", 0)),
+                 Response())
+    request.headers = httputil.HeaderMap()
+    request.headers.update(headers)
+    request.rest_generate_preamble = {}
+    request.db = { "instance": instance, "type": types.ModuleType("cx_Oracle"),
+                   "pool": None, "handle": { "connection": conn, "trace": None },
+                   "last_sql": None, "last_bind": (None, None), "tables": None,
+                   "modified": set(), "since": None, "changed": [], "fills": {},
+                   "idempotency": None }
@@ -0,0 +1,66 @@
+'''
+Unit tests for the cached response payloads.
+'''
+import unittest, zlib, types
+from cherrypy import request, response, serving
+from cherrypy._cprequest import Request, Response
+from cherrypy.lib import httputil
+from WMCore.REST.Format import JSONFormat
+from SiteDB.Cache import CacheEntry
+from SiteDB.Payload import PayloadFormat, PayloadRows
+
+class FakeETag:
+    def update(self, chunk):
+        pass
+
+    def invalidate(self):
+        pass
+
+class Payload_t(unittest.TestCase):
+
+    def setUp(self):
+        self.entry = CacheEntry("q", ["site"], (0,), 0, ["name"],
+                                [("T2_CH_%d" % i,) for i in xrange(1000)], "", 0)
+        self.format = PayloadFormat("application/json", JSONFormat(),
+                                    ["gzip", "deflate"], 9, 1024)
+
+    def tearDown(self):
+        serving.clear()
+
+    def request(self, **headers):
+        serving.load(Request(httputil.Host("127.0.0.1", 0), httputil.Host("127.0.0.1", 0)),
+                     Response())
+        request.headers = httputil.HeaderMap()
+        request.headers.update(headers)
+        request.rest_generate_data = "result"
+        request.rest_generate_preamble = { "columns": ["name"] }
+
+    def body(self, **headers):
+        self.request(**headers)
+        return self.format(PayloadRows(self.entry), FakeETag())
+
+    def testStreamedThenCached(self):
+        first = self.body(**{ "Accept-Encoding": "gzip" })
+        self.assertTrue(isinstance(first, types.GeneratorType))
+        self.assertFalse("Content-Length" in response.headers)
+        self.assertEqual(self.entry.encoded, {})
+        parts = list(first)
+        self.assertTrue(len(parts) > 1)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(self.entry.encoded[("application/json", "gzip")], parts)
+
+        second = self.body(**{ "Accept-Encoding": "gzip" })
+        self.assertEqual(second, parts)
+        self.assertEqual(response.headers["Content-Length"], len("".join(parts)))
+
+        plain = "".join(self.body())
+        self.assertEqual(zlib.decompress("".join(parts), 16 + zlib.MAX_WBITS), plain)
+        self.assertTrue('"T2_CH_999"' in plain)
+
+    def testDeflate(self):
+        parts = list(self.body(**{ "Accept-Encoding": "deflate" }))
+        plain = "".join(self.body())
+        self.assertEqual(zlib.decompress("".join(parts), -zlib.MAX_WBITS), plain)
+
+if __name__ == "__main__":
+    unittest.main()
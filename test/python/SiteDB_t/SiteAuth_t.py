@@ -0,0 +1,90 @@
+'''
+Unit tests for the authorisation checks.
+'''
+import unittest, itertools
+import cherrypy
+from cherrypy import request, serving
+from cherrypy._cprequest import Request, Response
+from cherrypy.lib import httputil
+from SiteDB.SiteAuth import authz_match, oldsite_authz_match, oldsite_authz_batch
+
+#: Site name translations, old site name to CMS names.
+SITES = { "CERN": ["T1_CH_CERN", "T2_CH_CERN"], "FNAL": ["T1_US_FNAL"],
+          "RAL": ["T1_UK_RAL"], "Nowhere": [] }
+
+#: Users with various roles.
+USERS = [
+  {},
+  { "global-admin": { "group": ["global"], "site": [] } },
+  { "site-admin": { "group": [], "site": ["t1-ch-cern"] } },
+  { "site-admin": { "group": [], "site": ["t2-ch-cern", "t1-us-fnal"] },
+    "data-manager": { "group": [], "site": ["t1-uk-ral"] } },
+  { "operator": { "group": ["sitedb"], "site": ["t1-us-fnal"] } },
+]
+
+#: Requirements as (role, group) pairs.
+REQUIREMENTS = [
+  ([], []), (["Site Admin"], []), (["Global Admin"], ["global"]),
+  (["Site Admin", "Data Manager"], []), (["Operator"], ["SiteDB"]),
+  ([], ["global"]), (["Global Admin"], []),
+]
+
+class SiteAuth_t(unittest.TestCase):
+
+    def setUp(self):
+        cherrypy.log.screen = False
+
+    def tearDown(self):
+        serving.clear()
+        cherrypy.log.screen = None
+
+    def login(self, roles):
+        serving.load(Request(httputil.Host("127.0.0.1", 0), httputil.Host("127.0.0.1", 0)),
+                     Response())
+        request.user = { "login": "test", "dn": "/CN=test", "name": "Test",
+                         "method": "X509Cert", "roles": roles }
+
+    def allowed(self, check, *args, **kwargs):
+        try:
+            check(*args, **kwargs)
+            return True
+        except cherrypy.HTTPError as e:
+            self.assertEqual(e.status, 403)
+            return False
+
+    def testMatch(self):
+        self.login(USERS[2])
+        self.assertTrue(self.allowed(authz_match, role=["Site Admin"], site=["T1_CH_CERN"]))
+        self.assertFalse(self.allowed(authz_match, role=["Site Admin"], site=["T2_CH_CERN"]))
+        self.assertFalse(self.allowed(authz_match, role=["Global Admin"]))
+        self.assertTrue(self.allowed(authz_match))
+
+    def testOldSite(self):
+        self.login(USERS[3])
+        self.assertTrue(self.allowed(oldsite_authz_match, None, SITES,
+                                     role=["Site Admin"], site=["CERN"]))
+        self.assertFalse(self.allowed(oldsite_authz_match, None, SITES,
+                                      role=["Site Admin"], site=["RAL"]))
+
+    def testBatchSameAsEachSite(self):
+        names = sorted(SITES) + ["Unknown"]
+        sitelists = [list(c) for n in (1, 2, 3) for c in itertools.combinations(names, n)]
+        for roles, (role, group), site in itertools.product(USERS, REQUIREMENTS, sitelists):
+            self.login(roles)
+            expect = all(self.allowed(oldsite_authz_match, None, SITES, role, group, [s])
+                         for s in site)
+            self.login(roles)
+            got = self.allowed(oldsite_authz_batch, None, SITES, role, group, site + site)
+            self.assertEqual(got, expect, (roles, role, group, site))
+
+    def testBatchListsDenied(self):
+        self.login(USERS[2])
+        try:
+            oldsite_authz_batch(None, SITES, role=["Site Admin"], site=["FNAL", "CERN", "RAL"])
+            self.fail("expected 403")
+        except cherrypy.HTTPError as e:
+            self.assertEqual(e.status, 403)
+            self.assertTrue("sites FNAL, RAL." in e._message)
+
+if __name__ == "__main__":
+    unittest.main()